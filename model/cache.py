@@ -0,0 +1,188 @@
+"""
+Memoized model operators.
+
+The operators are keyed by a hash of their arguments by content, so that a
+DDist is the same key as any other DDist with the same bounds and pmfs:
+
+    from model import cache
+    ddist = cache.discretize(('lognorm', -1, {'mu' : 4, 'sigma' : 0.5}), h=0.5)
+    res, delay, rtrip = cache.getSLPLatencyDist(5, ddist, 0.01)
+
+The results are kept in memory, and with setDir(path) also pickled to a file
+for each key under path, so that the next run reuses them.
+
+The key also covers MODEL_VERSION, a hash of the sources of the modules the
+operators come from, so results pickled by older models are not reused.
+"""
+
+import cPickle
+import hashlib
+import os
+
+import numpy as np
+
+import ddist
+import protocol
+import rintvl
+from ddist import DDist
+
+def sourceVersion(modules):
+    """Hash of the source files of @modules."""
+    sha = hashlib.sha1()
+    for module in modules:
+        fh = open('%s.py'%os.path.splitext(module.__file__)[0], 'rb')
+        sha.update(fh.read())
+        fh.close()
+    return sha.hexdigest()
+
+#part of every key, changes with the code of the operators
+MODEL_VERSION = sourceVersion([ddist, protocol, rintvl])
+
+def _canonical(value):
+    if isinstance(value, DDist):
+        return ('DDist', repr(value.lb), repr(value.h), repr(value.th),
+                value.pmfy.tostring(), value.tpmfy.tostring(),
+                value.maxBins, repr(value.error))
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.dtype.str, value.shape, value.tostring())
+    if isinstance(value, dict):
+        return ('dict', sorted([(_canonical(k), _canonical(v))
+                                for k, v in value.iteritems()]))
+    if isinstance(value, (list, tuple)):
+        return ('seq', [_canonical(v) for v in value])
+    if isinstance(value, float):
+        return repr(value)
+    return value
+
+def cacheKey(name, args, kwargs={}):
+    """Content hash of an operator call, equal for equal values."""
+    items = (MODEL_VERSION, name, _canonical(args), _canonical(kwargs))
+    return hashlib.sha1(repr(items)).hexdigest()
+
+class OpCache(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def setDir(self, path):
+        """Persist the results as pickle files under @path."""
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+
+    def _fn(self, key):
+        return os.path.join(self.path, '%s.pkl'%key)
+
+    def call(self, name, func, *args, **kwargs):
+        key = cacheKey(name, args, kwargs)
+        if key in self.values:
+            self.hits += 1
+            return self.values[key]
+        if self.path is not None and os.path.exists(self._fn(key)):
+            self.hits += 1
+            fh = open(self._fn(key), 'rb')
+            value = cPickle.load(fh)
+            fh.close()
+            self.values[key] = value
+            return value
+        self.misses += 1
+        value = func(*args, **kwargs)
+        self.values[key] = value
+        if self.path is not None:
+            #write aside and rename, so that a killed run leaves no partial file
+            tmpfn = '%s.%s'%(self._fn(key), os.getpid())
+            fh = open(tmpfn, 'wb')
+            cPickle.dump(value, fh, cPickle.HIGHEST_PROTOCOL)
+            fh.close()
+            os.rename(tmpfn, self._fn(key))
+        return value
+
+    def clear(self):
+        self.values = {}
+
+CACHE = OpCache()
+
+def setDir(path):
+    CACHE.setDir(path)
+
+def memoize(name, func):
+    def wrapper(*args, **kwargs):
+        return CACHE.call(name, func, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+sample = memoize('DDist.sample', DDist.sample)
+discretize = memoize('DDist.discretize', DDist.discretize)
+quorum = memoize('quorum', protocol.quorum)
+oodelay = memoize('oodelay', protocol.oodelay)
+getSLPLatencyDist = memoize('getSLPLatencyDist', protocol.getSLPLatencyDist)
+getEPLatencyDist = memoize('getEPLatencyDist', protocol.getEPLatencyDist)
+
+#####  TEST  #####
+def testKey():
+    print '===== test key ====='
+    x = np.random.normal(100, 20, 10000)
+    ddist1 = DDist.create(x, h=0.5)
+    ddist2 = DDist.create(x, h=0.5)
+    assert ddist1 is not ddist2
+    assert cacheKey('quorum', (5, 2, ddist1)) == \
+            cacheKey('quorum', (5, 2, ddist2))
+    assert cacheKey('quorum', (5, 2, ddist1)) != \
+            cacheKey('quorum', (5, 1, ddist1))
+    assert cacheKey('quorum', (5, 2, ddist1)) != \
+            cacheKey('quorum', (5, 2, DDist.create(x + 1, h=0.5)))
+    assert cacheKey('f', ({'a' : 1, 'b' : 2},)) == \
+            cacheKey('f', ({'b' : 2, 'a' : 1},))
+    assert cacheKey('f', (1,)) != cacheKey('g', (1,))
+    print 'test key passed'
+
+def testCache():
+    print '===== test cache ====='
+    import shutil
+    import tempfile
+    path = tempfile.mkdtemp()
+    try:
+        calls = []
+        def op(ddist, n):
+            calls.append(n)
+            return ddist.orderStat(n, n)
+        x = np.random.normal(100, 20, 10000)
+        ddist = DDist.create(x, h=0.5)
+        cache = OpCache()
+        cache.setDir(path)
+        ret1 = cache.call('op', op, ddist, 3)
+        ret2 = cache.call('op', op, DDist.create(x, h=0.5), 3)
+        assert ret1 is ret2 and calls == [3]
+        #a new run reads the pickled result
+        cache = OpCache(path)
+        ret3 = cache.call('op', op, ddist, 3)
+        assert calls == [3] and cache.hits == 1
+        assert np.array_equal(ret1.pmfy, ret3.pmfy)
+        cache.call('op', op, ddist, 4)
+        assert calls == [3, 4] and cache.misses == 1
+        #the results of an older model are not reused
+        global MODEL_VERSION
+        version = MODEL_VERSION
+        MODEL_VERSION = sourceVersion([protocol])
+        try:
+            cache = OpCache(path)
+            cache.call('op', op, ddist, 3)
+            assert calls == [3, 4, 3] and cache.misses == 1
+        finally:
+            MODEL_VERSION = version
+    finally:
+        shutil.rmtree(path)
+    print 'test cache passed'
+
+def test():
+    testKey()
+    testCache()
+
+def main():
+    test()
+
+if __name__ == '__main__':
+    main()
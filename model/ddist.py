@@ -5,11 +5,29 @@ import numpy as np
 #    import matplotlib
 #    matplotlib.use('pdf')
 import matplotlib.pylab as plt
+from scipy.misc import comb
+from scipy.stats import binom, expon, lognorm, norm, pareto, uniform
 
 from rintvl import RandInterval
 
+#below this length np.convolve is faster than fft
+FFT_MIN_LEN = 64
+#default bound on the intervals of the analyses, see DDist.coarsen
+MAX_BINS = 2000
+
+def convolve(a, b):
+    """Full convolution of arrays @a and @b, by fft for long ones."""
+    if min(len(a), len(b)) < FFT_MIN_LEN:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    c = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+    #round off errors of fft can be negative
+    return np.maximum(c, 0.0)
+
 class DDist(object):
-    def __init__(self, lb, pmfy, h=0.1, tpmfy=[], th=0.5):
+    def __init__(self, lb, pmfy, h=0.1, tpmfy=[], th=0.5,
+                 maxBins=None, error=0.0):
         """A discretized distribution.
 
         @args:
@@ -20,20 +38,30 @@ class DDist(object):
             tpmfy   --  tail pmf with the variable taken values
                         lb + (len(pmfy) - 1) * self.h + i * self.th.
             th      --  tail interval.
+            maxBins --  if not None, the results of operations with more
+                        intervals are re-binned to coarser ones.
+            error   --  a bound of the wasserstein-1 distance to the
+                        distribution without re-binning.
+
+        The pmfs and cmfs are kept as numpy arrays.
 
         """
         #bounds
         #[_lb, _tb) and [_tb, _ub)
         self.h = float(h)
-        self.th = floor(th / h) * h
-        self.lb = floor(lb / h) * h
+        #sums of bounds are off the grid by round off errors
+        self.th = floor(th / h + 1e-9) * h
+        self.lb = floor(lb / h + 1e-9) * h
         self.tb = self.lb + len(pmfy) * self.h
         self.ub = self.tb + len(tpmfy) * self.th
         #pmf and cmf
-        self.pmfy = pmfy
+        self.pmfy = np.asarray(pmfy, dtype=float)
         self.cmfy = None
-        self.tpmfy = tpmfy
+        self.tpmfy = np.asarray(tpmfy, dtype=float)
         self.tcmfy = None
+        #re-binning
+        self.maxBins = maxBins
+        self.error = error
         #mean and std
         self._mean = None
         self._std = None
@@ -41,40 +69,48 @@ class DDist(object):
         self.calcCmf()
 
     def calcCmf(self):
-        self.cmfy = [self.pmfy[0]]
-        for i in range(1, len(self.pmfy)):
-            self.cmfy.append(self.cmfy[i - 1] + self.pmfy[i])
+        self.cmfy = np.cumsum(self.pmfy)
         if len(self.tpmfy) != 0:
-            self.tcmfy = [self.cmfy[-1] + self.tpmfy[0]]
-            for i in range(1, len(self.tpmfy)):
-                self.tcmfy.append(self.tcmfy[i - 1] + self.tpmfy[i])
+            self.tcmfy = self.cmfy[-1] + np.cumsum(self.tpmfy)
         else:
-            self.tcmfy = []
+            self.tcmfy = np.zeros(0)
 
     def pmf(self, x):
-        if x < self._lb:
+        if x < self.lb:
             return 0
-        elif x < self._tb:
-            i = int(floor((x - self._lb) / self.h))
+        elif x < self.tb:
+            i = int(floor((x - self.lb) / self.h))
             return self.pmfy[i]
-        elif x < self._ub:
-            i = int(floor((x - self._tb) / self.th))
+        elif x < self.ub:
+            i = int(floor((x - self.tb) / self.th))
             return self.tpmfy[i]
         else:
             return 0
 
     def cmf(self, x):
-        if x < self._lb:
+        if x < self.lb:
             return 0
-        elif x < self._tb:
-            i = int(floor((x - self._lb) / self.h))
+        elif x < self.tb:
+            i = int(floor((x - self.lb) / self.h))
             return self.cmfy[i]
-        elif x < self._ub:
-            i = int(floor((x - self._tb) / self.th))
+        elif x < self.ub:
+            i = int(floor((x - self.tb) / self.th))
             return self.tcmfy[i]
         else:
             return 1
 
+    def cmfv(self, x):
+        """The cmf at each value of array @x."""
+        x = np.asarray(x, dtype=float)
+        i = np.clip(np.floor((x - self.lb) / self.h).astype(int),
+                    0, max(self.llen - 1, 0))
+        ret = np.where(x < self.lb, 0.0, self.cmfy[i])
+        if self.tlen != 0:
+            j = np.clip(np.floor((x - self.tb) / self.th).astype(int),
+                        0, self.tlen - 1)
+            ret = np.where(x >= self.tb, self.tcmfy[j], ret)
+        return np.where(x >= self.ub, 1.0, ret)
+
     @property
     def llen(self):
         return len(self.pmfy)
@@ -83,108 +119,170 @@ class DDist(object):
     def tlen(self):
         return len(self.tpmfy)
 
+    @property
+    def tnh(self):
+        """The number of head intervals in a tail interval."""
+        return int((self.th + 0.5 * self.h) / self.h)
+
+    def getPmfx(self):
+        return np.concatenate((self.lb + np.arange(self.llen) * self.h,
+                               self.tb + np.arange(self.tlen) * self.th))
+
     @property
     def mean(self):
         if self._mean is None:
-            self._mean = 0
-            for i, p in enumerate(self.pmfy):
-                self._mean += (self.lb + i * self.h) * p
-            for i, p in enumerate(self.tpmfy):
-                self._mean += (self.tb + i * self.th) * p
+            x = self.getPmfx()
+            y = np.concatenate((self.pmfy, self.tpmfy))
+            self._mean = float(np.dot(x, y))
         return self._mean
 
     @property
     def std(self):
         if self._std is None:
-            mean = self.mean
-            self._std = 0
-            for i, p in enumerate(self.pmfy):
-                value = self.lb + i * self.h
-                self._std += (value - mean)**2 * p
-            for i, p in enumerate(self.tpmfy):
-                value = self.tb + i * self.th
-                self._std += (value - mean)**2 * p
-            self._std = np.sqrt(self._std)
+            x = self.getPmfx()
+            y = np.concatenate((self.pmfy, self.tpmfy))
+            self._std = np.sqrt(np.dot((x - self.mean)**2, y))
         return self._std
 
     @property
     def var(self):
         return self.std ** 2
 
-    def __add__(self, ddist):
-        if not isinstance(ddist, DDist):
-            raise TypeError('%s is not of DDist type'%ddist)
-        if self.h != ddist.h or self.th != ddist.th:
+    def getFinePmfy(self):
+        """The pmf on the head interval from lb to ub.
+
+        The probability of a tail interval is at its start.
+
+        """
+        fine = np.zeros(self.llen + self.tlen * self.tnh)
+        fine[:self.llen] = self.pmfy
+        fine[self.llen::self.tnh] = self.tpmfy
+        return fine
+
+    def getFineCmfy(self):
+        """The cmf on the head interval from lb to ub."""
+        return np.concatenate((self.cmfy, np.repeat(self.tcmfy, self.tnh)))
+
+    @property
+    def numBins(self):
+        return self.llen + self.tlen
+
+    def rebin(self, factor):
+        """Merge every @factor intervals into one, head and tail.
+
+        The mass moves down to the start of the merged interval, and the mean
+        move is added to the error.
+
+        """
+        if factor == 1:
+            return self
+        h = self.h * factor
+        tnh = self.tnh
+        #the fine intervals before lb in the first merged one
+        li = int(floor(self.lb / h + 1e-9))
+        offset = int(round(self.lb / self.h)) - li * factor
+        fine = np.concatenate((np.zeros(offset), self.getFinePmfy()))
+        llen = int(ceil(float(offset + self.llen) / factor))
+        head = llen * factor
+        step = tnh * factor
+        tlen = int(ceil(float(max(len(fine) - head, 0)) / step))
+        fine = np.concatenate((fine, np.zeros(head + tlen * step - len(fine))))
+        index = np.arange(len(fine))
+        bins = np.where(index < head, index / factor,
+                        llen + (index - head) / step)
+        starts = np.where(bins < llen, bins * factor,
+                          head + (bins - llen) * step)
+        pmfy = np.bincount(bins, weights=fine, minlength=llen + tlen)
+        moved = np.dot(fine, index - starts) * self.h
+        return DDist(li * h, pmfy[:llen], h, pmfy[llen:], tnh * h,
+                     maxBins=self.maxBins, error=self.error + moved)
+
+    def coarsen(self):
+        """Re-bin until there are at most maxBins intervals."""
+        ret = self
+        while ret.maxBins is not None and ret.numBins > ret.maxBins:
+            ret = ret.rebin(int(ceil(float(ret.numBins) / ret.maxBins)))
+        return ret
+
+    def _align(self, ddist):
+        #re-bin the finer one if the intervals are multiples
+        if self.h > ddist.h:
+            other, this = ddist._align(self)
+            return this, other
+        ratio = ddist.h / self.h
+        factor = int(round(ratio))
+        if abs(ratio - factor) > 1e-9 or self.tnh != ddist.tnh:
             raise ValueError(
                 'DDists must have the same sample rate to add: '
                 'self.h:%s, ddist.h:%s, self.th:%s, ddist.th:%s'
                 %(self.h, ddist.h, self.th, ddist.th))
+        return self.rebin(factor), ddist
+
+    def __add__(self, ddist):
+        if not isinstance(ddist, DDist):
+            raise TypeError('%s is not of DDist type'%ddist)
+        this, other = self, ddist
+        if self.h != ddist.h or self.th != ddist.th:
+            this, other = self._align(ddist)
         #bounds and intervals
         #the addition bounds are set to:
         #   [lb1 + lb2, tb1 + tb2), [tb1 + tb2, ub1 + ub2)
-        lb = self.lb + ddist.lb
-        tb = self.tb + ddist.tb
-        ub = self.ub + ddist.ub
-        tnh = int((self.th + 0.5 * self.h) / self.h)
-        #print 'bounds', lb, tb, ub, tnh
-        #compute the front part
-        n = self.llen + ddist.llen
-        pmfy = [0.0] * n
-        for i in range(self.llen):
-            for j in range(ddist.llen):
-                pmfy[i + j] += self.pmfy[i] * ddist.pmfy[j]
-        for i in range(self.llen):
-            end = min(ddist.tlen, (n - i - 1 - ddist.llen) / tnh + 1)
-            for j in range(end):
-                k = i + ddist.llen + j * tnh
-                pmfy[k] += self.pmfy[i] * ddist.tpmfy[j]
-        for i in range(ddist.llen):
-            end = min(self.tlen, (n - i - 1 - self.llen) / tnh + 1)
-            for j in range(end):
-                k = i + self.llen + j * tnh
-                pmfy[k] += ddist.pmfy[i] * self.tpmfy[j]
-        #print 'pmfy', pmfy
-        #compute the tail part
-        tn = self.tlen + ddist.tlen
-        tpmfy = [0.0] * tn
-        for i in range(self.tlen):
-            start = max(0, ddist.llen - i * tnh)
-            for j in range(start, ddist.llen):
-                n = i + int(floor(float(j - ddist.llen) / tnh))
-                tpmfy[n] += self.tpmfy[i] * ddist.pmfy[j]
-        for i in range(ddist.tlen):
-            start = max(0, self.llen - i * tnh)
-            for j in range(start, self.llen):
-                n = i + int(floor(float(j - ddist.llen) / tnh))
-                tpmfy[n] += ddist.tpmfy[i] * self.pmfy[j]
-        for i in range(self.tlen):
-            for j in range(ddist.tlen):
-                tpmfy[i + j] += self.tpmfy[i] * self.tpmfy[j]
-        #print 'tpmfy', tpmfy
-        #return
-        return DDist(lb, pmfy, h=self.h, tpmfy=tpmfy, th=self.th)
+        lb = this.lb + other.lb
+        tnh = this.tnh
+        #convolve on the head interval, then sum the tail back into bins
+        n = this.llen + other.llen
+        tn = this.tlen + other.tlen
+        #the sum of the last values is in the next interval, which is empty
+        fine = np.zeros(n + tn * tnh)
+        conv = convolve(this.getFinePmfy(), other.getFinePmfy())
+        fine[:len(conv)] = conv
+        pmfy = fine[:n]
+        tpmfy = np.zeros(tn)
+        if tn != 0:
+            tail = fine[n:]
+            tpmfy[:] = np.bincount(np.arange(len(tail)) / tnh,
+                                   weights=tail, minlength=tn)
+        #the coupled sums are off by at most the sum of the errors
+        ret = DDist(lb, pmfy, h=this.h, tpmfy=tpmfy, th=this.th,
+                    maxBins=min(this.maxBins or other.maxBins,
+                                other.maxBins or this.maxBins),
+                    error=this.error + other.error)
+        return ret.coarsen()
+
+    def orderStat(self, k, n):
+        """The distribution of the @k-th smallest of @n iid samples.
+
+        At x, it is the probability that at least k of the samples are no
+        larger than x, i.e. the binomial survival function at k - 1. With
+        k = 0 no sample is needed, so all the mass is at lb.
+
+        """
+        if not 0 <= k <= n:
+            raise ValueError('order k = %s not in [0, %s]'%(k, n))
+        #round off errors may take a cmf over 1, where sf is nan
+        cmfy = np.clip(self.cmfy, 0, 1)
+        tcmfy = np.clip(self.tcmfy, 0, 1)
+        #an order statistic moves by at most the largest sample move
+        return DDist.fromCmf(self.lb, binom.sf(k - 1, n, cmfy),
+                             self.h, binom.sf(k - 1, n, tcmfy), self.th,
+                             maxBins=self.maxBins, error=n * self.error)
+
+    @classmethod
+    def fromCmf(cls, lb, cmfy, h=0.1, tcmfy=[], th=0.5,
+                maxBins=None, error=0.0):
+        """Create a ddist from the values of its cmf."""
+        cmfy = np.asarray(cmfy, dtype=float)
+        tcmfy = np.asarray(tcmfy, dtype=float)
+        pmfy = np.diff(cmfy)
+        pmfy = np.insert(pmfy, 0, cmfy[0])
+        tpmfy = np.diff(np.insert(tcmfy, 0, cmfy[-1]))
+        return DDist(lb, pmfy, h, tpmfy, th, maxBins=maxBins, error=error)
 
     def getPmfxy(self):
-        x = []
-        y = []
-        for i, p in enumerate(self.pmfy):
-            x.append(self.lb + i * self.h)
-            y.append(p)
-        for i, p in enumerate(self.tpmfy):
-            x.append(self.tb + i * self.th)
-            y.append(p)
-        return x, y
+        return self.getPmfx(), np.concatenate((self.pmfy, self.tpmfy))
 
     def getCmfxy(self):
-        x = []
-        y = []
-        for i, p in enumerate(self.cmfy):
-            x.append(self.lb + i * self.h)
-            y.append(p)
-        for i, p in enumerate(self.tcmfy):
-            x.append(self.tb + i * self.th)
-            y.append(p)
-        return x, y
+        return self.getPmfx(), np.concatenate((self.cmfy, self.tcmfy))
 
     def plot(self, outfn):
         fig = plt.figure()
@@ -197,71 +295,255 @@ class DDist(object):
         fig.savefig('%s'%outfn)
 
     @classmethod
-    def sample(cls, config, h=0.1, tail=('p', 0), tnh=1, num=100000):
-        try:
-            key, mean, cfg = config
-        except:
-            key, mean = config
-            cfg = {}
+    def sample(cls, config, h=0.1, tail=('p', 0), tnh=1, num=100000,
+               maxBins=None):
+        key, mean, cfg = _splitConfig(config)
         x = RandInterval.generate(key, mean, cfg, num)
-        return cls.create(x, h, tail, tnh)
+        return cls.create(x, h, tail, tnh, maxBins)
+
+    @classmethod
+    def discretize(cls, config, h=0.1, tail=('p', 0), tnh=1, maxBins=None,
+                   eps=1e-6):
+        """Create a ddist from the cdf of a RandInterval config.
+
+        The probability of an interval is the difference of the cdf at its
+        ends, so no sampling is needed. The cdf is cut at the @eps and
+        1 - @eps quantiles, and the cut mass goes to the first and last
+        intervals.
+
+        @options:
+            see DDist.create
+
+        """
+        key, mean, cfg = _splitConfig(config)
+        if key == 'fixed' or (key == 'norm' and cfg.get('sigma', 0) == 0):
+            return cls.create([mean], h, tail, tnh, maxBins)
+        if key == 'ddist':
+            return cls.create(cfg['values'], h, tail, tnh, maxBins,
+                              weights=cfg['probs'])
+        dist, lb, ub = CDFS[key](mean, cfg)
+        #the cdf conditioned on [lb, ub], as RandInterval redraws outside
+        flb, fub = dist.cdf(lb), dist.cdf(ub)
+        lo = max(lb, dist.ppf(flb + eps * (fub - flb)))
+        hi = min(ub, dist.ppf(fub - eps * (fub - flb)))
+        li = int(floor(lo / h))
+        ui = int(floor(hi / h))
+        #the cmf of each interval is the cdf at its right end
+        cmfy = (dist.cdf((li + 1 + np.arange(ui - li + 1)) * h) - flb) / \
+                (fub - flb)
+        cmfy = np.clip(cmfy, 0, 1)
+        cmfy[-1] = 1.0
+        spmf = np.diff(np.insert(cmfy, 0, 0.0))
+        return cls._fromFinePmf(li * h, spmf, h, tail, tnh, maxBins)
 
     @classmethod
-    def create(cls, samples, h=0.1, tail=('p', 0), tnh=1):
+    def create(cls, samples, h=0.1, tail=('p', 0), tnh=1, maxBins=None,
+               weights=None):
         """Create a ddist from sample.
 
         @options:
             tail = ('p', probability) or ('b', bound)
+            maxBins, see DDist.__init__
+            weights, of the samples if not all equal
 
         """
-        li = int(floor(min(samples) / h))
-        ui = int(floor(max(samples) / h))
-        lb = li * h
-        ub = ui * h
-        spmf = [0.0] * (ui - li + 1)
-        for x in samples:
-            i = int(floor(x / h)) - li
-            spmf[i] += 1
-        #normalize
-        for i in range(len(spmf)):
-            spmf[i] /= len(samples)
-        #print 'spmf', spmf
-        scmf = [spmf[0]]
-        for i in range(1, len(spmf)):
-            scmf.append(scmf[i - 1] + spmf[i])
-        #print 'scmf', scmf
-        #compute tail
+        samples = np.asarray(samples, dtype=float)
+        bins = np.floor(samples / h).astype(int)
+        li = int(bins.min())
+        ui = int(bins.max())
+        spmf = np.bincount(bins - li, weights=weights, minlength=ui - li + 1)
+        if weights is None:
+            spmf = spmf / float(len(samples))
+        else:
+            spmf = spmf / float(np.sum(weights))
+        return cls._fromFinePmf(li * h, spmf, h, tail, tnh, maxBins)
+
+    @classmethod
+    def _fromFinePmf(cls, lb, spmf, h, tail, tnh, maxBins):
+        #split the pmf on h intervals into the head and tail
+        ub = lb + (len(spmf) - 1) * h
         if (tail[0] == 'p' and tail[1] == 0) or \
            (tail[0] == 'b' and tail[1] >=ub) or \
            tnh == 1:
-            return DDist(lb, spmf, h, [], h)
+            return DDist(lb, spmf, h, [], h, maxBins=maxBins).coarsen()
         else:
             th = tnh * h
             if tail[0] == 'p':
                 tailprob = tail[1]
-                p = 0
-                n = 0
-                for i in range(len(spmf)):
-                    p += spmf[i]
-                    if p >= 1 - tailprob:
-                        break
-                    n += 1
+                #the first position with cmf >= 1 - tailprob
+                n = int(np.searchsorted(np.cumsum(spmf), 1 - tailprob))
                 #find the next position that mod th == 0
                 tb = ceil(float(lb + n * h) / th) * th
             elif tail[0] == 'b':
                 tb = ceil(float(tail[1] / th) * th)
             else:
                 raise ValueError('Unknown tail option %s'%tail[0])
-            n = int((tb - lb) / h)
-            pmf = list(spmf[0 : n])
+            #the head has at least the lb interval
+            n = max(int((tb - lb) / h), 1)
+            pmf = spmf[0 : n]
             tlen = (len(spmf) - 1 - n) / tnh + 1
-            tpmf = [0.0] * tlen
-            for i in range(n, len(spmf)):
-                k = (i - n) / tnh
-                tpmf[k] += spmf[i]
-            return DDist(lb, pmf, h, tpmf, th)
+            tpmf = np.bincount(np.arange(len(spmf) - n) / tnh,
+                               weights=spmf[n:], minlength=tlen)
+            return DDist(lb, pmf, h, tpmf, th, maxBins=maxBins).coarsen()
+
+def _splitConfig(config):
+    try:
+        key, mean, cfg = config
+    except:
+        key, mean = config
+        cfg = {}
+    return key, mean, cfg
+
+#the frozen scipy distribution of RandInterval configs and the bounds they
+#are truncated to
+CDFS = {
+    'expo' : lambda mean, cfg: (
+        expon(scale=mean), cfg.get('lb', 0), cfg.get('ub', np.inf)),
+    'norm' : lambda mean, cfg: (
+        norm(mean, cfg['sigma']), cfg.get('lb', 0), cfg.get('ub', np.inf)),
+    'uniform' : lambda mean, cfg: (
+        uniform(cfg.get('lb', 0), cfg['ub'] - cfg.get('lb', 0)),
+        cfg.get('lb', 0), cfg['ub']),
+    'lognorm' : lambda mean, cfg: (
+        lognorm(cfg['sigma'], scale=np.exp(cfg['mu'])),
+        cfg.get('lb', 0), cfg.get('ub', np.inf)),
+    'pareto' : lambda mean, cfg: (
+        pareto(cfg['a'], loc=cfg.get('lb', 0)),
+        cfg.get('lb', 0), cfg.get('ub', np.inf)),
+}
 
 #####  TEST  #####
+def _baselineAdd(ddist1, ddist2):
+    #the loops of DDist.__add__ as they were, bugs included
+    lb = ddist1.lb + ddist2.lb
+    tnh = int((ddist1.th + 0.5 * ddist1.h) / ddist1.h)
+    n = ddist1.llen + ddist2.llen
+    pmfy = [0.0] * n
+    for i in range(ddist1.llen):
+        for j in range(ddist2.llen):
+            pmfy[i + j] += ddist1.pmfy[i] * ddist2.pmfy[j]
+    for i in range(ddist1.llen):
+        end = min(ddist2.tlen, (n - i - 1 - ddist2.llen) / tnh + 1)
+        for j in range(end):
+            k = i + ddist2.llen + j * tnh
+            pmfy[k] += ddist1.pmfy[i] * ddist2.tpmfy[j]
+    for i in range(ddist2.llen):
+        end = min(ddist1.tlen, (n - i - 1 - ddist1.llen) / tnh + 1)
+        for j in range(end):
+            k = i + ddist1.llen + j * tnh
+            pmfy[k] += ddist2.pmfy[i] * ddist1.tpmfy[j]
+    tn = ddist1.tlen + ddist2.tlen
+    tpmfy = [0.0] * tn
+    for i in range(ddist1.tlen):
+        start = max(0, ddist2.llen - i * tnh)
+        for j in range(start, ddist2.llen):
+            k = i + int(floor(float(j - ddist2.llen) / tnh))
+            tpmfy[k] += ddist1.tpmfy[i] * ddist2.pmfy[j]
+    for i in range(ddist2.tlen):
+        start = max(0, ddist1.llen - i * tnh)
+        for j in range(start, ddist1.llen):
+            k = i + int(floor(float(j - ddist2.llen) / tnh))
+            tpmfy[k] += ddist2.tpmfy[i] * ddist1.pmfy[j]
+    for i in range(ddist1.tlen):
+        for j in range(ddist2.tlen):
+            tpmfy[i + j] += ddist1.tpmfy[i] * ddist1.tpmfy[j]
+    return DDist(lb, pmfy, h=ddist1.h, tpmfy=tpmfy, th=ddist1.th)
+
+def _loopAdd(ddist1, ddist2):
+    """The loops of _baselineAdd with two bug fixes, for regression.
+
+    The tail of the second operand is offset by the head length of the first
+    one, not of the second one, and the tail by tail product is of the two
+    operands, not of the first one with itself. Both only matter when the
+    operands differ.
+
+    """
+    lb = ddist1.lb + ddist2.lb
+    tnh = int((ddist1.th + 0.5 * ddist1.h) / ddist1.h)
+    n = ddist1.llen + ddist2.llen
+    pmfy = [0.0] * n
+    for i in range(ddist1.llen):
+        for j in range(ddist2.llen):
+            pmfy[i + j] += ddist1.pmfy[i] * ddist2.pmfy[j]
+    for i in range(ddist1.llen):
+        end = min(ddist2.tlen, (n - i - 1 - ddist2.llen) / tnh + 1)
+        for j in range(end):
+            k = i + ddist2.llen + j * tnh
+            pmfy[k] += ddist1.pmfy[i] * ddist2.tpmfy[j]
+    for i in range(ddist2.llen):
+        end = min(ddist1.tlen, (n - i - 1 - ddist1.llen) / tnh + 1)
+        for j in range(end):
+            k = i + ddist1.llen + j * tnh
+            pmfy[k] += ddist2.pmfy[i] * ddist1.tpmfy[j]
+    tn = ddist1.tlen + ddist2.tlen
+    tpmfy = [0.0] * tn
+    for i in range(ddist1.tlen):
+        start = max(0, ddist2.llen - i * tnh)
+        for j in range(start, ddist2.llen):
+            k = i + int(floor(float(j - ddist2.llen) / tnh))
+            tpmfy[k] += ddist1.tpmfy[i] * ddist2.pmfy[j]
+    for i in range(ddist2.tlen):
+        start = max(0, ddist1.llen - i * tnh)
+        for j in range(start, ddist1.llen):
+            k = i + int(floor(float(j - ddist1.llen) / tnh))
+            tpmfy[k] += ddist2.tpmfy[i] * ddist1.pmfy[j]
+    for i in range(ddist1.tlen):
+        for j in range(ddist2.tlen):
+            tpmfy[i + j] += ddist1.tpmfy[i] * ddist2.tpmfy[j]
+    return DDist(lb, pmfy, h=ddist1.h, tpmfy=tpmfy, th=ddist1.th)
+
+def testAddRegression():
+    print '===== test add regression ====='
+    cases = [
+        (DDist.create(np.random.normal(10, 3, 10000), h=0.1),
+         DDist.create(np.random.normal(20, 5, 10000), h=0.1)),
+        (DDist.create(np.random.normal(10, 3, 10000), h=0.1,
+                      tail=('p', 0.1), tnh=5),
+         DDist.create(np.random.pareto(1.3, 10000) + 10, h=0.1,
+                      tail=('p', 0.1), tnh=5)),
+        (DDist.create([1, 2, 3, 4, 8], h=1, tail=('b', 4), tnh=4),
+         DDist.create([1, 1, 2, 9, 12, 20], h=1, tail=('b', 8), tnh=4)),
+    ]
+    for ddist1, ddist2 in cases:
+        expected = _loopAdd(ddist1, ddist2)
+        actual = ddist1 + ddist2
+        assert (actual.lb, actual.tb, actual.ub) == \
+                (expected.lb, expected.tb, expected.ub)
+        assert np.allclose(actual.pmfy, expected.pmfy, atol=1e-12)
+        assert np.allclose(actual.tpmfy, expected.tpmfy, atol=1e-12)
+        assert abs(actual.cmf(actual.ub) - 1) < 1e-9
+        #the tail binning moves the mass by less than a tail interval
+        assert abs(actual.mean - ddist1.mean - ddist2.mean) < actual.th
+    print 'test add regression passed'
+
+def testAddBaselineBugs():
+    print '===== test add baseline bugs ====='
+    #tail values on the interval starts, so the binning is exact
+    np.random.seed(1)
+    x1 = np.random.choice([1, 2, 3, 4, 8], 100000,
+                          p=[0.25, 0.25, 0.25, 0.15, 0.1])
+    x2 = np.random.choice([1, 2, 8, 12], 100000, p=[0.4, 0.3, 0.2, 0.1])
+    ddist1 = DDist.create(x1, h=1, tail=('b', 4), tnh=4)
+    ddist2 = DDist.create(x2, h=1, tail=('b', 8), tnh=4)
+    assert ddist1.llen != ddist2.llen
+    sampled = DDist.create(x1 + x2, h=1, tail=('b', 12), tnh=4)
+    actual = ddist1 + ddist2
+    baseline = _baselineAdd(ddist1, ddist2)
+    print 'sampled', sampled.mean, sampled.tpmfy
+    print 'actual', actual.mean, actual.tpmfy
+    print 'baseline', baseline.mean, baseline.tpmfy
+    #the sums agree with the sampled one up to the sampling noise
+    tlen = sampled.tlen
+    assert np.allclose(actual.pmfy, sampled.pmfy, atol=0.005)
+    assert np.allclose(actual.tpmfy[:tlen], sampled.tpmfy, atol=0.005)
+    assert np.all(actual.tpmfy[tlen:] == 0)
+    assert abs(actual.mean - sampled.mean) < 0.05
+    #the baseline loses mass and puts some above the largest sum
+    assert abs(baseline.pmfy.sum() + baseline.tpmfy.sum() - 1) > 0.01
+    assert baseline.tpmfy[tlen:].sum() > 0.01
+    assert abs(baseline.mean - sampled.mean) > 0.5
+    print 'test add baseline bugs passed'
+
 def testAdd():
     print '===== test add ====='
     #two step
@@ -357,7 +639,83 @@ def testAdd():
     print 'add ana tail', ddist5.mean, ddist5.std
     print '===== end =====\n'
 
+def testOrderStat():
+    print '===== test order statistic ====='
+    ddist = DDist.create(np.random.normal(100, 20, 10000), h=0.5,
+                         tail=('p', 0.1), tnh=4)
+    maxd = ddist.orderStat(5, 5)
+    assert np.allclose(maxd.cmfy, ddist.cmfy**5)
+    assert np.allclose(maxd.tcmfy, ddist.tcmfy**5)
+    #the median of 5 against the binomial sum
+    med = ddist.orderStat(3, 5)
+    p = ddist.cmfy
+    cmfy = sum([comb(5, j) * p**j * (1 - p)**(5 - j) for j in range(3, 6)])
+    assert np.allclose(med.cmfy, cmfy)
+    assert abs(med.cmf(med.ub) - 1) < 1e-9
+    assert ddist.orderStat(1, 5).mean < med.mean < maxd.mean
+    #against samples
+    x = np.sort(np.random.normal(100, 20, (100000, 5)), axis=1)
+    assert abs(med.mean - x[:, 2].mean()) < 1
+    assert abs(maxd.mean - x[:, 4].mean()) < 1
+    print 'test order statistic passed'
+
+def testRebin():
+    print '===== test rebin ====='
+    x = np.random.normal(100, 20, 10000)
+    ddist = DDist.create(x, h=0.1, tail=('p', 0.1), tnh=5)
+    coarse = ddist.rebin(4)
+    assert coarse.h == 0.4 and coarse.tnh == 5
+    assert abs(coarse.cmf(coarse.ub) - 1) < 1e-9
+    #all the moves are down, so the mean drops by the error
+    assert abs(ddist.mean - coarse.mean - coarse.error) < 1e-9
+    assert 0 < coarse.error < coarse.th
+    #deep compositions stay bounded
+    ddist = DDist.create(x, h=0.1, maxBins=500)
+    assert ddist.numBins <= 500 and ddist.h > 0.1
+    fine = DDist.create(x, h=0.1)
+    total = ddist
+    for i in range(19):
+        total = total + ddist
+    assert total.numBins <= 500, total.numBins
+    assert abs(total.mean + total.error - 20 * fine.mean) < 1e-6
+    #different intervals are re-binned to the coarser one
+    mixed = fine + ddist
+    assert mixed.h >= ddist.h and mixed.maxBins == 500
+    assert mixed.numBins <= 500
+    assert abs(mixed.mean + mixed.error - 2 * fine.mean) < 1e-6
+    print 'test rebin passed'
+
+def testDiscretize():
+    print '===== test discretize ====='
+    configs = [
+        ('expo', 100),
+        ('norm', 100, {'sigma' : 20}),
+        ('uniform', -1, {'lb' : 50, 'ub' : 150}),
+        ('lognorm', -1, {'mu' : 4, 'sigma' : 0.5, 'ub' : 200}),
+        ('pareto', -1, {'lb' : 100, 'a' : 3}),
+        ('ddist', -1, {'values' : [1, 2, 8], 'probs' : [1, 1, 2]}),
+        ('fixed', 30),
+    ]
+    for config in configs:
+        exact = DDist.discretize(config, h=0.5, tail=('p', 0.01), tnh=4)
+        sampled = DDist.sample(config, h=0.5, tail=('p', 0.01), tnh=4,
+                               num=200000)
+        assert abs(exact.cmf(exact.ub) - 1) < 1e-9
+        assert abs(exact.mean - sampled.mean) < 0.02 * sampled.mean + 0.1, \
+                (config, exact.mean, sampled.mean)
+        assert abs(exact.std - sampled.std) < 0.05 * sampled.std + 0.1, \
+                (config, exact.std, sampled.std)
+    #truncated at lb as RandInterval redraws
+    ddist = DDist.discretize(('norm', 10, {'sigma' : 10}), h=0.1)
+    assert ddist.lb == 0
+    print 'test discretize passed'
+
 def test():
+    testAddRegression()
+    testAddBaselineBugs()
+    testDiscretize()
+    testOrderStat()
+    testRebin()
     testAdd()
 
 def main():
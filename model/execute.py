@@ -1,5 +1,6 @@
 import sys
 
+import numpy as np
 
 def calcNDetmnWait(k, c, s, u, rs, rc):
     norm = k * (k + 1) / 2 * s + k * (k - 1) / 2 * u + k * c
@@ -17,11 +18,14 @@ def calcNDetmnExec(n, m, k, s, c, rs, rc):
         k   --  number of locks each txn
         s   --  lock step overhead
         c   --  commit time
+
+    The args can also be numpy arrays, which are evaluated element wise.
     """
-    n, m, k, s, c = map(float, (n, m, k, s, c))
+    n, m, k, s, c, rs, rc = [np.asarray(v, dtype=float)
+                             for v in (n, m, k, s, c, rs, rc)]
     la = (k * (k + 1) * s + 2 * k * c) / (2 * (k * s + c))
     lb = k / 2
-    mr = m - 1 if m > 1 else 0
+    mr = np.maximum(m - 1, 0)
     L = n * (1 - (1 - 1.0 / n)**(mr * la))
     #L = (m - 1) * la
     ps = L / n
@@ -33,7 +37,8 @@ def calcNDetmnExec(n, m, k, s, c, rs, rc):
     #ws = w1
     ws = w1 * (0.5 - alpha / (1 - alpha) + 0.5 / (1 - alpha) + alpha / (1 - alpha)**2)
     pt = 1 - (1 - ps)**k
-    pd = ps * alpha / (m - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pd = ps * alpha / (m - 1)
     res = (k * s + c + ps * k * ws)
     beta = ps * k * ws / res
     return ps, pd, ws, res, beta
@@ -45,8 +50,10 @@ def calcDetmnExec(n, m, k, s):
         m   --  max number of txns
         k   --  number of locks each txn
         s   --  lock step overhead
+
+    The args can also be numpy arrays, which are evaluated element wise.
     """
-    n, m, k, s = map(float, (n, m, k, s))
+    n, m, k, s = [np.asarray(v, dtype=float) for v in (n, m, k, s)]
     l = n * (1 - (1 - 1.0 / n)**((m - 1)* k))
     pt = 1 - ((n - l) / n)**k
     p = 1 - ((n - k) / n)**k
@@ -0,0 +1,52 @@
+"""
+Evaluate the analytical models over grids of parameters.
+
+    from model.grid import mapPoints, runModelGrid
+    from model.tpc import runModel, TPCModel
+    results = mapPoints(runModel, [(64, 4096, d, 100, 80, 10, 100, 0)
+                                   for d in [2, 4, 8]], numProcs=3)
+    results = runModelGrid(TPCModel(64, 4096, 32, 20, 80, 10, 100, 0),
+                           'arvRate', [1.0 / a for a in [20, 40, 60]])
+
+mapPoints fans independent points out over a process pool.  runModelGrid
+sweeps one rate of a single model, so that the states and the structure of
+the generator are built once and only the rates change between points. With
+numProcs, each process sweeps its own copy of the model over a contiguous
+share of the values.
+"""
+
+import multiprocessing
+
+def _apply(task):
+    func, args = task
+    return func(*args)
+
+def mapPoints(func, argsList, numProcs=1):
+    """[func(*args) for args in @argsList], in order, on @numProcs processes."""
+    tasks = [(func, tuple(args)) for args in argsList]
+    if numProcs == 1:
+        return map(_apply, tasks)
+    pool = multiprocessing.Pool(numProcs)
+    try:
+        results = pool.map(_apply, tasks, chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+def runModelGrid(model, name, values, method='lu', numProcs=1):
+    """Run @model with its attribute @name set to each of @values."""
+    if numProcs > 1 and len(values) > 1:
+        size = -(-len(values) // numProcs)
+        chunks = [values[i:i + size] for i in range(0, len(values), size)]
+        argsList = [(model, name, chunk, method) for chunk in chunks]
+        results = mapPoints(runModelGrid, argsList, len(chunks))
+        return sum(results, [])
+    results = []
+    for value in values:
+        setattr(model, name, value)
+        results.append(model.run(method))
+    return results
@@ -1,107 +1,275 @@
-from numpy import ones, zeros, empty, average
+import time
+
+import numpy as np
 import scipy.sparse as sp
+import scipy.sparse.linalg as spla
 from matplotlib.pylab import matshow, savefig
-from scipy.linalg import norm
 from scipy.misc import comb
-import time
+from scipy.sparse.csgraph import connected_components
 
 def getAlpha(D, d):
     return comb(D - d, d) / comb(D, d)
 
+def _normalized(Q):
+    #pi Q = 0 as Q^T pi^T = 0, with the last equation replaced by sum(pi) = 1
+    n = Q.shape[0]
+    A = Q.T.tolil()
+    A[n - 1, :] = np.ones(n)
+    b = np.zeros(n)
+    b[n - 1] = 1.0
+    return A.tocsc(), b
+
+#the solvers of pi Q = 0 for a generator Q in csr
+def _solveLU(Q, tol):
+    A, b = _normalized(Q)
+    return spla.spsolve(A, b)
+
+def _solveKrylov(method):
+    def solve(Q, tol):
+        A, b = _normalized(Q)
+        #incomplete LU preconditioner
+        ilu = spla.spilu(A, drop_tol=1e-5)
+        M = spla.LinearOperator(A.shape, ilu.solve)
+        x, info = method(A, b, x0=ilu.solve(b), tol=tol, M=M)
+        if info != 0:
+            print '%s did not converge: info=%s'%(method.__name__, info)
+        return x
+    return solve
+
+def _solveGaussSeidel(Q, tol, maxiter=100000):
+    #(D + L) x_{k + 1} = -U x_k on Q^T, normalized each sweep
+    A = Q.T.tocsr()
+    DL = sp.tril(A, format='csr')
+    U = sp.triu(A, k=1, format='csr')
+    x = np.ones(A.shape[0]) / A.shape[0]
+    n = 1; i = 0
+    while n > tol and i < maxiter:
+        x1 = spla.spsolve_triangular(DL, -U.dot(x), lower=True)
+        x1 /= x1.sum()
+        n = np.abs(x1 - x).sum(); i += 1
+        x = x1
+    if i >= maxiter:
+        print 'gauss seidel did not converge: n=%s'%n
+    return x
+
+def _solvePower(Q, tol, maxiter=1e6):
+    # Compute a suitable stochastic matrix by means of uniformization
+    l = Q.diagonal().min() * 1.001  # avoid periodicity, see trivedi's book
+    P = (sp.eye(Q.shape[0], Q.shape[0]) - Q / l).T.tocsr()
+    pi = np.zeros(Q.shape[0])
+    pi[0] = 1
+    n = 1; i = 0
+    while n > tol and i < maxiter:
+        pi1 = P.dot(pi)
+        pi = P.dot(pi1)   # avoid copying pi1 to pi
+        n = np.abs(pi - pi1).sum(); i += 1
+    if i >= maxiter:
+        print 'power iteration did not converge: n=%s'%n
+    return pi
+
+def _csrPattern(src, dst, n):
+    #the csr structure of the transitions and the diagonal, as the order of
+    #the rates, the entry of each and the csr indices and indptr
+    rows = np.concatenate((src, np.arange(n)))
+    cols = np.concatenate((dst, np.arange(n)))
+    order = np.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    groups = np.cumsum(first) - 1
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows[first],
+                                                        minlength=n))))
+    return order, groups, cols[first], indptr
+
+SOLVERS = {
+    'lu' : _solveLU,
+    'gmres' : _solveKrylov(spla.gmres),
+    'bicgstab' : _solveKrylov(spla.bicgstab),
+    'gs' : _solveGaussSeidel,
+    'power' : _solvePower,
+}
+
 class Markov2D(object):
     """
     Methods for set up and compute markov chain.
 
     Copied from http://wiki.scipy.org/Cookbook/Solving_Large_Markov_Chains.
+
+    Subclasses either fill the off diagonal rates into a dict in
+    fillOffDiagonal(Q), or return them as arrays from getTransitions(), by
+    the grid ids of state(i, j). Only the (i, j) where isState is true are
+    states, and the matrices and pi are indexed by their order in
+    getStates().
     """
     def __init__(self, N1, N2):
         self.N1 = N1
         self.N2 = N2
         self.size = N1 * N2
+        self.index = None
+        self.kept = None
+        self.pattern = None
+        self.labels = None
+        self.residual = None
+        self.solveTime = None
+        self.truncated = 0.0
 
     def state(self, i, j):
         return j * self.N1 + i
 
+    def isState(self, i, j):
+        """If each (i, j) of the arrays is a state."""
+        return np.ones(np.shape(i), dtype=bool)
+
+    def _buildIndex(self):
+        grid = np.arange(self.size)
+        i = grid % self.N1
+        j = grid / self.N1
+        mask = self.isState(i, j)
+        self.states = (i[mask], j[mask])
+        #the compact index of each grid id, -1 if not a state
+        self.index = np.repeat(-1, self.size)
+        self.index[mask] = np.arange(mask.sum())
+
+    @property
+    def numStates(self):
+        if self.index is None:
+            self._buildIndex()
+        return len(self.states[0])
+
+    def getStates(self):
+        """The (i, j) of each state as arrays."""
+        if self.index is None:
+            self._buildIndex()
+        return self.states
+
     def fillOffDiagonal(self, Q):
         raise NotImplementedError(
             'Q matrix fill off diagnoal method not implemented')
 
-    def computePi(self, printQ=False):
-        e0 = time.time()
-        Q = sp.dok_matrix((self.size, self.size))
+    def getTransitions(self):
+        """The arrays of (source state, target state, rate)."""
+        Q = {}
         self.fillOffDiagonal(Q)
+        if len(Q) == 0:
+            return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+        keys = np.array(Q.keys(), dtype=int)
+        return keys[:, 0], keys[:, 1], np.array(Q.values(), dtype=float)
+
+    def getQ(self, printQ=False):
+        """The generator matrix in csr on the compact index.
+
+        The csr structure is kept, and reused while the transitions are
+        between the same states, e.g. when only the rates are rescaled.
+
+        """
+        src, dst, rate = self.getTransitions()
         if printQ is True:
             print 'Q='
-            self.printQ(Q)
-        #self.printQ(Q)
-        print 'finish filling Q matrix'
+            self.printQ(src, dst, rate)
+        n = self.numStates
+        src = self.index[src]
+        dst = self.index[dst]
+        if (src < 0).any() or (dst < 0).any():
+            raise ValueError('Transitions from or to states not in isState')
+        if self.pattern is None or \
+           not np.array_equal(self.pattern[0], src) or \
+           not np.array_equal(self.pattern[1], dst):
+            self.pattern = (src, dst) + _csrPattern(src, dst, n)
+            self.labels = None
+        order, groups, indices, indptr = self.pattern[2:]
         # Set the diagonal of Q such that the row sums are zero
-        diag = -Q * ones(self.size)
-        Q.setdiag( ones(self.size) )
-        Q.setdiag( diag )
-        # Compute a suitable stochastic matrix by means of uniformization
-        l = min(Q.values())*1.001  # avoid periodicity, see trivedi's book
-        P = sp.eye(self.size, self.size) - Q/l
-        # compute Pi
-        P =  P.tocsr()
-        pi = zeros(self.size);  pi1 = zeros(self.size)
-        pi[0] = 1;
-        n = norm(pi - pi1,1); i = 0;
-        tol = 1.0 / self.size / 100.0 if self.size > 10000 else 1e-6
-        while n > tol and i < 1e6:
-            pi1 = pi*P
-            pi = pi1*P   # avoid copying pi1 to pi
-            n = norm(pi - pi1,1); i += 1
-        if i < 1e6:
-            print ("compute Pi converges: time=%s, i=%s, n=%s" 
-                   %(time.time() - e0, i, n))
-        else:
-            print ("compute Pi did not converge: time=%s, n=%s"
-                   %(time.time() - e0, n))
+        rate = np.concatenate((rate, -np.bincount(src, weights=rate,
+                                                  minlength=n)))
+        data = np.bincount(groups, weights=rate[order],
+                           minlength=len(indices))
+        return sp.csr_matrix((data, indices, indptr), shape=(n, n))
+
+    def computePi(self, printQ=False, method='lu', tol=None, truncate=None):
+        """Solve pi Q = 0 on the states communicating with state 0.
+
+        @args:
+            method      --  one of SOLVERS.
+            tol         --  tolerance of the iterative solvers.
+            truncate    --  if not None, the states with pi below it are
+                            left out of the next solves of this model.
+
+        The l1 norm of pi Q on all states is kept in self.residual, which
+        includes the rates out of the solved states, and the mass of the
+        truncated states in self.truncated.
+
+        """
+        e0 = time.time()
+        Q = self.getQ(printQ)
+        print 'finish filling Q matrix'
+        #the closed class of state 0, rates cut by epsilon can leave
+        #negligible absorbing states which make Q singular
+        if self.labels is None:
+            ncomps, self.labels = connected_components(
+                Q, directed=True, connection='strong')
+        solved = self.labels == self.labels[0]
+        if self.kept is not None:
+            solved &= self.kept
+        reach = np.where(solved)[0]
+        Qr = Q[reach][:, reach]
+        Qr = Qr - sp.diags(Qr.diagonal(), 0)
+        Qr = Qr - sp.diags(np.asarray(Qr.sum(axis=1)).ravel(), 0)
+        n = len(reach)
+        if tol is None:
+            tol = 1.0 / n / 100.0 if n > 10000 else 1e-6
+        e1 = time.time()
+        pir = SOLVERS[method](Qr.tocsr(), tol)
+        #round off errors can be negative
+        pir = np.maximum(pir, 0)
+        pir /= pir.sum()
+        pi = np.zeros(self.numStates)
+        pi[reach] = pir
+        self.residual = np.abs(Q.T.dot(pi)).sum()
+        self.solveTime = time.time() - e1
+        if truncate is not None:
+            self.kept = pi >= truncate
+            self.truncated = pi[~self.kept].sum()
+        print ('compute Pi: method=%s, states=%s, fill=%s, solve=%s, '
+               'residual=%s, truncated=%s'
+               %(method, n, e1 - e0, self.solveTime, self.residual,
+                 self.truncated))
         return pi
 
-    def printQ(self, Q):
-        for key, val in Q.iteritems():
-            state1, state2 = key
+    def printQ(self, src, dst, rate):
+        for state1, state2, val in zip(src, dst, rate):
             n11 = state1 % self.N1
             n12 = state1 / self.N1
             n21 = state2 % self.N1
             n22 = state2 / self.N1
             print ('%s: (%s, %s) -> (%s, %s) :%s'
-                   %(key, n11, n12, n21, n22, val))
+                   %((state1, state2), n11, n12, n21, n22, val))
 
     def plotPi(self, pi, outfile):
-        pi = pi.reshape(self.N2, self.N1)
-        matshow(pi)
+        i, j = self.getStates()
+        grid = np.zeros(self.size)
+        grid[self.state(i, j)] = pi
+        matshow(grid.reshape(self.N2, self.N1))
         savefig(outfile)
 
     def getPiStats(self, pi, lambd):
         """Return E(n1), E(n2), E(n1 + n2), W."""
-        en1 = 0
-        en2 = 0
-        eL = 0
-        for i in range(0, self.N1):
-            for j in range(0, self.N2):
-                en1 += i * pi[self.state(i, j)]
-                en2 += j * pi[self.state(i, j)]
-                eL += (i + j) * pi[self.state(i, j)]
+        i, j = self.getStates()
+        en1 = np.dot(i, pi)
+        en2 = np.dot(j, pi)
+        eL = en1 + en2
         #the effective lambd is the one when it sees the system is not full
-        p = 0
-        for i in range(0, self.N1):
-            p += pi[self.state(i, self.N1 - i - 1)]
+        p = pi[i + j == self.N1 - 1].sum()
         effLambda = lambd * (1 - p)
         W = eL / effLambda
         return en1, en2, eL, p, W
 
     def pi2str(self, pi, num=-1):
-        ave = average(pi)
+        ave = np.average(pi)
         disps = []
-        for i in range(0, self.N1):
-            for j in range(0, self.N2):
-                curr = pi[self.state(i, j)]
-                if curr < ave and num < len(pi):
-                    continue
-                disps.append((i, j, curr))
+        for i, j, curr in zip(self.getStates()[0], self.getStates()[1], pi):
+            if curr < ave and num < len(pi):
+                continue
+            disps.append((i, j, curr))
         def sortpi(entry):
             i, j, curr = entry
             return curr
@@ -152,3 +320,71 @@ class BirthDeathProcess(object):
             if self.stop(count, curr):
                 break
         return coeffs
+
+#####  TEST  #####
+class _TwoQueues(Markov2D):
+    #two independent M/M/1 queues of capacity N1 - 1 and N2 - 1
+    def __init__(self, N1, N2, rhos):
+        Markov2D.__init__(self, N1, N2)
+        self.rhos = rhos
+
+    def fillOffDiagonal(self, Q):
+        for i in range(self.N1):
+            for j in range(self.N2):
+                if i < self.N1 - 1:
+                    Q[(self.state(i, j), self.state(i + 1, j))] = self.rhos[0]
+                    Q[(self.state(i + 1, j), self.state(i, j))] = 1.0
+                if j < self.N2 - 1:
+                    Q[(self.state(i, j), self.state(i, j + 1))] = self.rhos[1]
+                    Q[(self.state(i, j + 1), self.state(i, j))] = 1.0
+
+def testSolvers():
+    print '===== test solvers ====='
+    N1, N2 = 12, 9
+    rhos = (0.7, 0.5)
+    model = _TwoQueues(N1, N2, rhos)
+    #the product of the truncated geometric distributions
+    p1 = rhos[0]**np.arange(N1); p1 /= p1.sum()
+    p2 = rhos[1]**np.arange(N2); p2 /= p2.sum()
+    expected = np.outer(p2, p1).ravel()
+    for method in sorted(SOLVERS.keys()):
+        pi = model.computePi(method=method)
+        assert np.abs(pi - expected).sum() < 1e-4, (method, pi - expected)
+        assert model.residual < 1e-4
+    print 'test solvers passed'
+
+def testTruncate():
+    print '===== test truncate ====='
+    model = _TwoQueues(40, 30, (0.3, 0.2))
+    pi = model.computePi(truncate=1e-10)
+    assert len(pi) == model.numStates == 40 * 30
+    assert 0 < model.truncated < 1e-8
+    #the next solve is on the kept states only
+    pi1 = model.computePi()
+    assert model.kept.sum() < model.numStates / 4
+    assert np.abs(pi - pi1).sum() < 1e-8
+    print 'test truncate passed'
+
+def testReuse():
+    print '===== test reuse ====='
+    model = _TwoQueues(12, 9, (0.7, 0.5))
+    Q1 = model.getQ()
+    pattern = model.pattern
+    #only the rates change, so the csr structure is kept
+    model.rhos = (0.4, 0.9)
+    Q2 = model.getQ()
+    assert model.pattern is pattern
+    fresh = _TwoQueues(12, 9, (0.4, 0.9)).getQ()
+    assert abs(Q2 - fresh).max() < 1e-12 and abs(Q1 - fresh).max() > 0.1
+    print 'test reuse passed'
+
+def test():
+    testSolvers()
+    testTruncate()
+    testReuse()
+
+def main():
+    test()
+
+if __name__ == '__main__':
+    main()
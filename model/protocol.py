@@ -7,84 +7,35 @@ from scipy.misc import comb
 from ddist import DDist
 
 def maxn(n, ddist):
-    cmf = []
-    for p in ddist.cmfy:
-        cmf.append(p**n)
-    tcmf = []
-    for p in ddist.tcmfy:
-        tcmf.append(p**n)
-    pmf = [cmf[0]]
-    for i in range(1, len(cmf)):
-        pmf.append(cmf[i] - cmf[i - 1])
-    if len(tcmf) == 0:
-        return DDist(ddist.lb, pmf, ddist.h, [], ddist.th)
-    else:
-        tpmf = [tcmf[0] - cmf[-1]]
-        for i in range(1, len(tcmf)):
-            tpmf.append(tcmf[i] - tcmf[i - 1])
-        return DDist(ddist.lb, pmf, ddist.h, tpmf, ddist.th)
+    return ddist.orderStat(n, n)
 
 def cond(p, ddist1, ddist2):
     if ddist1.h != ddist2.h or ddist1.th != ddist2.th:
-        raise ValueError('DDists must have the same sample rate to use cond')
+        ddist1, ddist2 = ddist1._align(ddist2)
     h = ddist1.h
     th = ddist1.th
+    tnh = ddist1.tnh
     lb = min(ddist1.lb, ddist2.lb)
     tb = max(ddist1.tb, ddist2.tb)
     ub = max(ddist1.ub, ddist2.ub)
-    pmf = []
-    tpmf = []
-    pmf1 = _paddingPmf(ddist1, lb, tb)
-    pmf2 = _paddingPmf(ddist2, lb, tb)
-    assert len(pmf1) == len(pmf2), \
-            'len(pmf1) = %s == %s = len(pmf2)'%(len(pmf1), len(pmf2))
-    tpmf1 = _paddingTpmf(ddist1, tb, ub)
-    tpmf2 = _paddingTpmf(ddist2, tb, ub)
-    assert len(tpmf1) == len(tpmf2), \
-            'len(tpmf1) = %s == %s = len(tpmf2)'%(len(tpmf1), len(tpmf2))
-    for i in range(len(pmf1)):
-        pmf.append(p * pmf1[i] + (1 - p) * pmf2[i])
-    for i in range(len(tpmf1)):
-        tpmf.append(p * tpmf1[i] + (1 - p) * tpmf2[i])
-    return DDist(lb, pmf, h, tpmf, th)
-
-def _paddingPmf(ddist, lb, tb):
-    assert lb <= ddist.lb and tb >= ddist.tb, \
-            ('lb = %s <= %s = ddist.lb tb = %s >= %s = ddist.tb'
-             %(lb, ddist.lb, tb, ddist.tb))
-    #[lb, ddist.lb)
-    n = int((ddist.lb - lb + 0.5 * ddist.h) / ddist.h)
-    pmf = [0.0] * n
-    #[ddist.lb, ddist.tb)
-    pmf.extend(ddist.pmfy)
-    #[ddist.tb, tb)
-    tnh = int((ddist.th + 0.5 * ddist.h) / ddist.h)
-    end = min(len(ddist.tpmfy),
-              int((tb - ddist.tb + 0.5 * ddist.th) / ddist.th))
-    for i in range(end):
-        pmf.append(ddist.tpmfy[i])
-        pmf.extend([0.0] * (tnh - 1))
-    n = max(0, int(floor((tb - ddist.ub + 0.5 * ddist.h) / ddist.h)))
-    pmf.extend([0.0] * n)
-    return pmf
-
-def _paddingTpmf(ddist, tb, ub):
-    assert tb >= ddist.tb and ub >= ddist.ub, \
-            ('tb = %s >= %s = ddist.tb ub = %s >= %s = ddist.ub'
-             %(tb, ddist.tb, ub, ddist.ub))
-    #ddist.ub <= tb
-    if ddist.ub <= tb:
-        n = int((ub - tb + 0.5 * ddist.th) / ddist.th)
-        return [0.0] * n
-    #ddist.ub > tb
-    tpmf = []
-    #[tb, ddist.ub)
-    start = int((tb - ddist.tb + 0.5 * ddist.th) / ddist.th)
-    tpmf.extend(ddist.tpmfy[start:])
-    #[ddist.ub, ub)
-    n = int((ub - ddist.ub + 0.5 * ddist.th) / ddist.th)
-    tpmf.extend([0.0] * n)
-    return tpmf
+    #mix on the head intervals from lb to ub
+    fine = np.zeros(int(round((ub - lb) / h)))
+    for q, ddist in [(p, ddist1), (1 - p, ddist2)]:
+        start = int(round((ddist.lb - lb) / h))
+        pmfy = ddist.getFinePmfy()
+        fine[start:start + len(pmfy)] += q * pmfy
+    n = int(round((tb - lb) / h))
+    tail = fine[n:]
+    tlen = int(ceil(float(len(tail)) / tnh))
+    tpmf = np.bincount(np.arange(len(tail)) / tnh, weights=tail,
+                       minlength=tlen)
+    #a tail off the grid of tb moves down to the tail interval start
+    moved = np.dot(tail, np.arange(len(tail)) % tnh) * h
+    return DDist(lb, fine[:n], h, tpmf, th,
+                 maxBins=min(ddist1.maxBins or ddist2.maxBins,
+                             ddist2.maxBins or ddist1.maxBins),
+                 error=p * ddist1.error + (1 - p) * ddist2.error + moved
+                ).coarsen()
 
 def quorum(n, f, ddist):
     """The quorum latency distribution.
@@ -103,29 +54,8 @@ def quorum(n, f, ddist):
     return _quorumC(n - 1, n - f - 1, rTrip)
 
 def _quorumC(n, m, rTrip):
-    #front distribution
-    cmf = [0.0] * len(rTrip.cmfy)
-    for i in range(len(cmf)):
-        p = rTrip.cmfy[i]
-        for j in range(m, n + 1):
-            cmf[i] += comb(n, j) * p**j * (1 - p)**(n - j)
-    #tail disctribution
-    tcmf = [0.0] * len(rTrip.tcmfy)
-    for i in range(len(tcmf)):
-        p = rTrip.tcmfy[i]
-        for j in range(m, n + 1):
-            tcmf[i] += comb(n, j) * p**j * (1 - p)**(n - j)
-    #comput pmf
-    pmf = [cmf[0]]
-    for i in range(1, len(cmf)):
-        pmf.append(cmf[i] - cmf[i - 1])
-    if len(tcmf) == 0:
-        tpmf = []
-    else:
-        tpmf = [tcmf[0] - cmf[-1]]
-        for i in range(1, len(tcmf)):
-            tpmf.append(tcmf[i] - tcmf[i - 1])
-    return DDist(rTrip.lb, pmf, rTrip.h, tpmf, rTrip.th)
+    #at least m out of n round trips
+    return rTrip.orderStat(m, n)
 
 def _quorumR(n, m, sTrip, rTrip):
     if m <= 2:
@@ -158,17 +88,7 @@ def _quorumR(n, m, sTrip, rTrip):
                             comb(n - 2, j - k) * \
                             pr**(j - k) * (1 - pr)**(n - 2 - j + k)
         tcmf.append(p)
-    #compute pmf
-    pmf = [cmf[0]]
-    for i in range(1, len(cmf)):
-        pmf.append(cmf[i] - cmf[i - 1])
-    if len(tcmf) == 0:
-        tpmf = []
-    else:
-        tpmf = [tcmf[0] - cmf[-1]]
-        for i in range(1, len(tcmf)):
-            tpmf.append(tcmf[i] - tcmf[i - 1])
-    return DDist(rTrip.lb, pmf, rTrip.h, tpmf, rTrip.th)
+    return DDist.fromCmf(rTrip.lb, cmf, rTrip.h, tcmf, rTrip.th)
 
 def _paddingSTrip(sTrip, lb, tb, ub):
     assert sTrip.lb <= lb, 's.lb = %s <= %s = lb'%(sTrip.lb, lb)
@@ -230,95 +150,44 @@ def oodelay(ddist, config):
         raise ValueError('Arrival process %s not supported'%arrproc)
 
 def _oodelayFixedInterval(ddist, intvl):
-    cmf = []
-    tcmf = []
-    #front dist
-    for i in range(len(ddist.cmfy)):
-        curr = 1
-        prev = 0
-        #front part
-        start = ddist.lb + i * ddist.h
-        x = start
-        while x < ddist.tb:
-            j = int(floor((x - ddist.lb) / ddist.h))
-            prev = curr
-            curr *= ddist.cmfy[j]
-            x += intvl
-            if curr < 1e-10:
-                x = ddist.ub
-                break
-            if abs(prev - curr) / curr < 1e-6:
-                x = ddist.ub
-                break
-        #tail part
-        while x < ddist.ub:
-            j = int(floor((x - ddist.tb) / ddist.th))
-            prev = curr
-            curr *= ddist.tcmfy[j]
-            x += intvl
-            if curr < 1e-10:
-                break
-            if abs(prev - curr) / curr < 1e-6:
-                break
-        cmf.append(curr)
-    #tail dist
-    for i in range(len(ddist.tcmfy)):
-        curr = 1
-        prev = 0
-        start = ddist.tb + i * ddist.th
-        x = start
-        while x < ddist.ub:
-            j = int(floor((x - ddist.tb) / ddist.th))
-            prev = curr
-            curr *= ddist.tcmfy[j]
-            x += intvl
-            if curr < 1e-10:
-                break
-            if abs(prev - curr) / curr < 1e-6:
-                break
-        tcmf.append(curr)
-    pmf = [cmf[0]]
-    for i in range(1, len(cmf)):
-        pmf.append(cmf[i] - cmf[i - 1])
-    if len(tcmf) == 0:
-        return DDist(ddist.lb, pmf, ddist.h, [], ddist.th)
-    else:
-        tpmf = [tcmf[0] - cmf[-1]]
-        for i in range(1, len(tcmf)):
-            tpmf.append(tcmf[i] - tcmf[i - 1])
-        return DDist(ddist.lb, pmf, ddist.h, tpmf, ddist.th)
+    #the cmf at x is the product of the cmf at x + k * intvl for all k >= 0,
+    #summed in log space from the upper bound down
+    #the re-binning error of ddist is carried over as is
+    step = intvl / ddist.h
+    with np.errstate(divide='ignore'):
+        if abs(step - round(step)) < 1e-9:
+            #the chain from each head interval is on the head intervals
+            logs = _chainLogSum(np.log(ddist.getFineCmfy()), int(round(step)))
+            cmf = np.exp(logs[:ddist.llen])
+            tcmf = np.exp(logs[ddist.llen::ddist.tnh][:ddist.tlen])
+        else:
+            x = np.concatenate((ddist.lb + np.arange(ddist.llen) * ddist.h,
+                                ddist.tb + np.arange(ddist.tlen) * ddist.th))
+            num = int(ceil((ddist.ub - ddist.lb) / intvl)) + 1
+            chain = x[:, np.newaxis] + np.arange(num) * intvl
+            logs = np.log(ddist.cmfv(chain)).sum(axis=1)
+            cmf = np.exp(logs[:ddist.llen])
+            tcmf = np.exp(logs[ddist.llen:])
+    return DDist.fromCmf(ddist.lb, cmf, ddist.h, tcmf, ddist.th,
+                         maxBins=ddist.maxBins, error=ddist.error)
+
+def _chainLogSum(logs, step):
+    #sums of logs[i], logs[i + step], ... for every i
+    n = int(ceil(float(len(logs)) / step)) * step
+    padded = np.zeros(n)
+    padded[:len(logs)] = logs
+    rows = padded.reshape((n / step, step))
+    return np.cumsum(rows[::-1], axis=0)[::-1].reshape(n)[:len(logs)]
 
 def _oodelayPoisson(ddist, lambd):
-    cmf = []
-    tcmf = []
-    #front dist
-    for i in range(len(ddist.cmfy)):
-        s = 0
-        #front part
-        for j in range(i, len(ddist.cmfy)):
-            s += (1 - ddist.cmfy[j]) * ddist.h
-        #tail part
-        for j in range(len(ddist.tcmfy)):
-            s += (1 - ddist.tcmfy[j]) * ddist.th
-        p = ddist.cmfy[i] * np.exp(-lambd * s)
-        cmf.append(p)
-    #tail dist
-    for i in range(len(ddist.tcmfy)):
-        s = 0
-        for j in range(i, len(ddist.tcmfy)):
-            s += (1 - ddist.tcmfy[j]) * ddist.th
-        p = ddist.tcmfy[i] * np.exp(-lambd * s)
-        tcmf.append(p)
-    pmf = [cmf[0]]
-    for i in range(1, len(cmf)):
-        pmf.append(cmf[i] - cmf[i - 1])
-    if len(tcmf) == 0:
-        return DDist(ddist.lb, pmf, ddist.h, [], ddist.th)
-    else:
-        tpmf = [tcmf[0] - cmf[-1]]
-        for i in range(1, len(tcmf)):
-            tpmf.append(tcmf[i] - tcmf[i - 1])
-        return DDist(ddist.lb, pmf, ddist.h, tpmf, ddist.th)
+    #s is the integral of 1 - cmf from each interval to the upper bound
+    ts = np.cumsum(((1 - ddist.tcmfy) * ddist.th)[::-1])[::-1]
+    tsum = ts[0] if len(ts) != 0 else 0.0
+    s = np.cumsum(((1 - ddist.cmfy) * ddist.h)[::-1])[::-1] + tsum
+    cmf = ddist.cmfy * np.exp(-lambd * s)
+    tcmf = ddist.tcmfy * np.exp(-lambd * ts)
+    return DDist.fromCmf(ddist.lb, cmf, ddist.h, tcmf, ddist.th,
+                         maxBins=ddist.maxBins, error=ddist.error)
 
 def getSLPLatencyDist(n, ddist, lambd):
     f = int(np.ceil(n / 2.0) - 1)
@@ -418,7 +287,7 @@ def getEPLatencyDist(n, ddist, sync, elen):
     #wait time is a uniform distribution on elen
     lb = 0; ub = elen; length = int((ub - lb) / ddist.h) + 1
     pmf = [1.0 / length] * length
-    ewait = DDist(lb, pmf, h=ddist.h, th=ddist.th)
+    ewait = DDist(lb, pmf, h=ddist.h, th=ddist.th, maxBins=ddist.maxBins)
     delay = oodelay(elatency,
                     {'arrival.process' : 'fixed', 'fixed.interval' : elen})
     return ewait + delay, delay, rtrip
@@ -718,6 +587,34 @@ def testoodelay():
                 print 'ana pmf', ddist2.getPmfxy()
     print '===== end =====\n'
 
+def testoodelayVector():
+    print '===== test oodelay vector ====='
+    ddist = DDist.create(np.random.pareto(1.8, 10000) + 50, h=1,
+                         tail=('p', 0.1), tnh=5)
+    x = ddist.getPmfx()
+    #intervals exact in binary, so the chains hit the same bins
+    for intvl in [10, 7.25]:
+        #the product of the cmf along the chain of each value
+        expected = []
+        for start in x:
+            p = 1.0
+            curr = start
+            while curr < ddist.ub:
+                p *= ddist.cmf(curr)
+                curr += intvl
+            expected.append(p)
+        delay = _oodelayFixedInterval(ddist, intvl)
+        actual = np.concatenate((delay.cmfy, delay.tcmfy))
+        assert np.allclose(actual, expected, atol=1e-12)
+    lambd = 0.01
+    widths = np.concatenate(([ddist.h] * ddist.llen, [ddist.th] * ddist.tlen))
+    cmf = np.concatenate((ddist.cmfy, ddist.tcmfy))
+    expected = [cmf[i] * np.exp(-lambd * sum((1 - cmf[i:]) * widths[i:]))
+                for i in range(len(cmf))]
+    delay = _oodelayPoisson(ddist, lambd)
+    actual = np.concatenate((delay.cmfy, delay.tcmfy))
+    assert np.allclose(actual, expected, atol=1e-12)
+    print 'test oodelay vector passed'
 
 def runoodelay(arrintvl, latency):
     x = []
@@ -734,10 +631,32 @@ def runoodelay(arrintvl, latency):
         y.append(lastend - currtime)
     return x, y
 
+def testEPLatencyBins():
+    print '===== test ep latency bins ====='
+    network = ('lognorm', -1, {'mu' : np.log(100) - 0.125, 'sigma' : 0.5,
+                               'lb' : 0, 'ub' : 1000})
+    skew = ('uniform', -1, {'lb' : 0, 'ub' : 10})
+    exact = getEPLatencyDist(5, DDist.discretize(network, h=0.5),
+                             DDist.discretize(skew, h=0.5), 50)
+    maxBins = 1000
+    assert exact[0].numBins > maxBins
+    bounded = getEPLatencyDist(
+        5, DDist.discretize(network, h=0.5, maxBins=maxBins),
+        DDist.discretize(skew, h=0.5, maxBins=maxBins), 50)
+    for ddist, edist in zip(bounded, exact):
+        assert ddist.maxBins == maxBins
+        assert ddist.numBins <= maxBins, ddist.numBins
+        #re-binning moves the mean by at most the error bound
+        assert abs(ddist.mean - edist.mean) <= ddist.error + 1e-9
+    print 'res', exact[0].mean, bounded[0].mean, bounded[0].error
+    print 'test ep latency bins passed'
+
 def test():
+    testEPLatencyBins()
     testMaxn()
     testCond()
     testQuorum()
+    testoodelayVector()
     testoodelay()
 
 def main():
@@ -1,5 +1,6 @@
 import sys
 
+import numpy as np
 
 from model.ddist import DDist
 from model.execute import calcNDetmnExec
@@ -85,7 +86,143 @@ def calcDetmnSystem(n, k, s, l, p):
     return resc + p, mc, count, (pt, a, h, wt, beta)
 
 
+#status of each point of the grid versions
+CONVERGED = 0
+EXCEEDS_COUNT_MAX = 1
+NOT_CONVERGE = 2
+
+
+def _fixedPoint(l, res0, m0, execFunc):
+    #the loop of calc*System on arrays, execFunc(m) gives (res, stats)
+    l, res0, m0 = np.broadcast_arrays(*[np.asarray(v, dtype=float)
+                                        for v in (l, res0, m0)])
+    shape = l.shape
+    resp = res0.copy()
+    resc = res0.copy()
+    mp = m0.copy()
+    mc = m0.copy()
+    count = np.zeros(shape, dtype=int)
+    status = np.repeat(CONVERGED, l.size).reshape(shape)
+    stats = None
+    active = np.ones(shape, dtype=bool)
+    while active.any():
+        count[active] += 1
+        over = active & (count > COUNT_MAX)
+        diverge = active & ~over & (resc > 100 * res0)
+        status[over] = EXCEEDS_COUNT_MAX
+        status[diverge] = NOT_CONVERGE
+        active &= ~(over | diverge)
+        res, curr = execFunc(mp)
+        if stats is None:
+            stats = [np.zeros(shape) for v in curr]
+        for stat, v in zip(stats, curr):
+            stat[active] = v[active]
+        resc[active] = res[active]
+        mc[active] = np.floor(l * resc)[active]
+        active &= ~(np.abs(mc - mp) < 1)
+        resp[active] = resc[active]
+        mp[active] = mc[active]
+    failed = status != CONVERGED
+    resc[failed] = resp[failed]
+    mc[failed] = mp[failed]
+    return resc, mc, count, status, stats
+
+
+def calcNDetmnSystemGrid(n, k, s, c, rs, rc, l, C):
+    """calcNDetmnSystem on numpy arrays of the args.
+
+    All the points iterate together, each until it converges or fails.
+    Returns arrays of (res, m, count, status, (ps, pd, ws, beta)), where
+    status is CONVERGED, EXCEEDS_COUNT_MAX or NOT_CONVERGE instead of the
+    exceptions. The failed points have the res and m of the exception args.
+
+    """
+    n, k, s, c, rs, rc, l, C = np.broadcast_arrays(
+        *[np.asarray(v, dtype=float) for v in (n, k, s, c, rs, rc, l, C)])
+    res0 = k * s + c
+    def execFunc(m):
+        ps, pd, ws, res, beta = calcNDetmnExec(n, m, k, s, c, rs, rc)
+        return res, (ps, pd, ws, beta)
+    res, m, count, status, stats = _fixedPoint(l, res0, np.floor(l * res0),
+                                               execFunc)
+    res = np.where(status == CONVERGED, res + C, res)
+    return res, m, count, status, tuple(stats)
+
+
+def calcDetmnSystemGrid(n, k, s, l, p):
+    """calcDetmnSystem on numpy arrays of the args, see calcNDetmnSystemGrid.
+
+    Returns arrays of (res, m, count, status, (pt, a, h, wt, beta)).
+
+    """
+    n, k, s, l, p = np.broadcast_arrays(
+        *[np.asarray(v, dtype=float) for v in (n, k, s, l, p)])
+    res0 = k * s
+    def execFunc(m):
+        pt, a, h, wt, res, beta = calcDetmnExec(n, m, k, s)
+        return res, (pt, a, h, wt, beta)
+    res, m, count, status, stats = _fixedPoint(l, res0, l * res0, execFunc)
+    res = np.where(status == CONVERGED, res + p, res)
+    return res, m, count, status, tuple(stats)
+
+
+#####  TEST  #####
+def _scalarGrid(func, args):
+    #func on each point of the broadcast args, failures as in the grid
+    args = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in args])
+    ret = []
+    for point in zip(*[v.ravel() for v in args]):
+        try:
+            res, m, count, stats = func(*point)
+            ret.append((res, m, count, CONVERGED, stats))
+        except ExceedsCountMaxException as e:
+            ret.append(e.args + (EXCEEDS_COUNT_MAX, None))
+        except NotConvergeException as e:
+            ret.append(e.args + (NOT_CONVERGE, None))
+    return ret
+
+def _checkGrid(grid, scalar):
+    res, m, count, status, stats = [v.ravel() if isinstance(v, np.ndarray)
+                                     else v for v in grid]
+    assert len(res) == len(scalar)
+    for i, (sres, sm, scount, sstatus, sstats) in enumerate(scalar):
+        assert status[i] == sstatus, (i, status[i], sstatus)
+        assert count[i] == scount, (i, count[i], scount)
+        assert m[i] == sm, (i, m[i], sm)
+        assert abs(res[i] - sres) <= 1e-9 * abs(sres), (i, res[i], sres)
+        if sstatus == CONVERGED:
+            for stat, sstat in zip(stats, sstats):
+                assert np.isclose(stat.ravel()[i], sstat, rtol=1e-9, atol=0,
+                                  equal_nan=True), (i, stat.ravel()[i], sstat)
+
+def testGrid():
+    print '===== test grid ====='
+    #the example of scripts/show.py sysres, with some failing points
+    n, k, s = 1024, 12, 10
+    lambds = np.array([0.01, 0.04, 0.05, 0.08, 0.2]).reshape(-1, 1)
+    lmeans = np.array([0, 30, 60]).reshape(1, -1)
+    c = 2 * lmeans
+    args = (n, k, s, c, s, c, lambds, lmeans)
+    grid = calcNDetmnSystemGrid(*args)
+    assert grid[0].shape == (5, 3)
+    scalar = _scalarGrid(calcNDetmnSystem, args)
+    assert CONVERGED in [v[3] for v in scalar]
+    assert NOT_CONVERGE in [v[3] for v in scalar]
+    _checkGrid(grid, scalar)
+    args = (n, k, s, lambds, 3 * lmeans)
+    scalar = _scalarGrid(calcDetmnSystem, args)
+    assert CONVERGED in [v[3] for v in scalar]
+    assert NOT_CONVERGE in [v[3] for v in scalar]
+    _checkGrid(calcDetmnSystemGrid(*args), scalar)
+    print 'test grid passed'
+
+def test():
+    testGrid()
+
 def main():
+    if len(sys.argv) == 2 and sys.argv[1] == 'test':
+        test()
+        return
     if len(sys.argv) != 3:
         print 'system <key> <args>'
         print
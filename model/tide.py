@@ -1,9 +1,20 @@
 import sys
 
+import numpy as np
 from numpy import exp
-from scipy.misc import comb
+from scipy.special import gammaln
 
-from common import Markov2D
+from markov import Markov2D
+
+def getBetas(D, d, n):
+    """comb(D - x * d, d) / comb(D, d) for x in [0, n), by log gamma."""
+    x = np.arange(n)
+    top = D - x * d
+    valid = top >= d
+    top = np.where(valid, top, d)
+    logs = gammaln(top + 1) - gammaln(top - d + 1) - \
+            gammaln(D + 1) + gammaln(D - d + 1)
+    return np.where(valid, np.exp(logs), 0.0)
 
 class TideModel(Markov2D):
     """Tide model.
@@ -44,83 +55,80 @@ class TideModel(Markov2D):
         """
         Markov2D.__init__(self, N + 1, N + 1)
         self.N = N
-        self.alpha = comb(D - d, d) / comb(D, d)
-        self.getBeta = lambda x : comb(D - x * d, d) / comb(D, d)
+        #beta(x) = comb(D - x * d, d) / comb(D, d), in log space since the
+        #combinations overflow for large D
+        self.betas = getBetas(D, d, max(N + 1, 2))
+        self.alpha = self.betas[1]
         self.arvRate = 1.0 / a
         self.latency = l
         self.cmtRate = 1.0 / r
         self.epochLen = e
-        self.dpValues = {}
         if epsilon is None:
             self.epsilon = 1.0 / self.size / 1000.0
+        else:
+            self.epsilon = epsilon
+
+    def isState(self, w, r):
+        return w + r <= self.N
 
-    def fillOffDiagonal(self, Q):
+    def getBeta(self, x):
+        return self.betas[x]
+
+    def getTransitions(self):
+        N = self.N
+        src = []; dst = []; rate = []
         #arrive
-        for w in range(0, self.N):
-            for r in range(0, self.N - w):
-                #do not have (w, 0) state
-                if r == 0 and w != 0:
-                    continue
-                p = self.alpha**(w) * self.getBeta(r)
-                q = 1 - p
-                if p != 0:
-                    Q[(self.state(w, r), self.state(w, r + 1))] = self.arvRate * p
-                if q != 0:
-                    Q[(self.state(w, r), self.state(w + 1, r))] = self.arvRate * q
+        w, r = self.getStates()
+        #do not have (w, 0) state
+        arrive = (w + r < N) & ((r != 0) | (w == 0))
+        w = w[arrive]; r = r[arrive]
+        p = self.alpha**w * self.betas[r]
+        q = 1 - p
+        for mask, dw, dr, v in [(p != 0, 0, 1, p), (q != 0, 1, 0, q)]:
+            src.append(self.state(w[mask], r[mask]))
+            dst.append(self.state(w[mask] + dw, r[mask] + dr))
+            rate.append(self.arvRate * v[mask])
         #commit
-        for w in range(0, self.N + 1):
-            for r in range(1, self.N - w + 1):
-                for k in range(0, w + 1):
-                    p = self.getKRunProb(w, r - 1, k, self.alpha, self.getBeta(r - 1))
-                    #print '(%s, %s)->(%s,%s):%s'%(w, r, w-k, r+k-1, p)
-                    #print
-                    if p != 0:
-                        Q[(self.state(w, r), self.state(w - k, r + k - 1))] = \
-                           r * self.cmtRate * p
-
-    def getKRunProb(self, w, r, k, alpha, beta):
+        ws, ks = np.indices((N + 1, N + 1))
+        for r in range(1, N + 1):
+            #from (w, r) with w <= N - r to (w - k, r + k - 1)
+            table = self.getKRunTable(self.betas[r - 1])[:N - r + 1]
+            w = ws[:N - r + 1]; k = ks[:N - r + 1]
+            mask = table != 0
+            src.append(self.state(w[mask], r))
+            dst.append(self.state(w[mask] - k[mask], r + k[mask] - 1))
+            rate.append(r * self.cmtRate * table[mask])
+        return np.concatenate(src), np.concatenate(dst), np.concatenate(rate)
+
+    def getKRunTable(self, beta):
+        """The probabilities s(w, k) that k of w waiting txns can run.
+
+        Indexed [w, k], for w, k in [0, N]. Values below epsilon are cut to
+        0 at each step of the recursion
+            s(w, k) = s(w - 1, k - 1) * p_{w - 1} + s(w - 1, k) * q_{w - 1}
+        where p_i = alpha**i * beta, with
+            s(w, w) = alpha**((w - 1) * w / 2) * beta**w
+            s(w, 0) = prod_{i < w} q_i
+
+        """
+        N = self.N
+        table = np.zeros((N + 1, N + 1))
         #to save execution time and memory
         if beta < self.epsilon:
-            return 0
-        #dynamic programming
-        # check computed
-        if (w, r, k) in self.dpValues:
-            #print 'in (w,r,k)', self.dpValues[(w, r, k)]
-            return self.dpValues[(w, r, k)]
-        # boundary
-        if w < k:
-            self.dpValues[(w, r, k)] = 0
-            #print 'w<k', v
-            return 0
-        if w == k:
-            v = alpha**((w - 1)*w / 2) * beta**w
-            if v < self.epsilon:
-                v = 0
-            self.dpValues[(w, r, k)] = v
-            #print 'w==k', v
-            return v
-        if k == 0:
-            v = 1
-            for i in range(w):
-                v *= 1 - alpha**(i) * beta
-            if v < self.epsilon:
-                v = 0
-            self.dpValues[(w, r, k)] = v
-            #print 'k==0', v
-            return v
-        #s(w, r, k) = s(w - 1, r, k - 1) * p_{w-1} + s(w - 1, r, k) * q_{w - 1}
-        p = alpha**(w - 1) * beta
+            return table
+        p = self.alpha**np.arange(N + 1) * beta
         q = 1 - p
-        s1 = self.getKRunProb(w - 1, r, k - 1, alpha, beta)
-        s2 = self.getKRunProb(w - 1, r, k, alpha, beta)
-        v = s1 * p + s2 * q
-        if v < self.epsilon:
-            v = 0
-        self.dpValues[(w, r, k)] = v
-        #print '%s*%s + %s*%s = %s'%(s1, p, s2, q, v)
-        return v
-
-    def run(self):
+        cut = lambda v: np.where(v < self.epsilon, 0.0, v)
+        table[0, 0] = 1
+        for w in range(1, N + 1):
+            table[w, 1:w] = cut(table[w - 1, 0:w - 1] * p[w - 1] +
+                                table[w - 1, 1:w] * q[w - 1])
+            table[w, w] = cut(
+                np.array(self.alpha**((w - 1) * w / 2) * beta**w))
+            table[w, 0] = cut(np.array(np.prod(q[:w])))
+        return table
+
+    def run(self, method='lu'):
         """
         Calculate the following parameters:
             nwait   --  number of the txn waiting to run
@@ -149,7 +157,7 @@ class TideModel(Markov2D):
         print ('nwait2=%s, nrun2=%s, nqueue2=%s, tserve2=%s'
                %(nwait2, nrun2, nqueue2, tserve2))
         # step3
-        pi = self.computePi()
+        pi = self.computePi(method=method)
         print 'sum(pi)=%s' %sum(pi)
         print self.pi2str(pi, 10)
         nwait3, nrun3, nqueue3, loss, tserve3 = self.getPiStats(pi, self.arvRate)
@@ -164,9 +172,47 @@ class TideModel(Markov2D):
                %(nwait, nrun, nqueue, tserve))
         return nwait, nrun, nqueue, loss, tserve
 
-def runModel(N, D, d, a, l, r, e):
+#####  TEST  #####
+def _recKRunProb(w, k, alpha, beta, epsilon):
+    #the former recursion of getKRunProb for regression
+    if beta < epsilon or w < k:
+        return 0
+    if w == k:
+        v = alpha**((w - 1)*w / 2) * beta**w
+    elif k == 0:
+        v = 1
+        for i in range(w):
+            v *= 1 - alpha**(i) * beta
+    else:
+        p = alpha**(w - 1) * beta
+        v = _recKRunProb(w - 1, k - 1, alpha, beta, epsilon) * p + \
+                _recKRunProb(w - 1, k, alpha, beta, epsilon) * (1 - p)
+    return 0 if v < epsilon else v
+
+def testKRunTable():
+    print '===== test k run table ====='
+    from scipy.misc import comb
+    model = TideModel(12, 1000, 20, 20, 80, 10, 20)
+    assert np.allclose(model.betas,
+                       [comb(1000 - x * 20, 20) / comb(1000, 20)
+                        for x in range(13)], rtol=1e-8)
+    for r in [0, 3, 11]:
+        beta = model.getBeta(r)
+        table = model.getKRunTable(beta)
+        expected = [[_recKRunProb(w, k, model.alpha, beta, model.epsilon)
+                     for k in range(13)] for w in range(13)]
+        assert np.allclose(table, expected, rtol=1e-12, atol=0)
+    #large D and d do not overflow
+    model = TideModel(200, 10**6, 500, 20, 80, 10, 20)
+    assert np.all(np.isfinite(model.betas)) and 0 < model.alpha < 1
+    print 'test k run table passed'
+
+def test():
+    testKRunTable()
+
+def runModel(N, D, d, a, l, r, e, method='lu'):
     model = TideModel(N, D, d, a, l, r, e)
-    return model.run()
+    return model.run(method)
 
 def main():
     if not len(sys.argv) == 8:
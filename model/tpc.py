@@ -1,8 +1,9 @@
 import sys
 
+import numpy as np
 from scipy.misc import comb
 
-from common import Markov2D
+from markov import Markov2D
 
 class TPCModel(Markov2D):
     """TPC model.
@@ -39,32 +40,34 @@ class TPCModel(Markov2D):
         self.eta = eta
         self.epsilon = 1.0 / self.size / 1000.0
 
-    def fillOffDiagonal(self, Q):
-        #arrive 
-        for w in range(0, self.N):
-            for r in range(0, self.N - w):
-                Q[(self.state(w, r), self.state(w, r + 1))] = self.arvRate
-        #backoff and retry
-        for w in range(1, self.N + 1):
-            for r in range(0, self.N - w + 1):
-                Q[(self.state(w, r), self.state(w - 1, r + 1))] = \
-                        w * self.bkfRate
-        #commit
-        for w in range(0, self.N):
-            for r in range(1, self.N - w + 1):
-                ncfr = self.alpha**(r - 1)
-                val = (ncfr + self.eta * (1 - ncfr)) * r * self.cmtRate
-                if val > self.epsilon:
-                    Q[(self.state(w, r), self.state(w, r - 1))] = val
-        #abort
-        for w in range(0, self.N):
-            for r in range(1, self.N - w + 1):
-                ncfr = self.alpha**(r - 1)
-                val = (1 - self.eta) * (1 - ncfr) * r * self.cmtRate
-                if val > self.epsilon:
-                    Q[(self.state(w, r), self.state(w + 1, r - 1))] = val
+    def isState(self, w, r):
+        return w + r <= self.N
 
-    def run(self):
+    def getTransitions(self):
+        w, r = self.getStates()
+        ncfr = self.alpha**np.maximum(r - 1, 0)
+        cmtRates = (ncfr + self.eta * (1 - ncfr)) * r * self.cmtRate
+        abtRates = (1 - self.eta) * (1 - ncfr) * r * self.cmtRate
+        #(mask, dw, dr, rates) of each transition
+        moves = [
+            #arrive
+            (w + r < self.N, 0, 1, np.repeat(self.arvRate, len(w))),
+            #backoff and retry
+            (w >= 1, -1, 1, w * self.bkfRate),
+            #commit
+            ((w < self.N) & (r >= 1) & (cmtRates > self.epsilon),
+             0, -1, cmtRates),
+            #abort
+            ((w < self.N) & (r >= 1) & (abtRates > self.epsilon),
+             1, -1, abtRates),
+        ]
+        src = np.concatenate([self.state(w[m], r[m]) for m, dw, dr, v in moves])
+        dst = np.concatenate([self.state(w[m] + dw, r[m] + dr)
+                              for m, dw, dr, v in moves])
+        rate = np.concatenate([v[m] for m, dw, dr, v in moves])
+        return src, dst, rate
+
+    def run(self, method='lu'):
         """
         Calculate the following parameters:
             nwait   --  number of the txn waiting to run
@@ -72,7 +75,7 @@ class TPCModel(Markov2D):
             nqueue  --  total number of txns in the system
             tserve  --  time between txn submission and leave the system
         """
-        pi = self.computePi()
+        pi = self.computePi(method=method)
         print ('N=%s, alpha=%s, arvRate=%s, bkfRate=%s, cmtRate=%s, eta=%s'
                %(self.N, self.alpha,
                  self.arvRate, self.bkfRate, self.cmtRate, self.eta))
@@ -83,9 +86,9 @@ class TPCModel(Markov2D):
                %(nwait, nrun, nqueue, loss, tserve))
         return nwait, nrun, nqueue, loss, tserve
 
-def runModel(N, D, d, a, l, r, b, eta):
+def runModel(N, D, d, a, l, r, b, eta, method='lu'):
     model = TPCModel(N, D, d, a, l, r, b, eta)
-    return model.run()
+    return model.run(method)
 
 def main():
     if not len(sys.argv) == 9:
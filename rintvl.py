@@ -1,6 +1,17 @@
 import sys
 import random
 
+import numpy as np
+
+def _truncated(draw, lb, ub, num):
+    #redraw the values out of [lb, ub] as next() does, all at once
+    ret = draw(num)
+    bad = (ret < lb) | (ret > ub)
+    while bad.any():
+        ret[bad] = draw(int(bad.sum()))
+        bad = (ret < lb) | (ret > ub)
+    return ret
+
 class ExpoInterval(object):
     def __init__(self, mean, config):
         self.lb = config.get('lb', 0)
@@ -13,6 +24,11 @@ class ExpoInterval(object):
             ret = random.expovariate(self.lambd)
         return ret
 
+    def sample(self, num):
+        return _truncated(
+            lambda n: np.random.exponential(1.0 / self.lambd, n),
+            self.lb, self.ub, num)
+
 class NormInterval(object):
     def __init__(self, mean, config):
         self.lb = config.get('lb', 0)
@@ -26,6 +42,11 @@ class NormInterval(object):
             ret = random.normalvariate(self.mu, self.sigma)
         return ret
 
+    def sample(self, num):
+        return _truncated(
+            lambda n: np.random.normal(self.mu, self.sigma, n),
+            self.lb, self.ub, num)
+
 class FixedInterval(object):
     def __init__(self, mean, config):
         self.value = mean
@@ -33,6 +54,9 @@ class FixedInterval(object):
     def next(self):
         return self.value
 
+    def sample(self, num):
+        return np.repeat(float(self.value), num)
+
 class UniformInterval(object):
     def __init__(self, mean, config):
         self.lb = config.get('lb', 0)
@@ -42,6 +66,9 @@ class UniformInterval(object):
     def next(self):
         return self.lb + random.random() * self.span
 
+    def sample(self, num):
+        return self.lb + np.random.random(num) * self.span
+
 class LogNormalInterval(object):
     def __init__(self, mean, config):
         self.lb = config.get('lb', 0)
@@ -55,6 +82,11 @@ class LogNormalInterval(object):
             ret = random.lognormvariate(self.mu, self.sigma)
         return ret
 
+    def sample(self, num):
+        return _truncated(
+            lambda n: np.random.lognormal(self.mu, self.sigma, n),
+            self.lb, self.ub, num)
+
 class ParetoInterval(object):
     def __init__(self, mean, config):
         """Shifted type II pareto.
@@ -73,6 +105,12 @@ class ParetoInterval(object):
             ret = random.paretovariate(self.a) + self.lb
         return ret
 
+    def sample(self, num):
+        #np.random.pareto is paretovariate - 1
+        return _truncated(
+            lambda n: np.random.pareto(self.a, n) + 1 + self.lb,
+            self.lb, self.ub, num)
+
 class DDistInterval(object):
     def __init__(self, mean, config):
         self.values = config['values']
@@ -103,6 +141,12 @@ class DDistInterval(object):
                 return self.values[i]
         assert False
 
+    def sample(self, num):
+        #the first bin with r <= b, as in next()
+        i = np.searchsorted(self.bins, np.random.random(num))
+        i = np.minimum(i, len(self.bins) - 1)
+        return np.asarray(self.values, dtype=float)[i]
+
 DISTRIBUTIONS = {
     'expo': ExpoInterval,
     'norm': NormInterval,
@@ -120,15 +164,10 @@ class RandInterval:
 
     @classmethod
     def generate(cls, key, mean, config={}, nrun=1000):
-        rintval = RandInterval.get(key, mean, config)
-        values = []
-        for i in range(nrun):
-            values.append(rintval.next())
-        return values
+        """An array of @nrun values drawn at once."""
+        return RandInterval.get(key, mean, config).sample(nrun)
 
 ### test ###
-import numpy as np
-
 def main():
     ntests = 10000
     #exponential distribution
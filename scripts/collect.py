@@ -1,3 +1,18 @@
+"""
+Collect the configs and results of the runs in a dir.
+
+    python -m scripts.collect <dir> <range> [--table <out file>]
+    python -m scripts.collect test
+
+Run it as a module from the root of the repo; as a file it cannot import the
+sim package.
+
+The result of a run is read from the __result__ json line written by the
+simulator, or scanned from the log in stdout for runs without it. The runs
+are printed as exp=(config, result) lines, or with --table written to <out
+file> as json lines, one per run, in a single pass.
+"""
+
 import math
 import os
 import re
@@ -8,27 +23,29 @@ try:
 except:
     pass
 
+from sim.configure import Configuration
+from sim.parse import CustomArgsParser
+from sim.perf import dumpResult, loadResult
+
+RESULT_FILE = '__result__'
+
 def readconfig(indir):
-    fn = '%s/__config__'%indir
+    configs = Configuration()
+    configs.read('%s/__config__'%indir)
+    return dict(configs.conf)
+
+def readrun(indir):
+    """The (config, result) of a run."""
+    config = readconfig(indir)
+    fn = '%s/%s'%(indir, RESULT_FILE)
+    if not os.path.exists(fn):
+        return config, readresult(indir)
     fh = open(fn, 'r')
-    config = {}
-    while True:
-        line = fh.readline()
-        if line == '':
-            break
-        line = line.strip()
-        if line == '':
-            continue
-        if line.startswith('#'):
-            continue
-        key, val = line.split('=')
-        key = key.strip()
-        val = val.strip()
-        if re.match('[/a-zA-Z.]+', val):
-            config[key] = val
-        else:
-            config[key] = eval(val)
-    return config
+    line = fh.readline()
+    fh.close()
+    #the config in the file is json, which has no tuples
+    unused, result = loadResult(line)
+    return config, dict([(str(k), v) for k, v in result.iteritems()])
 
 def readresult(indir):
     fn = '%s/stdout'%indir
@@ -44,7 +61,7 @@ def readresult(indir):
             continue
         if '#####  END  #####' in line:
             break
-        assert re.match('[_a-zA-Z]+\.INFO:', line), \
+        assert re.match('[_a-zA-Z.]+\.INFO:', line), \
                 'line not starts with ...INFO: %s'%line
         if re.search('[([{]', line):
             while True:
@@ -54,7 +71,7 @@ def readresult(indir):
                     break
                 #this line is not complete
                 next = fh.readline()
-                if next == '' or re.match('[a-zA-Z]+\.INFO:', next):
+                if next == '' or re.match('[_a-zA-Z.]+\.INFO:', next):
                     raise ValueError(
                         'line end but incomplete: %s, %s'%(line, next))
                 line += next
@@ -101,31 +118,102 @@ class RangeStringParser(object):
                     ret += range(int(ranges[0]), int(ranges[2]), int(ranges[1]))
         return ret
 
-def collect(indir, r):
+def collect(indir, r, table=None):
     dirs = RangeStringParser().parse(r)
+    if table is not None:
+        out = open(table, 'w')
     for d in dirs:
         rundir = '%s/%s'%(indir, d)
         if not os.path.isdir(rundir):
             print 'file: %s in %s'%(d, indir)
             continue
         try:
-            config = readconfig(rundir)
             try:
-                result = readresult(rundir)
+                config, result = readrun(rundir)
             except Exception as e:
                 print >> sys.stderr, 'Error in %s'%rundir
                 continue
             config['out.dir'] = str(d)
-            print 'exp=(%s,%s)'%(config, result)
+            if table is None:
+                print 'exp=(%s,%s)'%(config, result)
+            else:
+                out.write(dumpResult(config, result))
+                out.write('\n')
         except:
             print 'Error in %s'%rundir
             raise
+    if table is not None:
+        out.close()
+
+#####  TEST  #####
+def testRange():
+    print '===== test range ====='
+    parser = RangeStringParser()
+    assert parser.parse('[1, 3:6, 9]') == [1, 3, 4, 5, 9]
+    assert parser.parse('[0:2:7]') == [0, 2, 4, 6]
+    try:
+        parser.parse('1-3')
+        assert False
+    except SyntaxError:
+        pass
+    print 'test range passed'
+
+def testCollect():
+    print '===== test collect ====='
+    import shutil
+    import tempfile
+    indir = tempfile.mkdtemp()
+    try:
+        for d in ['0', '1']:
+            os.mkdir('%s/%s'%(indir, d))
+            fh = open('%s/%s/__config__'%(indir, d), 'w')
+            fh.write("num.zones = %s\nnw.latency.within.zone = ('fixed', 0)\n"
+                     %(int(d) + 1))
+            fh.close()
+        #0 has the result of the simulator, 1 only the log
+        fh = open('%s/0/%s'%(indir, RESULT_FILE), 'w')
+        fh.write(dumpResult({}, {'res.mean' : 10.0, 'verified' : True}))
+        fh.write('\n')
+        fh.close()
+        fh = open('%s/1/stdout'%indir, 'w')
+        fh.write('sim.simulate.INFO: \n#####  PROFILING RESULTS  #####\n'
+                 'sim.perf.INFO: res.mean = 20.0\n'
+                 'sim.perf.INFO: res.hist = ([1, 2],\n[0, 5, 10])\n'
+                 'sim.simulate.INFO: \n#####  END  #####\n')
+        fh.close()
+        table = '%s/table'%indir
+        collect(indir, '[0:3]', table)
+        fh = open(table, 'r')
+        runs = [loadResult(line) for line in fh]
+        fh.close()
+        assert len(runs) == 2
+        config, result = runs[0]
+        assert config['out.dir'] == '0' and config['num.zones'] == 1
+        assert result['res.mean'] == 10.0 and result['verified'] is True
+        config, result = runs[1]
+        assert config['out.dir'] == '1' and config['num.zones'] == 2
+        assert config['nw.latency.within.zone'] == ['fixed', 0]
+        assert result['res.mean'] == 20.0
+        assert result['res.hist'] == [[1, 2], [0, 5, 10]]
+    finally:
+        shutil.rmtree(indir)
+    print 'test collect passed'
+
+def test():
+    testRange()
+    testCollect()
 
 def main():
-    if len(sys.argv) != 3:
-        print 'collect <dir> <range>'
+    if sys.argv[1:] == ['test']:
+        test()
+        return
+    parser = CustomArgsParser(optKeys=['--table'])
+    parser.parse(sys.argv[1:])
+    if len(parser.getPosArgs()) != 2:
+        print 'collect <dir> <range> [--table <out file>]'
         sys.exit(-1)
-    collect(sys.argv[1], sys.argv[2])
+    collect(parser.getPosArg(0), parser.getPosArg(1),
+            parser.getOption('--table'))
 
 if __name__ == '__main__':
     main()
@@ -4,13 +4,14 @@ import matplotlib
 matplotlib.use('pdf')
 import matplotlib.pylab as plt
 
-from tpc import runModel as runTPCModel
-from tide import runModel as runTideModel
+from model.grid import mapPoints, runModelGrid
+from model.tpc import TPCModel, runModel as runTPCModel
+from model.tide import TideModel, runModel as runTideModel
 
 #runTPCModel(N, D, d, a, l, r, b, eta)
 #runTideModel(N, D, d, a, l, r, e)
 
-def impactOfLambda(outdir):
+def impactOfLambda(outdir, numProcs=1):
     N = 64
     D = 4096
     d = 32
@@ -20,13 +21,14 @@ def impactOfLambda(outdir):
     eta = 0
     e = 20
     X = [20, 40, 60, 80, 100]
-    tpcY = []
-    tideY = []
-    for a in X:
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, b, eta)
-        tpcY.append(ts)
-        nw, nr, nq, loss, ts = runTideModel(N, D, d, a, l, r, e)
-        tideY.append(ts)
+    #only the arrival rate changes, so each model is built once
+    rates = [1.0 / a for a in X]
+    tpcY = [ret[-1] for ret in
+            runModelGrid(TPCModel(N, D, d, X[0], l, r, b, eta),
+                         'arvRate', rates, numProcs=numProcs)]
+    tideY = [ret[-1] for ret in
+             runModelGrid(TideModel(N, D, d, X[0], l, r, e),
+                          'arvRate', rates, numProcs=numProcs)]
     fig = plt.figure()
     axes = fig.add_subplot(111)
     ltpc = axes.plot(X, tpcY, '-ob')
@@ -36,7 +38,7 @@ def impactOfLambda(outdir):
     fig.legend((ltpc, ltide), ('tpc', 'tide'))
     fig.savefig('%s/impact_of_lambda.pdf'%outdir)
 
-def impactOfNumItems(outdir):
+def impactOfNumItems(outdir, numProcs=1):
     N = 64
     D = 4096
     a = 100
@@ -46,13 +48,12 @@ def impactOfNumItems(outdir):
     eta = 0
     e = 20
     X = [2, 4, 8, 16, 32, 64]
-    tpcY = []
-    tideY = []
-    for d in X:
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, b, eta)
-        tpcY.append(ts)
-        nw, nr, nq, loss, ts = runTideModel(N, D, d, a, l, r, e)
-        tideY.append(ts)
+    tpcY = [ret[-1] for ret in
+            mapPoints(runTPCModel, [(N, D, d, a, l, r, b, eta) for d in X],
+                      numProcs)]
+    tideY = [ret[-1] for ret in
+             mapPoints(runTideModel, [(N, D, d, a, l, r, e) for d in X],
+                       numProcs)]
     fig = plt.figure()
     axes = fig.add_subplot(111)
     ltpc = axes.plot(X, tpcY, '-ob')
@@ -62,7 +63,7 @@ def impactOfNumItems(outdir):
     fig.legend((ltpc, ltide), ('tpc', 'tide'))
     fig.savefig('%s/impact_of_num_items.pdf'%outdir)
 
-def impactOfExecTime(outdir):
+def impactOfExecTime(outdir, numProcs=1):
     N = 64
     D = 4096
     d = 32
@@ -72,13 +73,12 @@ def impactOfExecTime(outdir):
     eta = 0
     e = 20
     X = [10, 20, 30, 40, 50]
-    tpcY = []
-    tideY = []
-    for r in X:
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, b, eta)
-        tpcY.append(ts)
-        nw, nr, nq, loss, ts = runTideModel(N, D, d, a, l, r, e)
-        tideY.append(ts)
+    tpcY = [ret[-1] for ret in
+            mapPoints(runTPCModel, [(N, D, d, a, l, r, b, eta) for r in X],
+                      numProcs)]
+    tideY = [ret[-1] for ret in
+             mapPoints(runTideModel, [(N, D, d, a, l, r, e) for r in X],
+                       numProcs)]
     fig = plt.figure()
     axes = fig.add_subplot(111)
     ltpc = axes.plot(X, tpcY, '-ob')
@@ -88,7 +88,7 @@ def impactOfExecTime(outdir):
     fig.legend((ltpc, ltide), ('tpc', 'tide'))
     fig.savefig('%s/impact_of_exec_time.pdf'%outdir)
 
-def impactOfMaxNumTxns(outdir):
+def impactOfMaxNumTxns(outdir, numProcs=1):
     D = 4096
     d = 32
     a = 100
@@ -98,13 +98,12 @@ def impactOfMaxNumTxns(outdir):
     eta = 0
     e = 20
     X = [2, 4, 8, 16, 32, 64]
-    tpcY = []
-    tideY = []
-    for N in X:
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, b, eta)
-        tpcY.append(ts)
-        nw, nr, nq, loss, ts = runTideModel(N, D, d, a, l, r, e)
-        tideY.append(ts)
+    tpcY = [ret[-1] for ret in
+            mapPoints(runTPCModel, [(N, D, d, a, l, r, b, eta) for N in X],
+                      numProcs)]
+    tideY = [ret[-1] for ret in
+             mapPoints(runTideModel, [(N, D, d, a, l, r, e) for N in X],
+                       numProcs)]
     fig = plt.figure()
     axes = fig.add_subplot(111)
     ltpc = axes.plot(X, tpcY, '-ob')
@@ -114,7 +113,7 @@ def impactOfMaxNumTxns(outdir):
     fig.legend((ltpc, ltide), ('tpc', 'tide'))
     fig.savefig('%s/impact_of_max_num_txns.pdf'%outdir)
 
-def impactOfBackoffTime(outdir):
+def impactOfBackoffTime(outdir, numProcs=1):
     N = 64
     D = 4096
     d = 32
@@ -124,13 +123,12 @@ def impactOfBackoffTime(outdir):
     eta = 0
     e = 20
     X = [10, 30, 50, 70, 90, 110, 130, 150]
-    tpcY = []
-    tideY = []
-    for b in X:
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, b, eta)
-        tpcY.append(ts)
-        nw, nr, nq, loss, ts = runTideModel(N, D, d, a, l, r, e)
-        tideY.append(ts)
+    tpcY = [ret[-1] for ret in
+            mapPoints(runTPCModel, [(N, D, d, a, l, r, b, eta) for b in X],
+                      numProcs)]
+    tideY = [ret[-1] for ret in
+             mapPoints(runTideModel, [(N, D, d, a, l, r, e) for b in X],
+                       numProcs)]
     fig = plt.figure()
     axes = fig.add_subplot(111)
     ltpc = axes.plot(X, tpcY, '-ob')
@@ -140,7 +138,7 @@ def impactOfBackoffTime(outdir):
     fig.legend((ltpc, ltide), ('tpc', 'tide'))
     fig.savefig('%s/impact_of_backoff_time.pdf'%outdir)
 
-def impactOfEta(outdir):
+def impactOfEta(outdir, numProcs=1):
     N = 8
     D = 4096
     a = 10
@@ -148,16 +146,15 @@ def impactOfEta(outdir):
     r = 10
     e = 0
     X = [4, 8, 16, 32, 64, 128]
-    tpcY = []
-    tideY = []
-    tpc5Y = []
-    for d in X:
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, 100, 0)
-        tpcY.append(ts)
-        nw, nr, nq, loss, ts = runTideModel(N, D, d, a, l, r, e)
-        tideY.append(ts)
-        nw, nr, nq, loss, ts = runTPCModel(N, D, d, a, l, r, 1, 0.5)
-        tpc5Y.append(ts)
+    tpcY = [ret[-1] for ret in
+            mapPoints(runTPCModel, [(N, D, d, a, l, r, 100, 0) for d in X],
+                      numProcs)]
+    tideY = [ret[-1] for ret in
+             mapPoints(runTideModel, [(N, D, d, a, l, r, e) for d in X],
+                       numProcs)]
+    tpc5Y = [ret[-1] for ret in
+             mapPoints(runTPCModel, [(N, D, d, a, l, r, 1, 0.5) for d in X],
+                       numProcs)]
     fig = plt.figure()
     axes = fig.add_subplot(111)
     ltpc = axes.plot(X, tpcY, '-ob')
@@ -169,16 +166,17 @@ def impactOfEta(outdir):
     fig.savefig('%s/impact_of_eta.pdf'%outdir)
 
 def main():
-    if len(sys.argv) != 2:
-        print 'runmodel <outdir>'
+    if len(sys.argv) not in (2, 3):
+        print 'runmodel <outdir> [num procs]'
         sys.exit(-1)
     outdir = sys.argv[1]
-    #impactOfLambda(outdir)
-    #impactOfNumItems(outdir)
-    #impactOfExecTime(outdir)
-    #impactOfMaxNumTxns(outdir)
-    #impactOfBackoffTime(outdir)
-    impactOfEta(outdir)
+    numProcs = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+    #impactOfLambda(outdir, numProcs)
+    #impactOfNumItems(outdir, numProcs)
+    #impactOfExecTime(outdir, numProcs)
+    #impactOfMaxNumTxns(outdir, numProcs)
+    #impactOfBackoffTime(outdir, numProcs)
+    impactOfEta(outdir, numProcs)
 
 if __name__ == '__main__':
     main()
@@ -1,12 +1,141 @@
+"""
+Run simulations in a pool of worker processes.
+
+    python -m scripts.runsim <in dir> <range> [num procs]
+    python -m scripts.runsim test
+
+The scripts are modules of the scripts package, run from the root of the
+repo as above. Run as a file, e.g. python scripts/runsim.py, the sim package
+is not on the path.
+
+Every numbered config dir of <in dir> within <range>, e.g. 0-99, is a task.
+A worker imports the simulator once and runs the tasks in process, writing
+the log to stdout and stderr in the run dir as before. Each worker takes the
+next task as soon as it finishes one, so long runs do not hold back the short
+ones.
+
+The result dict of a task is written to __result__ in the run dir and sent
+back to the runner, which appends it to <in dir>/__results__ as a json line
+(see sim.perf.dumpResult) and the run dir to <in dir>/__completed__.
+Completed run dirs are skipped, so an interrupted run resumes where it
+stopped.
+"""
+
+import datetime
+import itertools
+import logging
+import logging.config
+import multiprocessing
 import os
-import subprocess
 import sys
 import time
-import datetime
+import traceback
+
+from sim.configure import Configuration
+from sim.perf import dumpResult, loadResult
+import sim.simulate
+
+COMPLETED_FILE = '__completed__'
+RESULTS_FILE = '__results__'
+
+def initLogging(outdir):
+    logcfg = '%s/__logcfg__'%outdir
+    if outdir is not None and os.path.exists(logcfg):
+        #loggers of the previous runs in this process are kept enabled
+        logging.config.fileConfig(logcfg, disable_existing_loggers=False)
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        logging.Formatter('%(name)s.%(levelname)s: %(message)s'))
+    root.addHandler(handler)
+    #without a run dir, only the warnings are worth the formatting
+    root.setLevel(logging.INFO if outdir is not None else logging.WARNING)
+
+def closeLogging():
+    manager = logging.Logger.manager
+    loggers = [logging.getLogger()] + [
+        logger for logger in manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)]
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+def runTask(task):
+    """Run a simulation task of (out dir, configs).
+
+    If configs is None, it is read from the __config__ in out dir. If out dir
+    is None, the run is in memory only: nothing is written and the log goes
+    to stdout of the worker. Returns (out dir, config dict, result, error,
+    elapsed time), where error is the traceback if the run fails.
+
+    """
+    outdir, configs = task
+    start = time.time()
+    stdout, stderr = sys.stdout, sys.stderr
+    if outdir is not None:
+        outfh = open('%s/stdout'%outdir, 'w')
+        errfh = open('%s/stderr'%outdir, 'w')
+        sys.stdout, sys.stderr = outfh, errfh
+    resultFile = None
+    if outdir is not None:
+        resultFile = '%s/%s'%(outdir, sim.simulate.RESULT_FILE)
+    result = None
+    error = None
+    try:
+        try:
+            if configs is None:
+                configs = Configuration()
+                configs.read('%s/__config__'%outdir)
+            initLogging(outdir)
+            configs['system.should.verify'] = True
+            result = sim.simulate.run(configs, verify=True,
+                                      resultFile=resultFile)
+        except Exception:
+            error = traceback.format_exc()
+            print >> sys.stderr, error
+    finally:
+        closeLogging()
+        sys.stdout, sys.stderr = stdout, stderr
+        if outdir is not None:
+            outfh.close()
+            errfh.close()
+    config = configs.conf if configs is not None else {}
+    return outdir, config, result, error, time.time() - start
+
+def runTasks(tasks, numProcs=1):
+    """Run @tasks and yield the output of runTask as each finishes."""
+    if numProcs == 1:
+        for output in itertools.imap(runTask, tasks):
+            yield output
+        return
+    pool = multiprocessing.Pool(numProcs)
+    try:
+        for output in pool.imap_unordered(runTask, tasks, chunksize=1):
+            yield output
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def readCompleted(indir):
+    fn = '%s/%s'%(indir, COMPLETED_FILE)
+    if not os.path.exists(fn):
+        return set([])
+    fh = open(fn, 'r')
+    completed = set([line.strip() for line in fh if line.strip() != ''])
+    fh.close()
+    return completed
 
 def run(indir, r, numProcs=1):
-    commands = []
+    tasks = []
     lb, ub = parseRange(r)
+    completed = readCompleted(indir)
     for cfgdir in os.listdir(indir):
         if not os.path.isdir('%s/%s'%(indir, cfgdir)):
             continue
@@ -16,11 +145,41 @@ def run(indir, r, numProcs=1):
             continue
         if lb > index or index > ub:
             continue
-        rundir = '%s/%s'%(indir, cfgdir)
-        command = 'python%s sim.py %s --verify' %(
-            os.environ['PYTHON_SIM_VERSION'], rundir)
-        commands.append((command, '%s/stdout'%rundir, '%s/stderr'%rundir))
-    runCommands(commands, numProcs)
+        if cfgdir in completed:
+            continue
+        tasks.append(('%s/%s'%(indir, cfgdir), None))
+    tasks.sort(key=lambda task: int(os.path.basename(task[0])))
+    print 'running %s tasks, %s completed before' %(len(tasks), len(completed))
+    start = time.time()
+    numFailed = 0
+    donefh = open('%s/%s'%(indir, COMPLETED_FILE), 'a')
+    resfh = open('%s/%s'%(indir, RESULTS_FILE), 'a')
+    for count, output in enumerate(runTasks(tasks, numProcs)):
+        rundir, config, result, error, elapsed = output
+        cfgdir = os.path.basename(rundir)
+        if error is not None:
+            numFailed += 1
+            print 'Error in %s, see %s/stderr' %(rundir, rundir)
+        else:
+            config = dict(config)
+            config['out.dir'] = cfgdir
+            resfh.write(dumpResult(config, result))
+            resfh.write('\n')
+            resfh.flush()
+            donefh.write('%s\n'%cfgdir)
+            donefh.flush()
+        #progress with an estimate from the average wall clock per task
+        wallclock = time.time() - start
+        left = len(tasks) - count - 1
+        print '[%s/%s] %s in %.1fs, eta %.0fs' %(
+            count + 1, len(tasks), rundir, elapsed,
+            wallclock / (count + 1) * left)
+        sys.stdout.flush()
+    donefh.close()
+    resfh.close()
+    if numFailed != 0:
+        print '%s tasks failed' %numFailed
+        return
     #write a success mark
     fh = open('%s/__success__'%indir, 'w')
     fh.write(str(datetime.datetime.now()))
@@ -31,34 +190,55 @@ def parseRange(r):
     lb, ub = r.split('-')
     return int(lb), int(ub)
 
-def runCommands(commands, numProcs):
-    procs = []
-    while True:
-        #first remove processes that are finished
-        for proc, fh in list(procs):
-            if proc.poll() is not None:
-                procs.remove((proc, fh))
-                fh.close()
-        #check terminate condition
-        if len(procs) == 0 and len(commands) == 0:
-            break
-        #try to launch new commands if we can
-        if len(procs) < numProcs and len(commands) != 0:
-            for i in range(len(procs), numProcs):
-                command, outfile, errfile = commands.pop()
-                print command, '1>', outfile, '2>', errfile
-                outfh = open(outfile, 'w')
-                errfh = open(errfile, 'w')
-                proc = subprocess.Popen(
-                    command.split(' '), stdout=outfh, stderr=errfh)
-                procs.append((proc, outfh))
-                if len(commands) == 0:
-                    break
-        time.sleep(10)
+#####  TEST  #####
+def testRun():
+    print '===== test run ====='
+    import shutil
+    import tempfile
+    from sim.configure import DEFAULT_CONFIG, readDefault
+    indir = tempfile.mkdtemp()
+    try:
+        for cfgdir in ['0', '1', '2', '5']:
+            os.mkdir('%s/%s'%(indir, cfgdir))
+            shutil.copy(DEFAULT_CONFIG, '%s/%s/__config__'%(indir, cfgdir))
+        #2 is completed before and 5 is out of the range
+        fh = open('%s/%s'%(indir, COMPLETED_FILE), 'w')
+        fh.write('2\n')
+        fh.close()
+        run(indir, '0-3', 2)
+        assert os.path.exists('%s/__success__'%indir)
+        assert readCompleted(indir) == set(['0', '1', '2'])
+        fh = open('%s/%s'%(indir, RESULTS_FILE), 'r')
+        lines = fh.readlines()
+        fh.close()
+        outdirs = []
+        for line in lines:
+            config, result = loadResult(line)
+            assert result['verified'] is True
+            outdirs.append(config['out.dir'])
+        assert sorted(outdirs) == ['0', '1']
+        assert os.path.exists('%s/0/%s'%(indir, sim.simulate.RESULT_FILE))
+        #a resumed run skips the completed dirs
+        run(indir, '0-3')
+        fh = open('%s/%s'%(indir, RESULTS_FILE), 'r')
+        assert len(fh.readlines()) == 2
+        fh.close()
+        #a run in memory writes nothing
+        outdir, config, result, error, elapsed = runTask((None, readDefault()))
+        assert error is None and result['verified'] is True
+    finally:
+        shutil.rmtree(indir)
+    print 'test run passed'
+
+def test():
+    testRun()
 
 def main():
+    if sys.argv[1:] == ['test']:
+        test()
+        return
     if len(sys.argv) < 3:
-        print 'run.py <in dir> <range> [num procs]'
+        print 'runsim <in dir> <range> [num procs]'
         sys.exit(-1)
     if len(sys.argv) == 3:
         run(sys.argv[1], sys.argv[2])
@@ -1,44 +1,29 @@
 import math
 import sys
 
+import numpy as np
 import matplotlib
 matplotlib.use('pdf')
 import matplotlib.pylab as plt
 from matplotlib.ticker import MaxNLocator
 
-from model.ddist import DDist
+from model import cache
 from model.execute import calcNDetmnExec
 from model.execute import calcDetmnExec
-from model.protocol import getSLPLatencyDist
 from model.protocol import getFPLatencyDist
-from model.protocol import getEPLatencyDist
-from model.system import calcNDetmnSystem
-from model.system import calcDetmnSystem
-from model.system import ExceedsCountMaxException
-from model.system import NotConvergeException
+from model.system import calcNDetmnSystemGrid
+from model.system import calcDetmnSystemGrid
+from model.system import EXCEEDS_COUNT_MAX, NOT_CONVERGE
 
 matplotlib.rc('xtick', labelsize=24)
 matplotlib.rc('ytick', labelsize=24)
 matplotlib.rc('font', size=24)
 matplotlib.rc('lines', markersize=14)
 
-DDists = { }
-
-def getDDist(config):
-    try:
-        key, mean, cfg = config
-    except:
-        key, mean = config
-        cfg = {}
-    strings = []
-    strings.append(str(key))
-    strings.append(str(mean))
-    for key, val in cfg.iteritems():
-        strings.append('%s=%s'%(key, val))
-    ddistkey = ' '.join(strings)
-    if ddistkey not in DDists:
-        DDists[ddistkey] = DDist.sample(config, h=1.0)
-    return DDists[ddistkey]
+#the plots are from sampled ddists; to bound the intervals of the analyses
+#built on them, pass maxBins, e.g. model.ddist.MAX_BINS
+def getDDist(config, maxBins=None):
+    return cache.sample(config, h=1.0, maxBins=maxBins)
 
 class DataPoints(object):
     def __init__(self):
@@ -82,41 +67,34 @@ def show_sysres(n, k, s, lambds, lmeans):
             if key not in lines:
                 lines[key] = {}
             lines[key][lambd] = DataPoints()
-    #compute
-    for lambd in lambds:
-        for lmean in lmeans:
-            c = 2 * lmean
-            rs = s
-            rc = c
-            C = lmean
-            try:
-                res, m, count, params = calcNDetmnSystem(n, k, s, c, rs, rc, lambd, C)
-            except ExceedsCountMaxException as e:
-                res, m, count = e.args
-                print 'Exceeds COUNT_MAX, res=%s, m=%s, count=%s'%(res, m, count)
-                continue
-            except NotConvergeException as e:
-                res, m, count = e.args
-                print ('Not converge, n=%s, k=%s, s=%s, lambd=%s, lmean=%s, '
-                       'res=%s, m=%s, count=%s'
-                       % (n, k, s, lambd, lmean, res, m, count))
-                continue
-            lines['nd'][lambd].add(lmean, res)
-            print 'nd', lambd, lmean, res
-            try:
-                res, m, count, params = calcDetmnSystem(n, k, s, lambd, 3 * lmean)
-            except ExceedsCountMaxException as e:
-                res, m, count = e.args
-                print 'Exceeds COUNT_MAX, res=%s, m=%s, count=%s'%(res, m, count)
-                continue
-            except NotConvergeException as e:
-                res, m, count = e.args
-                print ('Not converge, n=%s, k=%s, s=%s, lambd=%s, lmean=%s, '
-                       'res=%s, m=%s, count=%s'
-                       % (n, k, s, lambd, lmean, res, m, count))
-                continue
-            lines['de'][lambd].add(lmean, res)
-            print 'de', lambd, lmean, res
+    #compute all the points at once, lambdas by rows and lmeans by columns
+    lambdv = np.array(lambds, dtype=float).reshape(-1, 1)
+    lmeanv = np.array(lmeans, dtype=float).reshape(1, -1)
+    c = 2 * lmeanv
+    rs = s
+    rc = c
+    C = lmeanv
+    results = {
+        'nd' : calcNDetmnSystemGrid(n, k, s, c, rs, rc, lambdv, C),
+        'de' : calcDetmnSystemGrid(n, k, s, lambdv, 3 * lmeanv),
+    }
+    for i, lambd in enumerate(lambds):
+        for j, lmean in enumerate(lmeans):
+            for key in ['nd', 'de']:
+                res, m, count, status, params = results[key]
+                res, m, count, status = \
+                        res[i, j], m[i, j], count[i, j], status[i, j]
+                if status == EXCEEDS_COUNT_MAX:
+                    print 'Exceeds COUNT_MAX, res=%s, m=%s, count=%s'%(
+                        res, m, count)
+                    break
+                if status == NOT_CONVERGE:
+                    print ('Not converge, n=%s, k=%s, s=%s, lambd=%s, lmean=%s, '
+                           'res=%s, m=%s, count=%s'
+                           % (n, k, s, lambd, lmean, res, m, count))
+                    break
+                lines[key][lambd].add(lmean, res)
+                print key, lambd, lmean, res
     #plot
     fig = plt.figure()
     axes = fig.add_subplot(111)
@@ -272,10 +250,10 @@ def show_spvsep(n, elen, mean, lb, ub, sigmas, lambds):
     #compute
     for lambd in lambds:
         for ddist in ddists:
-            res, delay, rtrip = getSLPLatencyDist(n, ddist, lambd)
+            res, delay, rtrip = cache.getSLPLatencyDist(n, ddist, lambd)
             lines[lambd]['sp'].add(ddist.std / ddist.mean, res.mean)
             print 'sp', res.mean
-            res, delay, rtrip = getEPLatencyDist(n, ddist, sync, elen)
+            res, delay, rtrip = cache.getEPLatencyDist(n, ddist, sync, elen)
             lines[lambd]['ep'].add(ddist.std / ddist.mean, res.mean)
             print 'ep', res.mean
     #plot
@@ -323,7 +301,8 @@ def show_spvsfp(n, m, lb, ub, sigmas, lambds):
     #compute
     for lambd in lambds:
         for sigma in sigmas:
-            res, delay, rtrip = getSLPLatencyDist(n, ddists[sigma], lambd)
+            res, delay, rtrip = cache.getSLPLatencyDist(n, ddists[sigma],
+                                                        lambd)
             lines['sp'][sigma].add(lambd * 2 * m, res.mean)
             print 'sp', res.mean
             res, eN = getFPLatencyDist(n, ddists[sigma], lambd)
@@ -376,7 +355,7 @@ def show_epelen(n, mean, lb, ub, sigmas, elens):
     #compute
     for elen in elens:
         for i, ddist in enumerate(ddists):
-            res, delay, rtrip = getEPLatencyDist(n, ddist, sync, elen)
+            res, delay, rtrip = cache.getEPLatencyDist(n, ddist, sync, elen)
             lines[sigmas[i]].add(elen, res.mean)
             print 'ep', res.mean
     #plot
@@ -411,7 +390,7 @@ def show_epsynch(n, elen, mean, sigma, lb, ub, synchubs):
     #compute
     for synchub in synchubs:
         sync = getDDist(('uniform', -1, {'lb':0, 'ub':synchub}))
-        res, delay, rtrip = getEPLatencyDist(n, ddist, sync, elen)
+        res, delay, rtrip = cache.getEPLatencyDist(n, ddist, sync, elen)
         lines['synch'].add(synchub, res.mean)
         print 'ep', res.mean
     #plot
@@ -432,6 +411,7 @@ def main():
         print
         sys.exit()
     key = sys.argv[1]
+    cache.setDir('tmp/cache')
     args = sys.argv[2]
     if key == 'sysres':
         try:
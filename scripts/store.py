@@ -0,0 +1,282 @@
+"""
+Result store of experiments.
+
+    python -m scripts.store <result file> <db file>
+    python -m scripts.store test
+
+Run it as a module from the root of the repo; as a file it cannot import the
+sim package.
+
+A result file is either the exp=(config, result) lines printed by collect or
+the json lines written by collect --table and runsim. The store keeps every
+run as a row of an SQLite table, with a column for each config and result
+key. Numbers and strings are stored as they are, other values by a canonical
+string, so that e.g. ('fixed', 0) and ['fixed', 0] are the same. Config
+columns are indexed.
+
+Queries return vectors of the selected keys for plotting:
+
+    store = ResultStore.open('results.db')
+    data = store.select(['load.mean', 'res.mean'],
+                        {'system.impl' : 'sim.impl.cdetmn.CentralDetmnSystem'},
+                        order='load.mean')
+
+or the (config, result) pairs of the matching runs with getParams(where).
+String columns can also be matched by SQL LIKE patterns, e.g.
+like={'system.impl' : '%cdylock%'}.
+"""
+
+import cPickle
+import os
+import sqlite3
+import sys
+
+import numpy
+
+from sim.perf import loadResult
+
+RUN_COLUMN = '__run__'
+
+def canonical(value):
+    """The column value of a config or result value."""
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    if isinstance(value, basestring):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    return _canonicalStr(value)
+
+def _canonicalStr(value):
+    if isinstance(value, dict):
+        items = sorted([(_canonicalStr(k), _canonicalStr(v))
+                        for k, v in value.iteritems()])
+        return '{%s}'%(', '.join(['%s: %s'%item for item in items]))
+    if isinstance(value, (list, tuple)):
+        return '(%s)'%(', '.join([_canonicalStr(v) for v in value]))
+    if isinstance(value, unicode):
+        try:
+            value = str(value)
+        except UnicodeEncodeError:
+            pass
+    return repr(value)
+
+def quote(key):
+    return '"%s"'%key.replace('"', '""')
+
+def readRuns(fn):
+    """Yield the (config, result) of each run in a result file."""
+    fh = open(fn, 'r')
+    for line in fh:
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            config, result = loadResult(line)
+            config = dict([(str(k), v) for k, v in config.iteritems()])
+            result = dict([(str(k), v) for k, v in result.iteritems()])
+        else:
+            key, val = line.split('=', 1)
+            config, result = eval(val.strip())
+        yield config, result
+    fh.close()
+
+class ResultStore(object):
+    TABLE = 'runs'
+    def __init__(self, fn):
+        self.conn = sqlite3.connect(fn)
+        self.conn.text_factory = str
+        self.conn.execute('CREATE TABLE IF NOT EXISTS %s (%s BLOB)'
+                          %(ResultStore.TABLE, quote(RUN_COLUMN)))
+        self.columns = set([])
+        for row in self.conn.execute('PRAGMA table_info(%s)'
+                                     %ResultStore.TABLE):
+            self.columns.add(str(row[1]))
+
+    @classmethod
+    def open(cls, fn):
+        """Open a db file, or load a result file into a memory db."""
+        if fn.endswith('.db'):
+            if not os.path.exists(fn):
+                raise ValueError('no result db: %s'%fn)
+            return ResultStore(fn)
+        store = ResultStore(':memory:')
+        store.insert(readRuns(fn))
+        return store
+
+    def _addColumns(self, keys, index=False):
+        for key in sorted(keys):
+            if key in self.columns:
+                continue
+            self.conn.execute('ALTER TABLE %s ADD COLUMN %s'
+                              %(ResultStore.TABLE, quote(key)))
+            self.columns.add(key)
+            if index:
+                self.conn.execute(
+                    'CREATE INDEX %s ON %s (%s)'
+                    %(quote('idx_%s'%key), ResultStore.TABLE, quote(key)))
+
+    def insert(self, runs):
+        """Insert the (config, result) @runs in one transaction."""
+        runs = list(runs)
+        configKeys = set([])
+        resultKeys = set([])
+        for config, result in runs:
+            configKeys.update(config.keys())
+            resultKeys.update(result.keys())
+        self._addColumns(configKeys, index=True)
+        self._addColumns(resultKeys - configKeys)
+        if len(runs) == 0:
+            return
+        keys = sorted(configKeys | resultKeys)
+        rows = []
+        for config, result in runs:
+            row = [sqlite3.Binary(cPickle.dumps((config, result), 2))]
+            for key in keys:
+                #a key in both is a config, as indexed
+                value = config[key] if key in config else result.get(key)
+                row.append(canonical(value))
+            rows.append(row)
+        self.conn.executemany(
+            'INSERT INTO %s (%s) VALUES (%s)'
+            %(ResultStore.TABLE,
+              ', '.join([quote(RUN_COLUMN)] + [quote(k) for k in keys]),
+              ', '.join(['?'] * (len(keys) + 1))),
+            rows)
+        self.conn.commit()
+
+    def _where(self, where, like=None):
+        clauses = []
+        args = []
+        for key, pattern in sorted((like or {}).iteritems()):
+            if key not in self.columns:
+                return ' WHERE 0', []
+            clauses.append('%s LIKE ?'%quote(key))
+            args.append(pattern)
+        for key, value in sorted((where or {}).iteritems()):
+            if key not in self.columns:
+                #no run has the key
+                return ' WHERE 0', []
+            if isinstance(value, set):
+                values = [canonical(v) for v in value]
+                clauses.append('%s IN (%s)'
+                               %(quote(key), ', '.join(['?'] * len(values))))
+                args.extend(values)
+            elif value is None:
+                clauses.append('%s IS NULL'%quote(key))
+            else:
+                clauses.append('%s = ?'%quote(key))
+                args.append(canonical(value))
+        if len(clauses) == 0:
+            return '', []
+        return ' WHERE %s'%(' AND '.join(clauses)), args
+
+    def count(self, where=None, like=None):
+        clause, args = self._where(where, like)
+        return self.conn.execute('SELECT COUNT(*) FROM %s%s'
+                                 %(ResultStore.TABLE, clause), args).next()[0]
+
+    def select(self, keys, where=None, order=None, like=None):
+        """Vectors of @keys of the runs matching @where.
+
+        @where maps a key to a value, or to a set of values. Vectors of
+        numbers are numpy arrays, others are lists of the column values.
+
+        """
+        for key in keys:
+            if key not in self.columns:
+                raise ValueError('no such key: %s'%key)
+        clause, args = self._where(where, like)
+        if order is not None:
+            clause += ' ORDER BY %s'%quote(order)
+        rows = self.conn.execute(
+            'SELECT %s FROM %s%s'
+            %(', '.join([quote(k) for k in keys]), ResultStore.TABLE, clause),
+            args).fetchall()
+        ret = {}
+        for i, key in enumerate(keys):
+            column = [row[i] for row in rows]
+            if all([isinstance(v, (int, long, float)) for v in column]):
+                column = numpy.array(column, dtype=float)
+            ret[key] = column
+        return ret
+
+    def getParams(self, where=None, like=None):
+        """The (config, result) of the runs matching @where and @like."""
+        clause, args = self._where(where, like)
+        rows = self.conn.execute('SELECT %s FROM %s%s'
+                                 %(quote(RUN_COLUMN), ResultStore.TABLE,
+                                   clause), args)
+        return [cPickle.loads(str(row[0])) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+#####  TEST  #####
+def testRoundTrip():
+    print '===== test round trip ====='
+    import shutil
+    import tempfile
+    from sim.perf import dumpResult
+    impl = 'sim.impl.cdetmn.CentralDetmnSystem'
+    runs = []
+    for i, zones in enumerate([1, 3, 5]):
+        config = {'system.impl' : impl, 'num.zones' : zones,
+                  'nw.latency.cross.zone' : ('fixed', 10 * i)}
+        result = {'res.mean' : 100.0 - i, 'verified' : True,
+                  'res.hist' : [[1, 2], [0, 5, 10]]}
+        runs.append((config, result))
+    path = tempfile.mkdtemp()
+    try:
+        #json lines of runsim and exp= lines of collect
+        fn = '%s/results'%path
+        fh = open(fn, 'w')
+        for config, result in runs[:2]:
+            fh.write('%s\n'%dumpResult(config, result))
+        fh.write('exp=(%s,%s)\n'%runs[2])
+        fh.close()
+        db = '%s/results.db'%path
+        store = ResultStore(db)
+        store.insert(readRuns(fn))
+        store.close()
+        store = ResultStore.open(db)
+        assert store.count() == 3
+        data = store.select(['num.zones', 'res.mean'], order='res.mean')
+        assert list(data['num.zones']) == [5, 3, 1]
+        assert list(data['res.mean']) == [98.0, 99.0, 100.0]
+        #a tuple config matches its json list
+        where = {'nw.latency.cross.zone' : ['fixed', 10]}
+        assert store.count(where) == 1
+        assert store.count({'num.zones' : set([1, 5])}) == 2
+        assert store.count(like={'system.impl' : '%cdetmn%'}) == 3
+        assert store.count({'no.such.key' : 1}) == 0
+        params = store.getParams({'num.zones' : 5})
+        assert len(params) == 1
+        config, result = params[0]
+        assert config == runs[2][0] and result == runs[2][1]
+        config, result = store.getParams({'num.zones' : 1})[0]
+        assert config['nw.latency.cross.zone'] == ['fixed', 0]
+        assert result['res.hist'] == [[1, 2], [0, 5, 10]]
+        store.close()
+    finally:
+        shutil.rmtree(path)
+    print 'test round trip passed'
+
+def test():
+    testRoundTrip()
+
+def main():
+    if sys.argv[1:] == ['test']:
+        test()
+        return
+    if len(sys.argv) != 3:
+        print 'store <result file> <db file>'
+        sys.exit(-1)
+    store = ResultStore(sys.argv[2])
+    store.insert(readRuns(sys.argv[1]))
+    print '%s runs in %s'%(store.count(), sys.argv[2])
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Parameter sweep of simulations.
+
+    python -m scripts.sweep <base config> <sweep spec> <out dir> [num procs]
+    python -m scripts.sweep test
+
+Run it as a module from the root of the repo; as a file it cannot import the
+sim package.
+
+The variants of the base config are expanded in memory and run in a pool of
+worker processes (see scripts.runsim) without a run dir each. The sweep spec
+is a config file like:
+
+    sweep.method = 'lhs'            #'grid', 'random' or 'lhs'
+    sweep.num.samples = 50          #for 'random' and 'lhs'
+    sweep.num.replicas = 1          #runs of each variant
+    sweep.seed = 0
+    sweep.params = {
+        'epdetmn.epoch.length' : ('uniform', 10, 100),
+        'txn.arrive.interval.dist[1]' : ('loguniform', 10, 1000),
+        'num.zones' : [3, 5, 7],
+    }
+
+A param is a list of values, or a range of ('uniform', lb, ub),
+('loguniform', lb, ub) or ('int', lb, ub), where 'int' includes ub. A grid
+takes every combination of the values, so a range needs a number of points,
+e.g. ('uniform', 10, 100, 10). A key ending with indices, e.g.
+'txn.arrive.interval.dist[1]', replaces an item of the config value.
+
+Each variant has its content hash in 'sweep.hash'. The results are appended
+to <out dir>/__results__ as json lines (see sim.perf.dumpResult), and the
+variants whose hash is already there are skipped, so a sweep can be resumed
+or extended with more points.
+"""
+
+import hashlib
+import itertools
+import math
+import os
+import random
+import re
+import sys
+import time
+
+from sim.configure import Configuration
+from sim.perf import dumpResult, loadResult
+from scripts.runsim import RESULTS_FILE, runTasks
+from scripts.store import canonical
+
+HASH_KEY = 'sweep.hash'
+REPLICA_KEY = 'sweep.replica'
+#keys set by the runner, not part of a variant
+IGNORED_KEYS = set([HASH_KEY, 'out.dir', 'system.should.verify'])
+
+def configHash(config):
+    """Content hash of a config dict, equal for equal values."""
+    items = sorted([(key, canonical(val))
+                    for key, val in config.iteritems()
+                    if key not in IGNORED_KEYS])
+    return hashlib.sha1(repr(items)).hexdigest()
+
+def _replace(value, indices, item):
+    if len(indices) == 0:
+        return item
+    index = indices[0]
+    if isinstance(value, dict):
+        new = dict(value)
+        new[index] = _replace(value[index], indices[1:], item)
+        return new
+    new = list(value)
+    new[index] = _replace(value[index], indices[1:], item)
+    return tuple(new) if isinstance(value, tuple) else new
+
+def setParam(configs, key, value):
+    """Set @key of @configs, where key may end with indices, e.g. a[1]."""
+    match = re.match(r'^([^\[]+)((\[[^\]]+\])+)$', key)
+    if match is None:
+        configs[key] = value
+        return
+    name = match.group(1)
+    indices = [eval(index) for index in re.findall(r'\[([^\]]+)\]',
+                                                   match.group(2))]
+    if configs.get(name) is None:
+        raise ValueError('no config to index: %s'%key)
+    configs[name] = _replace(configs[name], indices, value)
+
+def getPoints(spec):
+    """The grid points of a param spec."""
+    if isinstance(spec, list):
+        return spec
+    try:
+        key, lb, ub, num = spec
+    except ValueError:
+        raise ValueError('grid range needs a number of points: %s'%(spec, ))
+    if key == 'int':
+        step = max(float(ub - lb) / max(num - 1, 1), 1)
+        return sorted(set([int(round(lb + i * step)) for i in range(num)
+                           if lb + i * step <= ub]))
+    if num == 1:
+        return [lb]
+    if key == 'uniform':
+        return [lb + (ub - lb) * float(i) / (num - 1) for i in range(num)]
+    if key == 'loguniform':
+        llb, lub = math.log(lb), math.log(ub)
+        return [math.exp(llb + (lub - llb) * float(i) / (num - 1))
+                for i in range(num)]
+    raise ValueError('unknown param range: %s'%key)
+
+def getValue(spec, u):
+    """The value of a param spec at quantile @u in [0, 1)."""
+    if isinstance(spec, list):
+        return spec[int(u * len(spec))]
+    key, lb, ub = spec[:3]
+    if key == 'uniform':
+        return lb + (ub - lb) * u
+    if key == 'loguniform':
+        llb, lub = math.log(lb), math.log(ub)
+        return math.exp(llb + (lub - llb) * u)
+    if key == 'int':
+        return lb + int(u * (ub - lb + 1))
+    raise ValueError('unknown param range: %s'%key)
+
+def expand(spec):
+    """Yield the param dicts of the sweep @spec."""
+    params = spec['sweep.params']
+    keys = sorted(params.keys())
+    method = spec.get('sweep.method', 'grid')
+    rand = random.Random(spec.get('sweep.seed', 0))
+    if method == 'grid':
+        for values in itertools.product(*[getPoints(params[key])
+                                          for key in keys]):
+            yield dict(zip(keys, values))
+        return
+    num = spec['sweep.num.samples']
+    if method == 'random':
+        for i in range(num):
+            yield dict([(key, getValue(params[key], rand.random()))
+                        for key in keys])
+    elif method == 'lhs':
+        #one sample in each of the num strata of every param
+        strata = {}
+        for key in keys:
+            strata[key] = range(num)
+            rand.shuffle(strata[key])
+        for i in range(num):
+            yield dict([(key, getValue(params[key],
+                                       (strata[key][i] + rand.random()) / num))
+                        for key in keys])
+    else:
+        raise ValueError('unknown sweep method: %s'%method)
+
+def getVariants(base, spec):
+    """The distinct variant configs of @base, each with its hash."""
+    variants = []
+    hashes = set([])
+    for params in expand(spec):
+        for replica in range(spec.get('sweep.num.replicas', 1)):
+            configs = base.clone()
+            for key, value in sorted(params.iteritems()):
+                setParam(configs, key, value)
+            if replica != 0:
+                configs[REPLICA_KEY] = replica
+            h = configHash(configs.conf)
+            if h in hashes:
+                continue
+            hashes.add(h)
+            configs[HASH_KEY] = h
+            variants.append(configs)
+    return variants
+
+def readHashes(fn):
+    """The hashes of the runs in result file @fn."""
+    hashes = set([])
+    if not os.path.exists(fn):
+        return hashes
+    fh = open(fn, 'r')
+    for line in fh:
+        line = line.strip()
+        if line == '':
+            continue
+        config, result = loadResult(line)
+        config = dict([(str(k), v) for k, v in config.iteritems()])
+        hashes.add(config.get(HASH_KEY, configHash(config)))
+    fh.close()
+    return hashes
+
+def readConfig(path):
+    configs = Configuration()
+    if os.path.isdir(path):
+        path = '%s/__config__'%path
+    configs.read(path)
+    return configs
+
+def sweep(base, spec, outdir, numProcs=1):
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    fn = '%s/%s'%(outdir, RESULTS_FILE)
+    done = readHashes(fn)
+    variants = getVariants(base, spec)
+    tasks = [(None, configs) for configs in variants
+             if configs[HASH_KEY] not in done]
+    print 'running %s variants, %s computed before' %(
+        len(tasks), len(variants) - len(tasks))
+    start = time.time()
+    numFailed = 0
+    resfh = open(fn, 'a')
+    for count, output in enumerate(runTasks(tasks, numProcs)):
+        rundir, config, result, error, elapsed = output
+        h = config[HASH_KEY]
+        if error is not None:
+            numFailed += 1
+            print >> sys.stderr, 'Error in %s:\n%s' %(h, error)
+        else:
+            resfh.write(dumpResult(config, result))
+            resfh.write('\n')
+            resfh.flush()
+        wallclock = time.time() - start
+        left = len(tasks) - count - 1
+        print '[%s/%s] %s in %.1fs, eta %.0fs' %(
+            count + 1, len(tasks), h[:8], elapsed,
+            wallclock / (count + 1) * left)
+        sys.stdout.flush()
+    resfh.close()
+    if numFailed != 0:
+        print '%s variants failed' %numFailed
+
+#####  TEST  #####
+def testExpand():
+    print '===== test expand ====='
+    params = {
+        'epdetmn.epoch.length' : ('uniform', 10, 100, 4),
+        'num.zones' : [3, 5, 7],
+    }
+    spec = {'sweep.method' : 'grid', 'sweep.params' : params}
+    points = list(expand(spec))
+    assert len(points) == 12
+    assert sorted(set([p['epdetmn.epoch.length'] for p in points])) == \
+            [10, 40, 70, 100]
+    assert getPoints(('int', 1, 4, 10)) == [1, 2, 3, 4]
+    params = {
+        'epdetmn.epoch.length' : ('uniform', 10, 100),
+        'txn.arrive.interval.dist[1]' : ('loguniform', 10, 1000),
+        'num.zones' : [3, 5, 7],
+    }
+    spec = {'sweep.method' : 'random', 'sweep.num.samples' : 20,
+            'sweep.params' : params}
+    points = list(expand(spec))
+    assert len(points) == 20 and points == list(expand(spec))
+    for p in points:
+        assert 10 <= p['epdetmn.epoch.length'] < 100
+        assert 10 <= p['txn.arrive.interval.dist[1]'] < 1000
+        assert p['num.zones'] in [3, 5, 7]
+    spec['sweep.method'] = 'lhs'
+    points = list(expand(spec))
+    assert len(points) == 20
+    #one sample in each stratum of every param
+    strata = [int((p['epdetmn.epoch.length'] - 10) / 90.0 * 20)
+              for p in points]
+    assert sorted(strata) == range(20)
+    print 'test expand passed'
+
+def testVariants():
+    print '===== test variants ====='
+    from sim.configure import readDefault
+    base = readDefault()
+    spec = {
+        'sweep.method' : 'grid',
+        'sweep.num.replicas' : 2,
+        #the duplicated value gives the same variants
+        'sweep.params' : {
+            'num.zones' : [3, 3, 5],
+            'txn.arrive.interval.dist[1]' : [50, 100],
+        },
+    }
+    variants = getVariants(base, spec)
+    assert len(variants) == 8
+    hashes = set([configs[HASH_KEY] for configs in variants])
+    assert len(hashes) == 8
+    for configs in variants:
+        assert configs[HASH_KEY] == configHash(configs.conf)
+        dist = configs['txn.arrive.interval.dist']
+        assert dist[0] == base['txn.arrive.interval.dist'][0]
+        assert dist[1] in [50, 100]
+    assert len([c for c in variants if c.get(REPLICA_KEY) == 1]) == 4
+    #the base is not changed, and the hash ignores the keys of the runner
+    assert base.get(HASH_KEY) is None
+    config = dict(variants[0].conf)
+    config['out.dir'] = '0'
+    assert configHash(config) == variants[0][HASH_KEY]
+    print 'test variants passed'
+
+def testSweep():
+    print '===== test sweep ====='
+    import shutil
+    import tempfile
+    from sim.configure import readDefault
+    outdir = tempfile.mkdtemp()
+    try:
+        spec = {'sweep.method' : 'grid',
+                'sweep.params' : {'num.zones' : [3, 5]}}
+        sweep(readDefault(), spec, outdir, 2)
+        fn = '%s/%s'%(outdir, RESULTS_FILE)
+        assert len(readHashes(fn)) == 2
+        #the computed variants are skipped, the new one is run
+        spec['sweep.params']['num.zones'] = [3, 5, 7]
+        sweep(readDefault(), spec, outdir)
+        hashes = readHashes(fn)
+        assert len(hashes) == 3
+        assert hashes == set([configs[HASH_KEY] for configs in
+                              getVariants(readDefault(), spec)])
+    finally:
+        shutil.rmtree(outdir)
+    print 'test sweep passed'
+
+def test():
+    testExpand()
+    testVariants()
+    testSweep()
+
+def main():
+    if sys.argv[1:] == ['test']:
+        test()
+        return
+    if len(sys.argv) < 4:
+        print 'sweep <base config> <sweep spec> <out dir> [num procs]'
+        sys.exit(-1)
+    base = readConfig(sys.argv[1])
+    spec = readConfig(sys.argv[2])
+    numProcs = 1
+    if len(sys.argv) > 4:
+        numProcs = int(sys.argv[4])
+    sweep(base, spec, sys.argv[3], numProcs)
+
+if __name__ == '__main__':
+    main()
@@ -8,18 +8,16 @@ import matplotlib.pylab as plt
 from matplotlib.ticker import MaxNLocator
 from matplotlib.ticker import FuncFormatter
 
-from model.ddist import DDist
+from model import cache
 from model.execute import calcNDetmnExec
 from model.execute import calcDetmnExec
-from model.protocol import quorum
-from model.protocol import getSLPLatencyDist
-from model.protocol import getEPLatencyDist
 from model.protocol import getFPLatencyDist
 from model.system import calcNDetmnSystem
 from model.system import calcDetmnSystem
 from model.system import ExceedsCountMaxException
 from model.system import NotConvergeException
 from scripts.collect import readconfig
+from scripts.store import ResultStore
 
 #matplotlib.rcParams['text.usetex'] = True
 matplotlib.rc('xtick', labelsize=36)
@@ -27,8 +25,6 @@ matplotlib.rc('ytick', labelsize=36)
 matplotlib.rc('font', size=24)
 matplotlib.rc('lines', markersize=10)
 
-DDists = { }
-
 #def toPercent(y, position):
 #    return '%.0f%s'%(y, r'$^{\bf \%}$')
 
@@ -37,49 +33,30 @@ def toPercent(y, position):
 
 percentFormatter = FuncFormatter(toPercent)
 
-def readparams(rfile):
-    fh = open(rfile, 'r')
-    params = []
-    while True:
-        line = fh.readline()
-        if line == '':
-            break
-        line = line.strip()
-        if line == '':
-            continue
-        if line.startswith('#'):
-            continue
-        key, val = line.split('=')
-        val = val.strip()
-        params.append(eval(val))
-    fh.close()
-    return params
+#the runs each validation needs
+IMPL_PATTERNS = {
+    'nd' : '%cdylock%',
+    'de' : '%cdetmn%',
+    'sp' : '%slpdetmn%',
+    'ep' : '%epdetmn%',
+    'fp' : '%fpdetmn%',
+    'ndsys' : '%mstdylock%',
+    'desys' : '%slpdetmn%',
+}
 
-def getDDist(config):
-    try:
-        key, mean, cfg = config
-    except:
-        key, mean = config
-        cfg = {}
-    strings = []
-    strings.append(str(key))
-    strings.append(str(mean))
-    for key, val in cfg.iteritems():
-        strings.append('%s=%s'%(key, val))
-    ddistkey = ' '.join(strings)
-    if ddistkey not in DDists:
-        DDists[ddistkey] = DDist.sample(config, h=0.5)
-    return DDists[ddistkey]
+def readparams(rfile, key=None):
+    like = None
+    if key in IMPL_PATTERNS:
+        like = {'system.impl' : IMPL_PATTERNS[key]}
+    return ResultStore.open(rfile).getParams(like=like)
 
-def getQuorum(n, f, ddist):
-    if (n, f, ddist) not in DDists:
-        DDists[(n, f, ddist)] = quorum(n, f, ddist)
-    return DDists[(n, f, ddist)]
+#the plots are from sampled ddists; to bound the intervals of the analyses
+#built on them, pass maxBins, e.g. model.ddist.MAX_BINS
+def getDDist(config, maxBins=None):
+    return cache.sample(config, h=0.5, maxBins=maxBins)
 
 def getSLPL(z, ddist, lambd):
-    if (z, ddist, lambd) not in DDists:
-        DDists[(z, ddist, lambd)] = getSLPLatencyDist(z, ddist, lambd)[0].mean
-    return DDists[z, ddist, lambd]
+    return cache.getSLPLatencyDist(z, ddist, lambd)[0].mean
 
 paxoskeys = [
     'paxos.propose.total.time',
@@ -262,7 +239,7 @@ def validate_sp(params):
         arrkey, arrmean = arrive
         lambd = 1.0 / arrmean * n
         #model
-        resM, odelayM, rtripM = getSLPLatencyDist(n, ddist, lambd)
+        resM, odelayM, rtripM = cache.getSLPLatencyDist(n, ddist, lambd)
         #sim
         rtripS = result['paxos.propose.total.time.mean']
         odelayS = result['order.consensus.time.mean']
@@ -320,7 +297,8 @@ def validate_ep(params):
         skewcfg = config['epdetmn.epoch.skew.dist']
         skewdist = getDDist(skewcfg)
         #model
-        resM, odelayM, rtripM = getEPLatencyDist(n, ddist, skewdist, elen)
+        resM, odelayM, rtripM = cache.getEPLatencyDist(n, ddist, skewdist,
+                                                       elen)
         #sim
         rtripS = result['paxos.propose.total.time.mean']
         odelayS = result['order.consensus.time.mean']
@@ -418,7 +396,7 @@ def model_ndsys(confdir):
     nwdist = getDDist(network)
     z = config['num.zones']
     f = z / 2 + 1
-    q = quorum(z, f, nwdist)
+    q = cache.quorum(z, f, nwdist)
     c = q.mean
     rc = (c**2 + q.var) / 2 / c
     n = config['dataset.groups'][1]
@@ -452,7 +430,7 @@ def validate_ndsys(params):
         nwdist = getDDist(network)
         z = config['num.zones']
         f = z / 2 + 1
-        q = quorum(z, f, nwdist)
+        q = cache.quorum(z, f, nwdist)
         c = q.mean
         rc = (c**2 + q.var) / 2 / c
         n = config['dataset.groups'][1]
@@ -535,7 +513,7 @@ def validate_ndsys1(params):
         nwdist = getDDist(network)
         z = config['num.zones']
         f = z / 2 + 1
-        q = quorum(z, f, nwdist)
+        q = cache.quorum(z, f, nwdist)
         c = q.mean
         rc = (c**2 + q.var) / 2 / c
         n = config['dataset.groups'][1]
@@ -670,10 +648,11 @@ def validate_desys(params):
 
 def main():
     if len(sys.argv) != 3:
-        print 'validate <key> <result file>'
+        print 'validate <key> <result file or db>'
         print
         sys.exit()
     key = sys.argv[1]
+    cache.setDir('tmp/cache')
     if key == 'test':
         data = DataPoints()
         for i in range(5):
@@ -686,7 +665,7 @@ def main():
     elif key == 'model_ndsys':
         model_ndsys(sys.argv[2])
     else:
-        params = readparams(sys.argv[2])
+        params = readparams(sys.argv[2], key)
         if key == 'fp':
             validate_fp(params)
         elif key == 'sp':
@@ -0,0 +1,208 @@
+"""
+Local clocks of the nodes.
+
+A node reads its local clock instead of the simulation time when it makes
+time based decisions, e.g. when an epoch ends. The local clock is
+
+    local = now() + offset + drift * (now() - syncTime)
+
+where the offset is the error left by the last synchronization at syncTime
+and drift is the rate error of the oscillator, e.g. 1e-5 for 10ppm. The clock
+is configured by:
+
+    'clock.offset.dist'     initial offset, default ('fixed', 0)
+    'clock.drift.dist'      drift rate, default ('fixed', 0)
+    'clock.sync.interval'   NTP style synchronization interval, default never
+    'clock.sync.error.dist' offset after a synchronization, default ('fixed', 0)
+    'clock.timer.jitter.dist' lateness of a timer set by setAlarm, default
+                              ('fixed', 0)
+
+The distributions are RandInterval specs drawn once per node, except for the
+sync error which is drawn at each synchronization and the timer jitter which
+is drawn at each alarm. Offsets and rates are signed, so a 'norm' spec is not
+truncated at 0 unless 'lb' is given. The jitter is not signed: a timer fires
+in [delay + lb, 2 * delay], with lb defaulting to 0.
+"""
+
+import random
+import sys
+
+from SimPy.Simulation import now
+
+from rintvl import RandInterval
+from sim.core import Alarm, infinite
+
+def getSpec(spec):
+    try:
+        key, mean, cfg = spec
+    except ValueError:
+        key, mean = spec
+        cfg = {}
+    return key, mean, dict(cfg)
+
+def getSignedDist(spec):
+    key, mean, cfg = getSpec(spec)
+    if key == 'norm':
+        cfg.setdefault('lb', -sys.maxint)
+    return RandInterval.get(key, mean, cfg)
+
+class Clock(object):
+    """Local clock with offset, drift, periodic synchronization and timers.
+
+    Synchronizations happen lazily when the clock is read. Nodes synchronize
+    every 'clock.sync.interval' but with a random phase, so they do not jump
+    at the same time. Timers set by setAlarm fire late by the timer jitter.
+
+    """
+    OFFSET_KEY = 'clock.offset.dist'
+    DRIFT_KEY = 'clock.drift.dist'
+    SYNC_INTERVAL_KEY = 'clock.sync.interval'
+    SYNC_ERROR_KEY = 'clock.sync.error.dist'
+    JITTER_KEY = 'clock.timer.jitter.dist'
+    def __init__(self, configs):
+        self.offset = getSignedDist(
+            configs.get(Clock.OFFSET_KEY, ('fixed', 0))).next()
+        self.drift = getSignedDist(
+            configs.get(Clock.DRIFT_KEY, ('fixed', 0))).next()
+        if self.drift <= -1:
+            raise ValueError('drift = %s > -1' %self.drift)
+        self.syncInterval = configs.get(Clock.SYNC_INTERVAL_KEY, infinite)
+        if self.syncInterval != infinite and self.syncInterval <= 0:
+            raise ValueError('sync interval = %s > 0' %self.syncInterval)
+        self.syncError = getSignedDist(
+            configs.get(Clock.SYNC_ERROR_KEY, ('fixed', 0)))
+        self.jitter = configs.get(Clock.JITTER_KEY, ('fixed', 0))
+        self.syncTime = 0
+        self.numSyncs = 0
+        if self.syncInterval != infinite:
+            self.syncPhase = random.random() * self.syncInterval
+        else:
+            self.syncPhase = infinite
+
+    def _sync(self):
+        if self.syncInterval == infinite or now() < self.syncPhase:
+            return
+        numSyncs = int((now() - self.syncPhase) / self.syncInterval) + 1
+        if numSyncs > self.numSyncs:
+            self.numSyncs = numSyncs
+            self.syncTime = self.syncPhase + (numSyncs - 1) * self.syncInterval
+            self.offset = self.syncError.next()
+
+    def getOffset(self):
+        """The local time minus the simulation time."""
+        self._sync()
+        return self.offset + self.drift * (now() - self.syncTime)
+
+    def now(self):
+        return now() + self.getOffset()
+
+    def getDelay(self, localTime):
+        """Simulation time until the clock reads @localTime.
+
+        Synchronizations in between are not accounted for. The delay is
+        negative if the clock has passed @localTime.
+
+        """
+        return (localTime - self.now()) / (1.0 + self.drift)
+
+    def getJitter(self, delay):
+        #the upper bound is clipped to the delay, which changes every alarm
+        key, mean, cfg = getSpec(self.jitter)
+        lb = cfg.get('lb', 0)
+        if lb < 0: raise ValueError('jitter lb = %s >= 0' %lb)
+        if key == 'fixed':
+            return min(max(mean, 0), delay)
+        if delay <= lb:
+            return delay
+        cfg['lb'] = lb
+        cfg['ub'] = min(cfg.get('ub', delay), delay)
+        return RandInterval.get(key, mean, cfg).next()
+
+    def setAlarm(self, localTime, name=None, jitter=True):
+        """Alarm event fired when the clock reads @localTime.
+
+        The alarm fires immediately if the clock has passed @localTime, and
+        late by the timer jitter if @jitter.
+
+        """
+        delay = max(self.getDelay(localTime), 0)
+        if jitter:
+            delay += self.getJitter(delay)
+        return Alarm.setOnetime(delay, name)
+
+#####  TEST  #####
+def testClock():
+    from SimPy.Simulation import initialize, simulate, activate, hold, Process
+    from SimPy.Simulation import waitevent
+    print '===== test clock ====='
+    initialize()
+    configs = {
+        'clock.offset.dist' : ('fixed', -5),
+        'clock.drift.dist' : ('fixed', 0.01),
+    }
+    clock = Clock(configs)
+    assert clock.now() == -5
+    assert abs(clock.getDelay(5) - 10 / 1.01) < 1e-9
+    class Reader(Process):
+        def run(self):
+            yield hold, self, 100
+            assert abs(clock.now() - 96) < 1e-9, clock.now()
+            yield hold, self, clock.getDelay(200)
+            assert abs(clock.now() - 200) < 1e-9, clock.now()
+    reader = Reader()
+    activate(reader, reader.run())
+    simulate(until=1000)
+    #timer jitter
+    initialize()
+    configs = {
+        'clock.offset.dist' : ('fixed', 10),
+        'clock.timer.jitter.dist' : ('uniform', -1, {'lb' : 1, 'ub' : 5}),
+    }
+    clock = Clock(configs)
+    jitters = [clock.getJitter(100) for i in range(1000)]
+    assert 1 <= min(jitters) and max(jitters) <= 5
+    assert max([clock.getJitter(3) for i in range(1000)]) <= 3
+    assert clock.getJitter(0) == 0
+    class Sleeper(Process):
+        def run(self):
+            for i in range(10):
+                yield hold, self, 0
+                alarm = clock.setAlarm(100 * (i + 1))
+                yield waitevent, self, alarm
+                late = clock.now() - 100 * (i + 1)
+                assert 1 <= late <= 5, late
+                alarm = clock.setAlarm(clock.now() + 20, jitter=False)
+                yield waitevent, self, alarm
+                assert abs(clock.now() - 100 * (i + 1) - late - 20) < 1e-9
+    sleeper = Sleeper()
+    activate(sleeper, sleeper.run())
+    simulate(until=2000)
+    #synchronized clocks
+    initialize()
+    configs = {
+        'clock.offset.dist' : ('fixed', 50),
+        'clock.drift.dist' : ('norm', 0, {'sigma' : 1e-4}),
+        'clock.sync.interval' : 1000,
+        'clock.sync.error.dist' : ('uniform', 0, {'lb' : -1, 'ub' : 1}),
+    }
+    clocks = [Clock(configs) for i in range(100)]
+    assert len([c for c in clocks if c.drift < 0]) > 0
+    class Checker(Process):
+        def run(self):
+            while now() < 10000:
+                yield hold, self, 100
+                for clock in clocks:
+                    offset = clock.getOffset()
+                    if now() >= 1000:
+                        assert abs(offset) < 1 + 1000 * 1e-3, offset
+            assert min([c.numSyncs for c in clocks]) >= 9
+    checker = Checker()
+    activate(checker, checker.run())
+    simulate(until=20000)
+    print 'test clock passed'
+
+def main():
+    testClock()
+
+if __name__ == '__main__':
+    main()
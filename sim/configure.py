@@ -2,6 +2,7 @@
 Check config and construct instances.
 """
 import math
+import os
 import re
 try:
     import numpy
@@ -18,6 +19,9 @@ class Configuration(object):
     def __setitem__(self, key, value):
         self.conf[key] = value
 
+    def __contains__(self, key):
+        return key in self.conf
+
     def __str__(self):
         return self.conf.__str__()
 
@@ -98,6 +102,16 @@ class Configuration(object):
         for key, val in self.conf.iteritems():
             fh.write('%s = %s\n' %(key, val))
 
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), '__config__')
+
+def readDefault(updates={}):
+    """The configuration of sim/__config__ with @updates applied."""
+    configs = Configuration()
+    configs.read(DEFAULT_CONFIG)
+    for key, val in updates.iteritems():
+        configs[key] = val
+    return configs
+
 #####  TEST  #####
 
 if __name__ == '__main__':
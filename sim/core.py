@@ -2,8 +2,6 @@ from SimPy.Simulation import Process, SimEvent
 from SimPy.Simulation import hold, waitevent
 from SimPy.Simulation import initialize, activate, simulate, now
 
-from rintvl import RandInterval
-
 infinite = -1
 
 class IDable(object):
@@ -61,20 +59,19 @@ class RetVal(object):
 
 class Alarm(Process):
     @classmethod
-    def setOnetime(cls, delay, name=None, at=0, drift=('fixed', 0)):
-        tm = Alarm(delay, name, drift=drift)
+    def setOnetime(cls, delay, name=None, at=0):
+        tm = Alarm(delay, name)
         activate(tm, tm.onetime())
         return tm.event
 
     @classmethod
     def setPeriodic(cls, interval, name=None, at=0,
-                    until=infinite, drift=('fixed', 0)):
-        tm = Alarm(interval, name, until, drift)
+                    until=infinite):
+        tm = Alarm(interval, name, until)
         activate(tm, tm.loop(), at=at)
         return tm.event
 
-    def __init__(self, interval, name=None,
-                 until=infinite, drift=('fixed', 0)):
+    def __init__(self, interval, name=None, until=infinite):
         Process.__init__(self)
         self.interval = interval
         if name is not None:
@@ -83,31 +80,17 @@ class Alarm(Process):
             eventname = "a_SimEvent"
         self.event = SimEvent(eventname)
         self.until = until
-        try:
-            key, mean, cfg = drift
-        except ValueError:
-            key, mean = drift
-            cfg = {}
-        lb = cfg.get('lb', 0); ub = cfg.get('ub', interval)
-        if lb < 0: raise ValueError('drift lb = %s >= 0' %lb)
-        if ub > interval:
-            raise ValueError('drift ub = %s < %s = interval' %interval)
-        cfg['lb'] = lb; cfg['ub'] = ub
-        self.rgen = RandInterval.get(key, mean, cfg)
 
     def onetime(self):
-        drift = self.rgen.next()
-        yield hold, self, self.interval + drift
+        yield hold, self, self.interval
         self.event.signal()
 
     def loop(self):
         left = 0
         while (self.until < 0) or (now() < self.until):
             yield hold, self, left
-            drift = self.rgen.next()
-            yield hold, self, drift
             self.event.signal()
-            left = self.interval - drift
+            left = self.interval
 
 class TimeoutException(Exception):
     pass
@@ -197,10 +180,25 @@ class BThread(Thread):
             raise e
 
     def endWait(self, res):
-        BThread.wait_graph[self].remove(res)
+        if self not in BThread.wait_graph:
+            return
+        BThread.wait_graph[self].discard(res)
         if len(BThread.wait_graph[self]) == 0:
             del  BThread.wait_graph[self]
 
+    def granted(self, res):
+        """@res is handed to self while self waits for it.
+
+        The waiter may run after the others woken up with it, so the graph is
+        updated by whoever grants the resource. Otherwise the stale edges of
+        the waiters would show as cycles.
+
+        """
+        self.endWait(res)
+        if res not in BThread.wait_graph:
+            BThread.wait_graph[res] = set([])
+        BThread.wait_graph[res].add(self)
+
     @property
     def height(self):
         """The height of the waiting graph."""
@@ -347,9 +345,9 @@ class WaitForAlarm(Process):
         yield waitevent, self, alarmevent
         print 'alarmed at %s' %now()
 
-    def periodic(self, interval, until=infinite, drift=('fixed', 0)):
+    def periodic(self, interval, until=infinite):
         print 'set periodic alarm'
-        alarmevent = Alarm.setPeriodic(interval, until=until, drift=drift)
+        alarmevent = Alarm.setPeriodic(interval, until=until)
         count = 20
         while count > 0:
             print 'work on something else until alarm'
@@ -363,7 +361,7 @@ def testAlarm():
     wfa2 = WaitForAlarm()
     activate(wfa2, wfa2.periodic(5, until=50), at=15)
     wfa3 = WaitForAlarm()
-    activate(wfa3, wfa3.periodic(5, drift=('norm', 0, {'sigma':0.1})), at=60)
+    activate(wfa3, wfa3.periodic(5), at=60)
 
 class Child(Thread):
     def run(self):
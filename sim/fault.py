@@ -0,0 +1,257 @@
+"""
+Fault injection at the RTI layer.
+
+A fault schedule 'fault.schedule' is a list of faults in the form of dicts:
+
+    {'type':'crash', 'nodes':'zone1/', 'start':t0, 'end':t1}
+        nodes whose inet address starts with 'nodes'(a prefix or a list of
+        prefixes) neither send nor receive messages in [t0, t1). They keep
+        their state, as if they recover from stable storage.
+
+    {'type':'partition', 'zones':[[0, 1], [2, 3, 4]], 'start':t0, 'end':t1}
+        messages sent in [t0, t1) between zones in different sets are lost.
+
+    {'type':'drop', 'src':0, 'dst':1, 'rate':0.1, 'start':t0, 'end':t1}
+        messages sent in [t0, t1) from zone 'src' to zone 'dst' are lost with
+        probability 'rate'. Missing 'src' or 'dst' means any zone.
+
+The systems assume reliable channels, so by default a lost message is resent
+as a reliable transport would: after the crash or partition that lost it
+ends, or 'fault.resend.timeout' later for a random drop. A message lost by a
+fault that never ends is lost for good. With 'fault.resend' set to False,
+every lost message is lost for good, and a lost invocation that waits for a
+round trip never returns, so the caller has to time out.
+"""
+
+import random
+import re
+
+from SimPy.Simulation import now
+
+from sim.core import infinite
+
+class Fault(object):
+    def __init__(self, config):
+        self.type = config['type']
+        self.start = config.get('start', 0)
+        self.end = config.get('end', infinite)
+        if self.end != infinite and self.end < self.start:
+            raise ValueError('fault ends before start: %s' %config)
+
+    def isActive(self, time):
+        if time < self.start:
+            return False
+        return self.end == infinite or time < self.end
+
+    def __str__(self):
+        return '%s[%s, %s)' %(self.type, self.start, self.end)
+
+class CrashFault(Fault):
+    def __init__(self, config):
+        Fault.__init__(self, config)
+        nodes = config['nodes']
+        if isinstance(nodes, basestring):
+            nodes = [nodes]
+        self.prefixes = list(nodes)
+
+    def isCrashed(self, addr):
+        for prefix in self.prefixes:
+            if addr.startswith(prefix):
+                return True
+        return False
+
+    def isDropped(self, src, srcZone, dst, dstZone):
+        return self.isCrashed(src) or self.isCrashed(dst)
+
+class PartitionFault(Fault):
+    def __init__(self, config):
+        Fault.__init__(self, config)
+        self.sides = {}         #{zone: index of the zone set}
+        for i, zones in enumerate(config['zones']):
+            for zone in zones:
+                self.sides[zone] = i
+
+    def isDropped(self, src, srcZone, dst, dstZone):
+        return self.sides.get(srcZone) != self.sides.get(dstZone)
+
+class DropFault(Fault):
+    def __init__(self, config):
+        Fault.__init__(self, config)
+        self.src = config.get('src')
+        self.dst = config.get('dst')
+        self.rate = config['rate']
+
+    def isDropped(self, src, srcZone, dst, dstZone):
+        if self.src is not None and self.src != srcZone:
+            return False
+        if self.dst is not None and self.dst != dstZone:
+            return False
+        return random.random() < self.rate
+
+FAULTS = {
+    'crash' : CrashFault,
+    'partition' : PartitionFault,
+    'drop' : DropFault,
+}
+
+class FaultInjector(object):
+    """Decide which messages are lost according to the fault schedule."""
+    SCHEDULE_KEY = 'fault.schedule'
+    RESEND_TIMEOUT = 1000
+    ZONE_PATTERN = re.compile('zone(\d+)/')
+    def __init__(self, configs):
+        self.faults = []
+        for config in configs[FaultInjector.SCHEDULE_KEY]:
+            if config['type'] not in FAULTS:
+                raise ValueError('unknown fault type: %s' %config['type'])
+            self.faults.append(FAULTS[config['type']](config))
+        self.resend = configs.get('fault.resend', True)
+        self.resendTimeout = configs.get('fault.resend.timeout',
+                                         FaultInjector.RESEND_TIMEOUT)
+        self.zones = {}         #{addr: zone}
+        self.numDropped = 0
+        self.numResent = 0
+
+    def getZone(self, addr):
+        if addr not in self.zones:
+            match = FaultInjector.ZONE_PATTERN.match(addr)
+            self.zones[addr] = int(match.group(1)) if match else None
+        return self.zones[addr]
+
+    def getDropFault(self, src, dst):
+        """The fault that loses the message sent now from @src to @dst."""
+        if src == dst:
+            return None
+        time = now()
+        srcZone = self.getZone(src)
+        dstZone = self.getZone(dst)
+        for fault in self.faults:
+            if not fault.isActive(time):
+                continue
+            if fault.isDropped(src, srcZone, dst, dstZone):
+                self.numDropped += 1
+                return fault
+        return None
+
+    def getCrashFault(self, addr):
+        """The fault that crashes the node with @addr now."""
+        time = now()
+        for fault in self.faults:
+            if isinstance(fault, CrashFault) and fault.isActive(time) \
+               and fault.isCrashed(addr):
+                self.numDropped += 1
+                return fault
+        return None
+
+    def getResendDelay(self, fault):
+        """Time to wait before resending a message lost by @fault.
+
+        None if the message is lost for good.
+
+        """
+        if not self.resend:
+            return None
+        if isinstance(fault, DropFault):
+            delay = self.resendTimeout
+        elif fault.end == infinite:
+            return None
+        else:
+            delay = fault.end - now()
+        self.numResent += 1
+        return delay
+
+    def profile(self, results, commitTimes):
+        """Add the unavailability and throughput around each fault.
+
+        For a fault lasting d, the throughput is measured in d before, during
+        and d after the fault. The recovery time is from the end of the fault
+        to the next commit, and the max commit gap is the longest time without
+        commits from the start of the fault to then. Both are only added if
+        there is a commit after the fault, which 'recovered' tells.
+
+        """
+        results.add('fault.num.dropped.msgs', self.numDropped)
+        results.add('fault.num.resent.msgs', self.numResent)
+        times = sorted(commitTimes)
+        for i, fault in enumerate(self.faults):
+            key = 'fault.%s.%s'%(i, fault.type)
+            start = fault.start
+            end = fault.end if fault.end != infinite else now()
+            length = end - start
+            if length > 0:
+                before = len([t for t in times if start - length <= t < start])
+                during = len([t for t in times if start <= t < end])
+                after = len([t for t in times if end <= t < end + length])
+                results.add('%s.throughput.before'%key, float(before) / length)
+                results.add('%s.throughput.during'%key, float(during) / length)
+                results.add('%s.throughput.after'%key, float(after) / length)
+            recovered = [t for t in times if t >= end]
+            results.add('%s.recovered'%key, len(recovered) > 0)
+            if len(recovered) == 0:
+                continue
+            results.add('%s.recovery.time'%key, recovered[0] - end)
+            points = [start] + [t for t in times
+                                if start <= t <= recovered[0]]
+            gap = 0
+            for j in range(1, len(points)):
+                gap = max(gap, points[j] - points[j - 1])
+            results.add('%s.max.commit.gap'%key, gap)
+
+#####  TEST  #####
+def testRecovery():
+    print '===== test recovery ====='
+    import numpy
+    from sim import simulate
+    #which messages get lost decides whether the nodes diverge
+    random.seed(1)
+    numpy.random.seed(1)
+    configs = {
+        'dataset.groups' : {1 : 1024},
+        'num.zones' : 5,
+        'num.storage.nodes.per.zone' : 1,
+        'nw.latency.within.zone' : ('fixed', 0),
+        'nw.latency.cross.zone' : ('fixed', 50),
+        'txn.gen.impl' : 'sim.txngen.UniformTxnGen',
+        'total.num.txns' : 300,
+        'txn.arrive.interval.dist' : ('expo', 100),
+        'txn.classes' : [
+            {'freq' : 1, 'nwrites' : 10,
+             'action.intvl.dist' : ('fixed', 0),
+             'commit.intvl.dist' : ('fixed', 0)},
+        ],
+        'epdetmn.epoch.length' : 50,
+        'epdetmn.epoch.skew.dist' : ('fixed', 0),
+        'simulation.duration' : 600000,
+        'system.impl' : 'sim.impl.epdetmn.EPaxosDetmnSystem',
+        'fault.schedule' : [
+            {'type' : 'partition', 'zones' : [[0, 1, 2], [3, 4]],
+             'start' : 2000, 'end' : 3000},
+        ],
+    }
+    results = simulate.run(configs, verify=True)
+    key = 'fault.0.partition'
+    assert results['verified'] is True
+    assert results['fault.num.resent.msgs'] > 0
+    #the minority side cannot commit during the partition
+    assert results['%s.throughput.during'%key] < \
+            results['%s.throughput.before'%key]
+    assert results['%s.recovered'%key] is True
+    assert results['%s.throughput.after'%key] > 0
+    assert 0 <= results['%s.recovery.time'%key] < 1000
+    #without resending, the lost paxos messages are never recovered
+    configs['fault.resend'] = False
+    results = simulate.run(configs, verify=True)
+    assert results['%s.recovered'%key] is False
+    assert results['fault.num.resent.msgs'] == 0
+    #and the txns stuck behind them leave the storage nodes diverged
+    assert results['verified'] is False
+    print 'test recovery passed'
+
+def test():
+    testRecovery()
+
+def main():
+    test()
+
+if __name__ == '__main__':
+    main()
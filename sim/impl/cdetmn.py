@@ -7,7 +7,7 @@ from sim.core import BThread
 from sim.locking import Lockable, LockThread
 from sim.perf import Profiler
 from rintvl import RandInterval
-from sim.system import BaseSystem, StorageNode
+from sim.system import BaseSystem, ClientNode, StorageNode
 from sim.txns import TxnRunner
 
 def StrictFCFSAlgo(lockable):
@@ -34,13 +34,103 @@ def StrictFCFSAlgo(lockable):
                 break
     return threads, state
 
+class BatchPlanner(object):
+    """Plan the conflict free execution of the ordered txns on a storage node.
+
+    Each txn depends on the unfinished txns before it that conflict with it:
+    a read on the last writer of the item, and a write on the last writer and
+    the readers after it. Txns without unfinished dependencies run in
+    parallel, so a batch runs in waves of independent txns instead of going
+    through the lock queues one txn at a time.
+
+    """
+    def __init__(self, snode):
+        self.snode = snode
+        self.lastWriter = {}        #{itemID: txn}
+        self.readers = {}           #{itemID: [txn]}, after the last writer
+        self.deps = {}              #{txn: set(txn)}, unfinished dependencies
+        self.dependents = {}        #{txn: [txn]}
+        self.doneEvent = SimEvent()
+
+    def getActions(self, txn):
+        if self.snode.partitioned:
+            return self.snode.getLocalActions(txn)
+        return txn.actions
+
+    def add(self, txn):
+        deps = set([])
+        for action in self.getActions(txn):
+            itemID = action.itemID
+            writer = self.lastWriter.get(itemID)
+            if writer is not None and writer != txn:
+                deps.add(writer)
+            if action.isWrite():
+                for reader in self.readers.get(itemID, []):
+                    if reader != txn:
+                        deps.add(reader)
+                self.lastWriter[itemID] = txn
+                self.readers[itemID] = []
+            elif writer != txn:
+                self.readers.setdefault(itemID, []).append(txn)
+        self.deps[txn] = deps
+        for dep in deps:
+            self.dependents.setdefault(dep, []).append(txn)
+        return deps
+
+    def plan(self, txns):
+        """Add the ordered @txns, return the number of waves they run in."""
+        waves = {}
+        for txn in txns:
+            deps = self.add(txn)
+            waves[txn] = 1
+            for dep in deps:
+                if dep in waves:
+                    waves[txn] = max(waves[txn], waves[dep] + 1)
+        if len(waves) == 0:
+            return 0
+        return max(waves.values())
+
+    def isReady(self, txn):
+        return len(self.deps[txn]) == 0
+
+    def finish(self, txn):
+        for action in self.getActions(txn):
+            itemID = action.itemID
+            if self.lastWriter.get(itemID) == txn:
+                del self.lastWriter[itemID]
+            readers = self.readers.get(itemID, [])
+            if txn in readers:
+                readers.remove(txn)
+            if len(readers) == 0:
+                self.readers.pop(itemID, None)
+        for dependent in self.dependents.pop(txn, []):
+            self.deps[dependent].discard(txn)
+        del self.deps[txn]
+        self.doneEvent.signal()
+
 class CentralDetmnSystem(BaseSystem):
     """
     Centralized Deterministic System.
+
+    If 'detmn.partitioned.execution' is set, storage nodes of a zone execute
+    the ordered txns in the style of Calvin: each storage node only locks and
+    runs the actions on the groups it hosts, forwards its local reads to the
+    other participants that write, and a txn departs when all of its
+    participants finish. The client node of this system dispatches a txn to
+    all of its participants, the subclasses feed every storage node the same
+    ordered log instead.
+
+    If 'detmn.batch.planner' is set, storage nodes do not lock items. A
+    BatchPlanner computes the conflicts of the ordered txns when they are
+    enqueued, and a txn starts as soon as the txns it conflicts with finish.
     """
     def __init__(self, configs):
         BaseSystem.__init__(self, configs)
         Lockable.WakeupAlgo = StrictFCFSAlgo
+        self.partitionsLeft = {}    #{(cnode, txn): number of participants}
+
+    def newClientNode(self, idx, configs):
+        return CDCNode(self, idx, configs)
 
     def newStorageNode(self, cnode, index, configs):
         return CDSNode(cnode, index, configs)
@@ -50,38 +140,73 @@ class CentralDetmnSystem(BaseSystem):
         rootMon = Profiler.getMonitor('/')
         wmean, wstd, whisto, wcount = \
                 rootMon.getElapsedStats('.*wait.lock')
-        self.logger.info('wait.lock.time.mean=%s'%wmean)
-        self.logger.info('wait.lock.time.std=%s'%wstd)
+        self.results.add('wait.lock.time.mean', wmean)
+        self.results.add('wait.lock.time.std', wstd)
         #self.logger.info('wait.lock.time.histo=(%s, %s)'%whisto)
         numLockAcquire = rootMon.getElapsedCount('.*lock.acquire')
         bmean, bstd, bhisto, bcount = \
                 rootMon.getElapsedStats('.*%s'%LockThread.LOCK_BLOCK_KEY)
-        self.logger.info('lock.block.prob=%s'%(float(bcount) / numLockAcquire))
-        self.logger.info('lock.block.time.mean=%s'%bmean)
-        self.logger.info('lock.block.time.std=%s'%bstd)
+        if numLockAcquire != 0:
+            self.results.add('lock.block.prob', float(bcount) / numLockAcquire)
+        self.results.add('lock.block.time.mean', bmean)
+        self.results.add('lock.block.time.std', bstd)
         #self.logger.info('lock.block.time.histo=(%s, %s)'%(bhisto))
         nlmean, nlstd, nlhisto, nlcount = \
                 rootMon.getObservedStats('.*num.blocking.lock')
-        self.logger.info('num.blocking.lock.mean=%s'%nlmean)
-        self.logger.info('num.blocking.lock.std=%s'%nlstd)
+        self.results.add('num.blocking.lock.mean', nlmean)
+        self.results.add('num.blocking.lock.std', nlstd)
         #self.logger.info('num.blocking.lock.histo=(%s, %s)'%(nlhisto))
         nbmean, nbstd, nbhisto, nbcount = \
                 rootMon.getObservedStats('.*num.blocking.txns')
-        self.logger.info('num.blocking.txns.mean=%s'%nbmean)
-        self.logger.info('num.blocking.txns.std=%s'%nbstd)
+        self.results.add('num.blocking.txns.mean', nbmean)
+        self.results.add('num.blocking.txns.std', nbstd)
         #self.logger.info('num.blocking.txns.histo=(%s, %s)'%(nbhisto))
         hmean, hstd, hhisto, hcount = \
                 rootMon.getObservedStats('.*%s.cond'%LockThread.LOCK_BLOCK_HEIGHT_KEY)
-        self.logger.info('block.height.cond.mean=%s'%hmean)
-        self.logger.info('block.height.cond.std=%s'%hstd)
+        self.results.add('block.height.cond.mean', hmean)
+        self.results.add('block.height.cond.std', hstd)
         #self.logger.info('block.height.cond.histo=(%s, %s)'%(hhisto))
         wmean, wstd, whisto, wcount = \
                 rootMon.getObservedStats('.*%s'%LockThread.LOCK_BLOCK_WIDTH_KEY)
-        self.logger.info('block.width.mean=%s'%wmean)
-        self.logger.info('block.width.std=%s'%wstd)
+        self.results.add('block.width.mean', wmean)
+        self.results.add('block.width.std', wstd)
         #self.logger.info('block.width.histo=(%s, %s)'%(whisto))
         h = rootMon.getObservedMean('.*%s.abs'%LockThread.LOCK_BLOCK_HEIGHT_KEY)
-        self.logger.info('block.height.mean.noncond=%s'%h)
+        self.results.add('block.height.mean.noncond', h)
+        if self.configs.get('detmn.batch.planner', False):
+            dmean, dstd, dhisto, dcount = \
+                    rootMon.getElapsedStats('.*wait.deps')
+            self.results.add('wait.deps.time.mean', dmean)
+            self.results.add('wait.deps.time.std', dstd)
+            smean, sstd, shisto, scount = \
+                    rootMon.getObservedStats('.*planned.batch.size')
+            self.results.add('planned.batch.size.mean', smean)
+            wmean, wstd, whisto, wcount = \
+                    rootMon.getObservedStats('.*planned.batch.waves')
+            self.results.add('planned.batch.waves.mean', wmean)
+            self.results.add('planned.batch.waves.std', wstd)
+            if wmean != 0:
+                self.results.add('planned.batch.wave.width',
+                                 float(smean) / wmean)
+        if self.configs.get('detmn.partitioned.execution', False):
+            rmean, rstd, rhisto, rcount = \
+                    rootMon.getElapsedStats('.*wait.remote.read')
+            self.results.add('wait.remote.read.time.mean', rmean)
+            self.results.add('wait.remote.read.time.std', rstd)
+            self.results.add('num.remote.reads',
+                             rootMon.getObservedCount('.*remote.read.recv'))
+
+class CDCNode(ClientNode):
+    def dispatchTxn(self, txn):
+        if not self.configs.get('detmn.partitioned.execution', False):
+            return ClientNode.dispatchTxn(self, txn)
+        #every participant runs its local actions, in the order we dispatch
+        hosts = self.getTxnHosts(txn)
+        for host in hosts:
+            host.onTxnArrive(txn)
+        self.logger.debug('%s dispatch %s to %s at %s'
+                          %(self.ID, txn.ID, hosts, now()))
+        return hosts
 
 class CDSNode(StorageNode):
     def __init__(self, cnode, index, configs):
@@ -91,6 +216,80 @@ class CDSNode(StorageNode):
         self.waitingSet = set([])
         self.nextEvent = SimEvent()
         self.ts = 0
+        self.planner = None
+        if configs.get('detmn.batch.planner', False):
+            self.planner = BatchPlanner(self)
+        #partitioned execution
+        self.partitioned = configs.get('detmn.partitioned.execution', False)
+        self.remoteReads = {}       #{txn: number of remote reads received}
+        self.remoteReadEvent = SimEvent()
+
+    def enqueueTxn(self, txn):
+        """Start @txn in the order it is enqueued."""
+        self.enqueueBatch([txn])
+
+    def enqueueBatch(self, txns):
+        """Start the ordered @txns in the order they are enqueued."""
+        if self.partitioned:
+            txns = [txn for txn in txns if self.isParticipant(txn)]
+        if len(txns) == 0:
+            return
+        if self.planner is not None:
+            numWaves = self.planner.plan(txns)
+            self.monitor.observe('planned.batch.size', len(txns))
+            self.monitor.observe('planned.batch.waves', numWaves)
+        else:
+            #add txns to the locking queue
+            self.lockingQueue.extend(txns)
+        for txn in txns:
+            thread = StorageNode.TxnStarter(self, txn)
+            thread.start()
+
+    def isParticipant(self, txn):
+        for gid in txn.gids:
+            if gid in self.groups:
+                return True
+        return False
+
+    def getParticipants(self, txn):
+        return self.cnode.getTxnHosts(txn)
+
+    def getActiveParticipants(self, txn):
+        #participants that write need the reads of the others
+        hosts = set([])
+        for action in txn.actions:
+            if action.isWrite():
+                hosts.add(self.cnode.groupLocations[action.itemID.gid])
+        return hosts
+
+    def getLocalActions(self, txn):
+        return [action for action in txn.actions
+                if action.itemID.gid in self.groups]
+
+    def getNumRemoteReads(self, txn):
+        count = 0
+        for action in txn.actions:
+            if action.isRead() and action.itemID.gid not in self.groups:
+                count += 1
+        return count
+
+    def onRemoteRead(self, txn, itemID, value):
+        self.monitor.observe('remote.read.recv', 1)
+        self.remoteReads[txn] = self.remoteReads.get(txn, 0) + 1
+        self.remoteReadEvent.signal()
+
+    def onTxnFinish(self, txn):
+        if not self.partitioned:
+            StorageNode.onTxnFinish(self, txn)
+            return
+        partitionsLeft = self.system.partitionsLeft
+        key = (self.cnode, txn)
+        if key not in partitionsLeft:
+            partitionsLeft[key] = len(self.getParticipants(txn))
+        partitionsLeft[key] -= 1
+        if partitionsLeft[key] == 0:
+            del partitionsLeft[key]
+            StorageNode.onTxnFinish(self, txn)
 
     def run(self):
         #the big while loop
@@ -98,10 +297,7 @@ class CDSNode(StorageNode):
             yield waitevent, self, (self.closeEvent, self.newTxnEvent)
             while len(self.newTxns) > 0:
                 txn = self.newTxns.pop(0)
-                #add txn to the locking queue
-                self.lockingQueue.append(txn)
-                thread = StorageNode.TxnStarter(self, txn)
-                thread.start()
+                self.enqueueTxn(txn)
             #if self.shouldClose:
             #    self.logger.info(
             #        '%s closing. Wait for threads to terminate at %s'
@@ -123,11 +319,19 @@ class DETxnRunner(TxnRunner):
         self.snode.ts += 1
         self.ts = self.snode.ts
 
+    def getActions(self):
+        if self.snode.partitioned:
+            return self.snode.getLocalActions(self.txn)
+        return self.txn.actions
+
     def nonblockLock(self, lockable, state):
         self.logger.debug(
             '%s lock %r at %s' %(self.ID, lockable, now()))
-        #try acquire the lockable
-        acquired = lockable.tryAcquire(self, state)
+        #try acquire the lockable, but do not pass the txns ordered before
+        #us that wait for it, e.g. a shared lock past a queued exclusive one
+        acquired = False
+        if len(lockable.blockQueue) == 0 or lockable.isLockedBy(self):
+            acquired = lockable.tryAcquire(self, state)
         if acquired:
             self.logger.debug(
                 '%s acquired %s at %s' %(self.ID, lockable, now()))
@@ -148,7 +352,18 @@ class DETxnRunner(TxnRunner):
         blockEvt = lockable.block(self, state)
         return blockEvt
 
+    def waitDeps(self):
+        planner = self.snode.planner
+        self.monitor.start('wait.deps')
+        while not planner.isReady(self.txn):
+            yield waitevent, self, planner.doneEvent
+        self.monitor.stop('wait.deps')
+
     def begin(self):
+        if self.snode.planner is not None:
+            for step in self.waitDeps():
+                yield step
+            return
         self.monitor.start('wait.lock')
         index = -1
         while index != 0:
@@ -168,7 +383,7 @@ class DETxnRunner(TxnRunner):
         #now we are at the head of the queue
         self.monitor.start('lock.acquire')
         blockEvts = {}
-        for action in self.txn.actions:
+        for action in self.getActions():
             if action.isRead():
                 state = Lockable.SHARED
             else:
@@ -210,18 +425,46 @@ class DETxnRunner(TxnRunner):
         self.logger.debug('%s acquired all locks at %s' %(self.ID, now()))
         self.monitor.stop('lock.acquire')
 
+    def read(self, itemID, attr):
+        if self.snode.partitioned:
+            #forward the local read to the participants that write
+            item = self.snode.groups[itemID.gid][itemID]
+            value, version = item.read()
+            for snode in self.snode.getActiveParticipants(self.txn):
+                if snode != self.snode:
+                    self.snode.invoke(snode.onRemoteRead,
+                                      self.txn, itemID, value).rtiCall()
+        yield hold, self
+
     def write(self, itemID, attr):
         self.writeset[itemID] = attr
         yield hold, self
 
+    def trycommit(self):
+        if self.snode.partitioned and len(self.writeset) > 0:
+            #wait for the reads from the other participants
+            self.monitor.start('wait.remote.read')
+            numReads = self.snode.getNumRemoteReads(self.txn)
+            while self.snode.remoteReads.get(self.txn, 0) < numReads:
+                yield waitevent, self, self.snode.remoteReadEvent
+            self.monitor.stop('wait.remote.read')
+        self.snode.remoteReads.pop(self.txn, None)
+        yield hold, self
+
+    def newVersion(self, item):
+        return self.ts
+
     def commit(self):
         wsStrings = []
+        versions = {}
         for itemID, value in self.writeset.iteritems():
             item = self.snode.groups[itemID.gid][itemID]
-            assert self.ts > item.version, \
+            version = self.newVersion(item)
+            assert version > item.version, \
                     'txn=%s, itemID=%s, curr=%s, prev=%s' \
-                    %(self.txn.ID, itemID, self.ts, item.version)
-            item.write(value, self.ts)
+                    %(self.txn.ID, itemID, version, item.version)
+            item.write(value, version)
+            versions[itemID] = version
             if self.logger.isEnabledFor(logging.DEBUG):
                 wsStrings.append('(%s, %s)'%(itemID, value))
             yield hold, self, RandInterval.get(*self.txn.config.get(
@@ -233,9 +476,96 @@ class DETxnRunner(TxnRunner):
                               %(self.ID, ', '.join([s for s in wsStrings])))
         dataset = self.snode.system.dataset
         for itemID, value in self.writeset.iteritems():
-            dataset[itemID].write(value, self.ts)
+            dataset[itemID].write(value, versions[itemID])
             dataset[itemID].lastWriteTxn = self.txn
         for lock in self.locks:
             for step in self.unlock(lock):
                 yield step
+        if self.snode.planner is not None:
+            self.snode.planner.finish(self.txn)
+
+
+#####  TEST  #####
+def testPartitioned():
+    print '===== test partitioned ====='
+    from sim import simulate
+    configs = {
+        'dataset.groups' : {0 : 64, 1 : 64},
+        #cdetmn does not replicate, the zones are not consistent with others
+        'num.zones' : 1,
+        'num.storage.nodes.per.zone' : 2,
+        'nw.latency.within.zone' : ('fixed', 1),
+        'nw.latency.cross.zone' : ('fixed', 1),
+        'txn.gen.impl' : 'sim.txngen.UniformTxnGen',
+        'total.num.txns' : 200,
+        'txn.arrive.interval.dist' : ('expo', 10),
+        #reads and writes on both groups, so most txns span the two nodes
+        'txn.classes' : [
+            {'freq' : 1, 'nwrites' : 4, 'nreads' : 4,
+             'action.intvl.dist' : ('expo', 5),
+             'commit.intvl.dist' : ('fixed', 0)},
+        ],
+        'simulation.duration' : 600000,
+        'system.impl' : 'sim.impl.cdetmn.CentralDetmnSystem',
+        'detmn.partitioned.execution' : True,
+    }
+    for i in range(5):
+        results = simulate.run(configs, verify=True)
+        assert results['verified'] is True
+        assert results['loss.ratio'] == 0
+        assert results['num.remote.reads'] > 0
+        assert results['wait.remote.read.time.mean'] > 0
+    #the replicated systems feed the ordered log to the storage nodes
+    configs['num.zones'] = 3
+    configs['nw.latency.cross.zone'] = ('fixed', 50)
+    configs['system.impl'] = 'sim.impl.slpdetmn.SLPaxosDetmnSystem'
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['num.remote.reads'] > 0
+    assert results['wait.remote.read.time.mean'] > 0
+    print 'test partitioned passed'
+
+def testBatchPlanner():
+    print '===== test batch planner ====='
+    from sim.data import ItemID
+    from sim.txns import Action, Transaction
+    class FakeSNode(object):
+        partitioned = False
+    def newTxn(ID, reads, writes):
+        actions = [Action(Action.READ, ItemID(0, i)) for i in reads] + \
+                [Action(Action.WRITE, ItemID(0, i)) for i in writes]
+        return Transaction(ID, 0, actions, {})
+    planner = BatchPlanner(FakeSNode())
+    #conflict free txns run in one wave
+    txns = [newTxn(i, [10 + i], [i]) for i in range(4)]
+    assert planner.plan(txns) == 1
+    assert all([planner.isReady(txn) for txn in txns])
+    for txn in txns:
+        planner.finish(txn)
+    #reads share a wave, a write waits for the reads before it
+    t0 = newTxn(10, [1], [])
+    t1 = newTxn(11, [1], [])
+    t2 = newTxn(12, [], [1])
+    t3 = newTxn(13, [1], [2])
+    assert planner.plan([t0, t1, t2, t3]) == 3
+    assert [planner.isReady(t) for t in (t0, t1, t2, t3)] == \
+            [True, True, False, False]
+    planner.finish(t0)
+    assert not planner.isReady(t2)
+    planner.finish(t1)
+    assert planner.isReady(t2) and not planner.isReady(t3)
+    planner.finish(t2)
+    assert planner.isReady(t3)
+    planner.finish(t3)
+    assert planner.deps == {} and planner.lastWriter == {}
+    print 'test batch planner passed'
+
+def test():
+    testBatchPlanner()
+    testPartitioned()
+
+def main():
+    test()
 
+if __name__ == '__main__':
+    main()
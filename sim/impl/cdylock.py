@@ -21,32 +21,32 @@ class CentralDyLockSystem(BaseSystem):
         numLockAcquire = rootMon.getElapsedCount('.*lock.acquire')
         bmean, bstd, bhisto, bcount = \
                 rootMon.getElapsedStats('.*%s'%LockThread.LOCK_BLOCK_KEY)
-        self.logger.info('lock.block.prob=%s'%(float(bcount) / numLockAcquire))
-        self.logger.info('lock.block.time.mean=%s'%bmean)
-        self.logger.info('lock.block.time.std=%s'%bstd)
+        self.results.add('lock.block.prob', float(bcount) / numLockAcquire)
+        self.results.add('lock.block.time.mean', bmean)
+        self.results.add('lock.block.time.std', bstd)
         #self.logger.info('lock.block.time.histo=(%s, %s)'%(bhisto))
         numExecTxns = rootMon.getElapsedCount(
             '.*%s'%BaseSystem.TXN_EXEC_KEY_PREFIX)
         dmean, dstd, dhisto, dcount = \
                 rootMon.getElapsedStats('.*abort.deadlock')
-        self.logger.info('abort.deadlock.prob=%s'%(float(dcount) / numExecTxns))
-        self.logger.info('abort.deadlock.time.mean=%s'%dmean)
-        self.logger.info('abort.deadlock.time.std=%s'%dstd)
+        self.results.add('abort.deadlock.prob', float(dcount) / numExecTxns)
+        self.results.add('abort.deadlock.time.mean', dmean)
+        self.results.add('abort.deadlock.time.std', dstd)
         #self.logger.info('abort.deadlock.time.histo=(%s, %s)'%(dhisto))
         cmean, cstd, chisto, ccount = \
                 rootMon.getObservedStats('.*deadlock.cycle.length')
-        self.logger.info('deadlock.cycle.length.mean=%s'%cmean)
-        self.logger.info('deadlock.cycle.length.std=%s'%cstd)
+        self.results.add('deadlock.cycle.length.mean', cmean)
+        self.results.add('deadlock.cycle.length.std', cstd)
         #self.logger.info('deadlock.cycle.length.histo=(%s, %s)'%(chisto))
         hmean, hstd, hhisto, hcount = \
                 rootMon.getObservedStats('.*%s'%LockThread.LOCK_BLOCK_HEIGHT_KEY)
-        self.logger.info('block.height.mean=%s'%hmean)
-        self.logger.info('block.height.std=%s'%hstd)
+        self.results.add('block.height.mean', hmean)
+        self.results.add('block.height.std', hstd)
         #self.logger.info('block.height.histo=(%s, %s)'%(hhisto))
         wmean, wstd, whisto, wcount = \
                 rootMon.getObservedStats('.*%s'%LockThread.LOCK_BLOCK_WIDTH_KEY)
-        self.logger.info('block.width.mean=%s'%wmean)
-        self.logger.info('block.width.std=%s'%wstd)
+        self.results.add('block.width.mean', wmean)
+        self.results.add('block.width.std', wstd)
         #self.logger.info('block.width.histo=(%s, %s)'%(whisto))
 
 class DLSNode(StorageNode):
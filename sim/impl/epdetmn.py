@@ -4,14 +4,27 @@ from SimPy.Simulation import now
 from SimPy.Simulation import waitevent, hold
 
 from rintvl import RandInterval
-from sim.core import Alarm, IDable, infinite
+from sim.core import IDable, infinite
 from sim.impl.cdetmn import CentralDetmnSystem, CDSNode
 from sim.paxos import initPaxosCluster, profilePaxos
 from sim.perf import Profiler
-from sim.system import ClientNode, StorageNode
+from sim.system import ClientNode
+from sim.txns import Transaction
 
 class EPaxosDetmnSystem(CentralDetmnSystem):
-    """Deterministic system with master timestamp assignment."""
+    """Deterministic system with master timestamp assignment.
+
+    With 'epdetmn.adaptive.epoch', each storage node tunes its epoch length to
+    the arrival rate and consensus time it observes. With
+    'epdetmn.skip.empty.batch', which adaptive epochs imply, empty batches are
+    not proposed. Instead, a node without txns fills its instances below the
+    largest learned one with skip markers sent to the learners, which need no
+    consensus round.
+
+    Epochs end on the local clock of each storage node (see sim.clock), so
+    nodes with skewed clocks disagree on where the epoch boundaries are.
+
+    """
     def newClientNode(self, idx, configs):
         return EPDCNode(self, idx, configs)
 
@@ -21,12 +34,19 @@ class EPaxosDetmnSystem(CentralDetmnSystem):
     def startupPaxos(self):
         initPaxosCluster(
             self.cnodes, self.cnodes, False, False, 'all',
-            True, True, infinite)
+            True, True, infinite,
+            **self.getThriftyKargs())
 
     def profile(self):
         CentralDetmnSystem.profile(self)
         rootMon = Profiler.getMonitor('/')
-        profilePaxos(self.logger, rootMon)
+        profilePaxos(self.results, rootMon)
+        mean, std, histo, count = rootMon.getObservedStats('.*epoch.length')
+        self.results.add('epdetmn.epoch.length.mean', mean)
+        self.results.add('epdetmn.epoch.length.std', std)
+        numEmpty = rootMon.getObservedCount('.*epoch.empty')
+        self.results.add('epdetmn.num.epochs', count)
+        self.results.add('epdetmn.num.empty.epochs', numEmpty)
 
 class EPDCNode(ClientNode):
     pass
@@ -46,57 +66,264 @@ class Batch(IDable):
     def isEmpty(self):
         return len(self.batch) == 0
 
+    @property
+    def pktSize(self):
+        size = Transaction.PKT_SIZE
+        for txn in self.batch:
+            size += txn.pktSize
+        return size
+
+class Skip(Batch):
+    """An empty batch that is learned without a consensus round."""
+    pass
+
+class EpochController(object):
+    """Adaptive epoch length of a storage node.
+
+    The epoch is long enough to collect 'epdetmn.epoch.target.batch.size' txns
+    at the arrival rate, but not shorter than the consensus time divided by
+    'epdetmn.epoch.max.inflight', so that the number of outstanding instances
+    stays bounded. Both the rate and the consensus time are exponentially
+    weighted moving averages, and the length is bounded by
+    'epdetmn.epoch.min.length' and 'epdetmn.epoch.max.length'. An epoch with a
+    full batch ends early, but not before the minimum length.
+
+    """
+    def __init__(self, eLen, configs):
+        self.eLen = eLen
+        self.minLen = configs.get('epdetmn.epoch.min.length', eLen / 10.0)
+        self.maxLen = configs.get('epdetmn.epoch.max.length', eLen * 4.0)
+        self.targetSize = configs.get('epdetmn.epoch.target.batch.size', 1)
+        self.maxInflight = configs.get('epdetmn.epoch.max.inflight', 2)
+        self.weight = configs.get('epdetmn.epoch.ewma.weight', 0.2)
+        if not 0 < self.minLen <= self.maxLen:
+            raise ValueError('epoch length bounds: %s, %s'
+                             %(self.minLen, self.maxLen))
+        self.rate = None
+        self.consensus = None
+
+    def _update(self, prev, curr):
+        if prev is None:
+            return curr
+        return (1 - self.weight) * prev + self.weight * curr
+
+    def onEpoch(self, numTxns, length):
+        if length > 0:
+            self.rate = self._update(self.rate, float(numTxns) / length)
+
+    def onConsensus(self, elapsed):
+        self.consensus = self._update(self.consensus, elapsed)
+
+    def isFull(self, numTxns):
+        return numTxns >= self.targetSize
+
+    def isEpochEnd(self, numTxns, elapsed):
+        if elapsed >= self.eLen:
+            return True
+        return self.isFull(numTxns) and elapsed >= self.minLen
+
+    def next(self):
+        if self.rate is None:
+            length = self.eLen
+        elif self.rate > 0:
+            length = self.targetSize / self.rate
+        else:
+            length = self.maxLen
+        if self.consensus is not None:
+            length = max(length, self.consensus / self.maxInflight)
+        self.eLen = min(max(length, self.minLen), self.maxLen)
+        return self.eLen
+
 class EPDSNode(CDSNode):
     def __init__(self, cnode, index, configs):
         CDSNode.__init__(self, cnode, index, configs)
         self.nextIID = 0
         self.eLen = self.configs['epdetmn.epoch.length']
-        self.skew = self.configs['epdetmn.epoch.skew.dist']
+        if self.configs.get('epdetmn.epoch.skew.dist') is not None:
+            #the skew of the epoch boundaries is the jitter of the clock timer
+            self.clock.jitter = self.configs['epdetmn.epoch.skew.dist']
         self.gcID = 0
+        adaptive = self.configs.get('epdetmn.adaptive.epoch', False)
+        self.skipEmpty = self.configs.get('epdetmn.skip.empty.batch', adaptive)
+        self.controller = None
+        if adaptive:
+            #instances are interleaved, so without skips the nodes with
+            #longer epochs would hold back the execution of the others
+            if not self.skipEmpty:
+                raise ValueError('adaptive epoch requires skipping empty batch')
+            self.controller = EpochController(self.eLen, self.configs)
+        self.proposeTimes = {}
+        self.numSkips = 0
+
+    def _skipBehind(self):
+        #as in mencius, an idle node skips its instances below the largest
+        #learned one, so that the instances after them can be executed
+        prunner = self.cnode.paxosPRunner
+        learner = self.cnode.paxosLearner
+        if len(prunner.requests) > 0:
+            return
+        while prunner.nextInstanceID + prunner.iidstep < learner.maxInstanceID:
+            skip = Skip('%s-skip-%s'%(self, self.numSkips))
+            prunner.addSkip(skip)
+            self.numSkips += 1
+
+    def _setEpochAlarm(self, localTime, skew=True):
+        #epoch boundaries are in the local clock time
+        return self.clock.setAlarm(localTime, 'epoch', jitter=skew)
 
     def run(self):
-        periodEvent = Alarm.setPeriodic(self.eLen, name='epoch', drift=self.skew)
-        lastEpochTime = 0
+        if self.controller is None:
+            lastEpochTime = int(self.clock.now() / self.eLen) * self.eLen
+        else:
+            lastEpochTime = self.clock.now()
+        periodEvent = self._setEpochAlarm(lastEpochTime + self.eLen)
+        fullEvent = None
         count = 0
         lastBatch = False
         while True:
             #handle batch transaction event
-            if now() > lastEpochTime + self.eLen and not lastBatch:
-                batch = Batch('%s-%s'%(self, count))
-                while len(self.newTxns) > 0:
-                    txn = self.newTxns.pop()
-                    batch.append(txn)
-                #propose the txn for instance
-                self.monitor.start('order.consensus.%s'%batch)
-                self.cnode.paxosPRunner.addRequest(batch)
-                lastEpochTime += self.eLen
+            fired = self.eventsFired
+            isNewEpoch = periodEvent in fired
+            if self.controller is not None:
+                isNewEpoch = (isNewEpoch or fullEvent in fired or
+                              self.controller.isEpochEnd(
+                                  len(self.newTxns),
+                                  self.clock.now() - lastEpochTime))
+                if (not isNewEpoch and fullEvent is None and
+                    self.controller.isFull(len(self.newTxns))):
+                    #the batch is full, end the epoch as soon as allowed
+                    fullEvent = self._setEpochAlarm(
+                        lastEpochTime + self.controller.minLen, skew=False)
+            if isNewEpoch and not lastBatch:
+                if self.skipEmpty and len(self.newTxns) == 0:
+                    batch = None
+                    self.monitor.observe('epoch.empty', 1)
+                else:
+                    batch = Batch('%s-%s'%(self, count))
+                    while len(self.newTxns) > 0:
+                        txn = self.newTxns.pop()
+                        batch.append(txn)
+                    #propose the txn for instance
+                    self.monitor.start('order.consensus.%s'%batch)
+                    self.cnode.paxosPRunner.addRequest(batch)
+                    self.proposeTimes[batch] = now()
+                    self.logger.debug('%s propose new batch %s at %s'
+                                      %(self.ID, batch, now()))
+                elapsed = self.clock.now() - lastEpochTime
+                self.monitor.observe('epoch.length', elapsed)
+                if self.controller is None:
+                    lastEpochTime += self.eLen
+                else:
+                    numTxns = 0 if batch is None else len(batch.batch)
+                    self.controller.onEpoch(numTxns, elapsed)
+                    lastEpochTime = self.clock.now()
+                    self.eLen = self.controller.next()
+                    fullEvent = None
+                periodEvent = self._setEpochAlarm(lastEpochTime + self.eLen)
                 count += 1
-                self.logger.debug('%s propose new batch %s at %s'
-                                  %(self.ID, batch, now()))
                 if self.shouldClose:
                     self.logger.debug('%s sending last batch at %s'
                                       %(self, now()))
                     lastBatch = True
+            #fill the instances we have not proposed in
+            if self.skipEmpty and len(self.newTxns) == 0:
+                self._skipBehind()
             #handle new instance
             instances = self.cnode.paxosLearner.instances
             while self.nextIID in instances:
                 readyBatch = instances[self.nextIID]
-                if self.ID in readyBatch.ID:
+                if readyBatch in self.proposeTimes:
                     self.monitor.stop('order.consensus.%s'%readyBatch)
+                    elapsed = now() - self.proposeTimes.pop(readyBatch)
+                    if self.controller is not None:
+                        self.controller.onConsensus(elapsed)
                 if not readyBatch.isEmpty():
                     self.logger.debug('%s execute new batch %s at %s'
                                       %(self.ID, readyBatch, now()))
-                for txn in readyBatch:
-                    self.lockingQueue.append(txn)
-                    thread = StorageNode.TxnStarter(self, txn)
-                    thread.start()
+                self.enqueueBatch(list(readyBatch))
                 self.nextIID += 1
             #garbage collection
             if len(instances) > 1000:
                 for i in range(self.gcID, self.nextIID / 2):
-                    del instances[i]
+                    instances.pop(i, None)
                 self.gcID = self.nextIID / 2
             #wait for new event
-            yield waitevent, self, \
-                    (periodEvent, self.cnode.paxosLearner.newInstanceEvent)
+            events = [periodEvent, self.cnode.paxosLearner.newInstanceEvent]
+            if self.controller is not None:
+                events.append(self.newTxnEvent)
+                if fullEvent is not None:
+                    events.append(fullEvent)
+            yield waitevent, self, events
+
+#####  TEST  #####
+def testDefault():
+    print '===== test default ====='
+    from sim import simulate
+    from sim.configure import readDefault
+    #epdetmn is the default system.impl
+    configs = readDefault()
+    assert configs['system.impl'] == 'sim.impl.epdetmn.EPaxosDetmnSystem'
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['epdetmn.num.epochs'] > 0
+    #with the epoch skew of the clock timer
+    configs['epdetmn.epoch.skew.dist'] = ('uniform', -1, {'lb':0, 'ub':10})
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    print 'test default passed'
+
+def testAdaptiveEpoch():
+    print '===== test adaptive epoch ====='
+    from sim import simulate
+    from sim.configure import readDefault
+    configs = readDefault({'epdetmn.adaptive.epoch' : True})
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['loss.ratio'] == 0
+    #the epochs follow the load instead of the fixed length
+    assert results['epdetmn.epoch.length.std'] > 0
+    #idle nodes skip empty batches and fill their instances with skips
+    assert results['epdetmn.num.empty.epochs'] > 0
+    assert results['paxos.num.skip'] > 0
+    print 'test adaptive epoch passed'
+
+def testBatchPlanner():
+    print '===== test batch planner ====='
+    from sim import simulate
+    from sim.configure import readDefault
+    configs = readDefault({
+        'detmn.batch.planner' : True,
+        'total.num.txns' : 200,
+        'txn.arrive.interval.dist' : ('expo', 5),
+        'txn.classes' : [
+            {'freq' : 1, 'nwrites' : 10,
+             'action.intvl.dist' : ('fixed', 5),
+             'commit.intvl.dist' : ('fixed', 0)},
+        ],
+    })
+    #one txn runs for 10 * 5
+    runTime = 50
+    #few conflicts, the txns of a batch run in parallel
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['planned.batch.size.mean'] > 2
+    assert results['planned.batch.wave.width'] > 2
+    assert results['wait.deps.time.mean'] < runTime
+    #every txn conflicts with the others, they run one after another
+    configs['dataset.groups'] = {1 : 12}
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['planned.batch.wave.width'] == 1
+    assert results['wait.deps.time.mean'] > runTime
+    print 'test batch planner passed'
+
+def test():
+    testDefault()
+    testAdaptiveEpoch()
+    testBatchPlanner()
+
+def main():
+    test()
 
+if __name__ == '__main__':
+    main()
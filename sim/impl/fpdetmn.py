@@ -17,7 +17,8 @@ class FPaxosDetmnSystem(SLPaxosDetmnSystem):
             'fast.paxos.coordinated.recovery', False)
         initPaxosCluster(
             self.cnodes, self.cnodes, coordinatedRecovery, True, 'all',
-            False, False, infinite)
+            False, False, infinite,
+            **self.getThriftyKargs())
 
 class FPDCNode(ClientNode):
     pass
@@ -0,0 +1,397 @@
+import logging
+
+from SimPy.Simulation import SimEvent
+from SimPy.Simulation import now
+from SimPy.Simulation import waitevent
+
+from sim.core import BThread, IDable, Thread
+from sim.impl.cdetmn import CentralDetmnSystem, CDSNode, DETxnRunner
+from sim.paxos import getClassicQSize
+from sim.perf import Profiler
+from sim.rti import MsgXeiver
+from sim.system import ClientNode
+
+LL_MSG_TAGS = ['preaccept', 'preacceptok', 'accept', 'acceptok', 'commit']
+
+def getLLFastQSize(n):
+    #F + floor((F + 1) / 2), including the command leader
+    f = (n - 1) / 2
+    return max(f + (f + 1) / 2, 1)
+
+def getItemIDs(txn):
+    itemIDs = set([])
+    for action in txn.actions:
+        itemIDs.add(action.itemID)
+    return itemIDs
+
+class LeaderlessDetmnSystem(CentralDetmnSystem):
+    """Deterministic system with leaderless dependency based ordering.
+
+    Every client node leads the ordering of the txns arriving in its zone, in
+    the style of EPaxos. A txn that does not interfere with any concurrent txn
+    commits after a single round trip to a fast quorum; otherwise an extra
+    round trip to a classic quorum is needed. Replicas execute committed txns
+    in dependency order. As in EPaxos, under sustained high contention the
+    dependency graph of a txn may keep growing, and the txn is not executed
+    until the graph closes.
+
+    """
+    def newClientNode(self, idx, configs):
+        return LLDCNode(self, idx, configs)
+
+    def newStorageNode(self, cnode, index, configs):
+        return LLDSNode(cnode, index, configs)
+
+    def startupPaxos(self):
+        replicas = []
+        for cnode in self.cnodes:
+            replica = LLReplica(cnode)
+            cnode.llReplica = replica
+            replicas.append(replica)
+        for replica in replicas:
+            replica.init(replicas)
+            replica.start()
+
+    def profile(self):
+        CentralDetmnSystem.profile(self)
+        rootMon = Profiler.getMonitor('/')
+        pmean, pstd, phisto, pcount = \
+                rootMon.getElapsedStats('.*order.consensus')
+        self.results.add('order.consensus.time.mean', pmean)
+        self.results.add('order.consensus.time.std', pstd)
+        numFast = rootMon.getObservedCount('.*ll.fast.commit')
+        numSlow = rootMon.getObservedCount('.*ll.slow.commit')
+        self.results.add('ll.num.fast.commit', numFast)
+        self.results.add('ll.num.slow.commit', numSlow)
+        if numFast + numSlow != 0:
+            self.results.add('ll.fast.commit.ratio',
+                             float(numFast) / (numFast + numSlow))
+            numMsgs = 0
+            for tag in LL_MSG_TAGS:
+                numMsgs += MsgXeiver.msgCounts.get(tag, 0)
+            self.results.add('ll.msgs.per.commit',
+                             float(numMsgs) / (numFast + numSlow))
+
+class LLDCNode(ClientNode):
+    def __init__(self, system, ID, configs):
+        ClientNode.__init__(self, system, ID, configs)
+        self.llReplica = None
+
+class LLReplica(IDable, Thread, MsgXeiver):
+    """Replica of the leaderless ordering protocol.
+
+    A replica keeps, for each item, the txns it has seen but not yet executed
+    and the last txn it executed. Their union is the interference set of a new
+    txn on that item. The last executed txn transitively depends on all txns
+    executed before it, so the older ones can be dropped.
+
+    """
+    def __init__(self, cnode):
+        IDable.__init__(self, '%s/llreplica'%cnode.ID)
+        Thread.__init__(self)
+        MsgXeiver.__init__(self, cnode.inetAddr)
+        self.cnode = cnode
+        self.replicas = None
+        self.itemTxns = {}          #{itemID: [txn]}, seen and not executed
+        self.lastExecuted = {}      #{itemID: txn}
+        self.seqs = {}              #{txn: seq}
+        self.committed = {}         #{txn: deps}, committed and not executed
+        self.blockedBy = {}         #{txn: [txn]}, waiting for txn to commit
+        self.executed = set([])
+        self.execOrder = []
+        self.newExecEvent = SimEvent()
+        self.closed = False
+        self.monitor = Profiler.getMonitor(self.ID)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def init(self, replicas):
+        self.replicas = replicas
+        self.total = len(replicas)
+        self.qsize = getClassicQSize(self.total)
+        self.fqsize = getLLFastQSize(self.total)
+
+    def close(self):
+        self.closed = True
+
+    def propose(self, txn):
+        commander = LLCommander(self, txn)
+        commander.start()
+
+    def isKnown(self, txn):
+        return txn in self.committed or txn in self.executed
+
+    def preaccept(self, txn, seq, deps):
+        """Update the attributes of @txn with the local interference."""
+        deps = set(deps)
+        for itemID in getItemIDs(txn):
+            for other in self.itemTxns.get(itemID, []):
+                if other != txn:
+                    deps.add(other)
+            last = self.lastExecuted.get(itemID)
+            if last is not None:
+                deps.add(last)
+        for dep in deps:
+            seq = max(seq, self.seqs.get(dep, 0) + 1)
+        self.record(txn, seq)
+        return seq, frozenset(deps)
+
+    def record(self, txn, seq):
+        if txn not in self.seqs:
+            for itemID in getItemIDs(txn):
+                if itemID not in self.itemTxns:
+                    self.itemTxns[itemID] = []
+                self.itemTxns[itemID].append(txn)
+        self.seqs[txn] = seq
+
+    def commit(self, txn, seq, deps):
+        if self.isKnown(txn):
+            return
+        self.record(txn, seq)
+        self.committed[txn] = deps
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('%s commit %s seq=%s deps=[%s] at %s'
+                              %(self.ID, txn.ID, seq,
+                                ', '.join([d.ID for d in deps]), now()))
+        self._executeCommitted(txn)
+
+    def _getGraph(self, root):
+        #the committed and not executed txns reachable from root, or the
+        #first txn found that is not committed yet
+        graph = {}
+        stack = [root]
+        while len(stack) > 0:
+            txn = stack.pop()
+            if txn in graph:
+                continue
+            if txn not in self.committed:
+                return None, txn
+            graph[txn] = []
+            for dep in self.committed[txn]:
+                if dep in self.executed:
+                    continue
+                graph[txn].append(dep)
+                stack.append(dep)
+        return graph, None
+
+    def _executeCommitted(self, txn):
+        #only the txn itself and those blocked by it can become executable
+        candidates = [txn] + self.blockedBy.pop(txn, [])
+        for root in candidates:
+            if root in self.executed:
+                continue
+            graph, blocker = self._getGraph(root)
+            if graph is None:
+                if blocker not in self.blockedBy:
+                    self.blockedBy[blocker] = []
+                self.blockedBy[blocker].append(root)
+                continue
+            #tarjan gives the components in reverse topological order, which is
+            #exactly dependencies first
+            for scc in BThread.TarjanAlgo.findscc(graph, root):
+                scc.sort(key=lambda t: (self.seqs[t], t.ID))
+                for t in scc:
+                    self._executeTxn(t)
+        self.newExecEvent.signal()
+
+    def _executeTxn(self, txn):
+        for itemID in getItemIDs(txn):
+            self.itemTxns[itemID].remove(txn)
+            self.lastExecuted[itemID] = txn
+        del self.committed[txn]
+        self.executed.add(txn)
+        self.execOrder.append(txn)
+
+    def run(self):
+        if self.replicas is None:
+            raise ValueError('init before run')
+        while not self.closed:
+            for content in self.popContents('preaccept'):
+                commander, txn, seq, deps = content
+                if self.isKnown(txn):
+                    continue
+                seq, deps = self.preaccept(txn, seq, deps)
+                self.sendMsg(commander, 'preacceptok', (self, seq, deps))
+            for content in self.popContents('accept'):
+                commander, txn, seq, deps = content
+                if self.isKnown(txn):
+                    continue
+                self.record(txn, seq)
+                self.sendMsg(commander, 'acceptok', (self, ))
+            for content in self.popContents('commit'):
+                txn, seq, deps = content
+                self.commit(txn, seq, deps)
+            for step in self.waitMsg(['preaccept', 'accept', 'commit']):
+                yield step
+
+class LLCommander(IDable, Thread, MsgXeiver):
+    """Command leader of a txn.
+
+    The commander preaccepts the txn at its own replica and sends the
+    attributes to all the other replicas. If a fast quorum replies with the
+    same attributes, the txn commits. Otherwise, the union of the replies from
+    a classic quorum is accepted by a classic quorum before commit.
+
+    """
+    def __init__(self, replica, txn):
+        IDable.__init__(self, '%s/cmd-%s'%(replica.ID, txn.ID))
+        Thread.__init__(self)
+        MsgXeiver.__init__(self, replica.inetAddr)
+        self.replica = replica
+        self.txn = txn
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def run(self):
+        replica = self.replica
+        monitor = replica.monitor
+        monitor.start('order.consensus.%s'%self.txn)
+        #phase 1: preaccept
+        seq, deps = replica.preaccept(self.txn, 1, [])
+        others = [r for r in replica.replicas if r != replica]
+        for other in others:
+            self.sendMsg(other, 'preaccept', (self, self.txn, seq, deps))
+        replies = []
+        isFast = True
+        while True:
+            for content in self.popContents('preacceptok'):
+                other, rseq, rdeps = content
+                replies.append((rseq, rdeps))
+                if rseq != seq or rdeps != deps:
+                    isFast = False
+            if isFast and len(replies) >= replica.fqsize - 1:
+                break
+            if not isFast and len(replies) >= replica.qsize - 1:
+                break
+            if len(replies) == len(others):
+                break
+            for step in self.waitMsg('preacceptok'):
+                yield step
+        #phase 2: accept if the fast quorum does not agree
+        if isFast:
+            monitor.observe('ll.fast.commit', 1)
+        else:
+            monitor.observe('ll.slow.commit', 1)
+            deps = set(deps)
+            for rseq, rdeps in replies:
+                seq = max(seq, rseq)
+                deps.update(rdeps)
+            deps = frozenset(deps)
+            replica.record(self.txn, seq)
+            for other in others:
+                self.sendMsg(other, 'accept', (self, self.txn, seq, deps))
+            numAccepts = 0
+            while numAccepts < replica.qsize - 1:
+                for step in self.waitMsg('acceptok'):
+                    yield step
+                for content in self.popContents('acceptok'):
+                    numAccepts += 1
+        #commit
+        monitor.stop('order.consensus.%s'%self.txn)
+        self.logger.debug('%s commit %s fast=%s at %s'
+                          %(self.ID, self.txn.ID, isFast, now()))
+        for other in others:
+            self.sendMsg(other, 'commit', (self.txn, seq, deps))
+        replica.commit(self.txn, seq, deps)
+
+class LLDSNode(CDSNode):
+    def __init__(self, cnode, index, configs):
+        CDSNode.__init__(self, cnode, index, configs)
+        self.nextExec = 0
+
+    def run(self):
+        while True:
+            replica = self.cnode.llReplica
+            #handle new transaction
+            while len(self.newTxns) > 0:
+                txn = self.newTxns.pop(0)
+                replica.propose(txn)
+            #handle executable txns
+            while self.nextExec < len(replica.execOrder):
+                txn = replica.execOrder[self.nextExec]
+                self.logger.debug('%s ready to start runner for %s'
+                                  %(self.ID, txn))
+                self.enqueueTxn(txn)
+                self.nextExec += 1
+            #wait for new event
+            yield waitevent, self, (self.newTxnEvent, replica.newExecEvent)
+
+    def newTxnRunner(self, txn):
+        return LLTxnRunner(self, txn)
+
+class LLTxnRunner(DETxnRunner):
+    """Deterministic txn runner for the leaderless system.
+
+    Txns that do not interfere may run in different orders on different
+    replicas, so item versions count the writes on the item instead of using
+    the storage node sequence.
+
+    """
+    def newVersion(self, item):
+        return item.version + 1
+
+#####  TEST  #####
+def testExecOrder():
+    print '===== test exec order ====='
+    from SimPy.Simulation import initialize
+    from sim.configure import readDefault
+    from sim.data import ItemID
+    from sim.rti import RTI
+    from sim.txns import Action, Transaction
+    initialize()
+    RTI.initialize(readDefault())
+    class FakeCNode(object):
+        def __init__(self, ID):
+            self.ID = ID
+            self.inetAddr = ID
+    replica = LLReplica(FakeCNode('zone0/cn'))
+    replica.init([replica])
+    def newTxn(ID, iids):
+        actions = [Action(Action.WRITE, ItemID(0, i)) for i in iids]
+        return Transaction(ID, 0, actions, {})
+    t0 = newTxn(0, [0])
+    t1 = newTxn(1, [0, 1])
+    t2 = newTxn(2, [1])
+    t3 = newTxn(3, [2])
+    t4 = newTxn(4, [2])
+    #a txn waits until its dependencies commit
+    replica.commit(t2, 3, frozenset([t1]))
+    replica.commit(t1, 2, frozenset([t0]))
+    assert replica.execOrder == []
+    replica.commit(t0, 1, frozenset([]))
+    assert replica.execOrder == [t0, t1, t2]
+    #txns depending on each other execute in the order of the seqs
+    replica.commit(t4, 1, frozenset([t3]))
+    replica.commit(t3, 2, frozenset([t4]))
+    assert replica.execOrder[3:] == [t4, t3]
+    assert replica.committed == {} and replica.blockedBy == {}
+    #a new txn depends on the last executed ones of its items
+    seq, deps = replica.preaccept(newTxn(5, [1, 2]), 1, [])
+    assert deps == frozenset([t2, t3]) and seq == 4
+    print 'test exec order passed'
+
+def testConflicts():
+    print '===== test conflicts ====='
+    from sim import simulate
+    from sim.configure import readDefault
+    configs = readDefault({
+        'system.impl' : 'sim.impl.lldetmn.LeaderlessDetmnSystem',
+        #every txn writes 10 of the 16 items, so concurrent txns conflict
+        'dataset.groups' : {1 : 16},
+        'txn.arrive.interval.dist' : ('expo', 20),
+        'total.num.txns' : 100,
+    })
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['loss.ratio'] == 0
+    #replicas disagree on the dependencies of the conflicting txns
+    assert results['ll.num.slow.commit'] > 0
+    print 'test conflicts passed'
+
+def test():
+    testExecOrder()
+    testConflicts()
+
+def main():
+    test()
+
+if __name__ == '__main__':
+    main()
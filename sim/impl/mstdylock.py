@@ -20,16 +20,17 @@ class MasterDyLockSystem(CentralDyLockSystem):
     def startupPaxos(self):
         initPaxosCluster(
             self.cnodes, self.cnodes, False, False, 'one',
-            True, False, infinite)
+            True, False, infinite,
+            **self.getThriftyKargs())
 
     def profile(self):
         CentralDyLockSystem.profile(self)
         rootMon = Profiler.getMonitor('/')
         pmean, pstd, phisto, pcount = \
                 rootMon.getElapsedStats('.*paxos.propose')
-        self.logger.info('paxos.propose.time.mean=%s'%pmean)
-        self.logger.info('paxos.propose.time.std=%s'%pstd)
-        self.logger.info('paxos.propose.time.histo=(%s, %s)'%(phisto))
+        self.results.add('paxos.propose.time.mean', pmean)
+        self.results.add('paxos.propose.time.std', pstd)
+        self.results.add('paxos.propose.time.histo', phisto)
 
 class MDLCNode(ClientNode):
     def __init__(self, system, ID, configs):
@@ -5,7 +5,7 @@ from sim.core import infinite
 from sim.impl.cdetmn import CentralDetmnSystem, CDSNode
 from sim.paxos import initPaxosCluster, profilePaxos
 from sim.perf import Profiler
-from sim.system import ClientNode, StorageNode
+from sim.system import ClientNode
 
 class SLPaxosDetmnSystem(CentralDetmnSystem):
     """Deterministic system with master timestamp assignment."""
@@ -18,12 +18,13 @@ class SLPaxosDetmnSystem(CentralDetmnSystem):
     def startupPaxos(self):
         initPaxosCluster(
             self.cnodes, self.cnodes, False, False, 'one',
-            True, False, infinite)
+            True, False, infinite,
+            **self.getThriftyKargs())
 
     def profile(self):
         CentralDetmnSystem.profile(self)
         rootMon = Profiler.getMonitor('/')
-        profilePaxos(self.logger, rootMon)
+        profilePaxos(self.results, rootMon)
 
 class SPDCNode(ClientNode):
     def __init__(self, system, ID, configs):
@@ -74,9 +75,7 @@ class SPDSNode(CDSNode):
                     proposingTxns.remove(readyTxn)
                 self.logger.debug('%s ready to start runner for %s'
                                   %(self.ID, readyTxn))
-                self.lockingQueue.append(readyTxn)
-                thread = StorageNode.TxnStarter(self, readyTxn)
-                thread.start()
+                self.enqueueTxn(readyTxn)
                 self.nextIID += 1
             #wait for new event
             yield waitevent, self, \
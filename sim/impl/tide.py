@@ -1,16 +1,23 @@
 import logging
-import random
 
 from SimPy.Simulation import now
 from SimPy.Simulation import waitevent, hold
 
-from sim.core import Alarm, IDable, Thread
-from sim.impl.cendet import CDSNode
+from sim.core import IDable, Thread, TimeoutException
+from sim.impl.cdetmn import CDSNode
 from sim.rti import MsgXeiver
 from sim.system import BaseSystem, ClientNode
 
 class DeterministicReplicationSystem(BaseSystem):
-    """Deterministic replication system."""
+    """Deterministic replication system.
+
+    Every client node batches the txns arriving in an epoch of
+    'tide.epoch.length' and replicates the batch of the epoch to all
+    acceptors. Epochs are numbered by the local clock of the client node (see
+    sim.clock), so a node with a skewed clock puts its txns in an earlier or a
+    later epoch than the other nodes.
+
+    """
     def newClientNode(self, idx, configs):
         return DRCNode(self, idx, configs)
 
@@ -20,64 +27,71 @@ class DeterministicReplicationSystem(BaseSystem):
 class DRCNode(ClientNode):
     def __init__(self, system, ID, configs):
         ClientNode.__init__(self, system, ID, configs)
-        self.epochLength = self.configs['tide.epoch.length']
-        skew = self.calcSkew()
-        self.skew = skew if skew > 0 else -skew
+        self.epochLength = self.configs.get('tide.epoch.length', 50)
         self.epochQueue = []
+        self.proposed = {}      #{eid : batch}, not learned yet
         self.acceptor = Acceptor(self)
         self.learner = Learner(self)
         self.sysAcceptors = []
         self.sysLearners = []
 
-    def calcSkew(self):
-        mu = self.configs.get('tide.epoch.skew.mu', 0)
-        sigma = self.configs.get('tide.epoch.skew.sigma', 5)
-        return random.normalvariate(mu, sigma)
-
     def now(self):
-        return now() - self.skew
+        return self.clock.now()
 
     def onTxnArrive(self, txn):
-        if len(self.runningTxns) < self.maxNumTxns:
-            self.system.onTxnArrive(txn)
-            self.runningTxns[txn] = None
-            self.epochQueue.append(txn)
-        else:
-            self.system.onTxnLoss(txn)
+        self.system.onTxnArrive(txn)
+        self.txnsRunning.add(txn)
+        self.epochQueue.append(txn)
+
+    def onBatchLearned(self, eid, batch):
+        #a batch proposed too late is learned empty, retry in the next epoch
+        proposed = self.proposed.pop(eid, [])
+        if len(batch) == 0 and len(proposed) > 0:
+            self.epochQueue[0:0] = proposed
+            self.logger.debug('%s batch %s.%s expired at %s'
+                              %(self, self, eid, now()))
 
-    def onTxnDepart(self, txn):
-        if txn not in self.runningTxns:
-            return
-        del self.runningTxns[txn]
-        self.system.onTxnDepart(txn)
+    def isAllLearned(self):
+        system = self.system
+        return (self.learner.numTxnsLearned ==
+                system.numTxnsArrive - system.numTxnsLoss)
+
+    def getEpochAlarm(self, eid):
+        return self.clock.setAlarm(eid * self.epochLength, 'epoch')
 
     def run(self):
         for cnode in self.system.cnodes:
             self.sysAcceptors.append(cnode.acceptor)
         for cnode in self.system.cnodes:
             self.sysLearners.append(cnode.learner)
-        yield hold, self, self.skew
         self.acceptor.start()
         self.learner.start()
-        timer = Alarm.setPeriodic(self.epochLength, 'epoch')
-        while not self.shouldClose:
+        #batch eid is proposed when the local clock reads eid * epochLength
+        eid = max(int(self.now() / self.epochLength), 0) + 1
+        timer = self.getEpochAlarm(eid)
+        while True:
             yield waitevent, self, (self.closeEvent, timer)
             if timer in self.eventsFired:
                 batch = []
                 while len(self.epochQueue) > 0:
                     batch.append(self.epochQueue.pop(0))
-                eid = int((self.now() + 0.01)/ self.epochLength)
                 Proposer(self).propose(eid, list(batch))
                 if len(batch) > 0:
+                    self.proposed[eid] = batch
                     self.logger.debug(
                         '%s proposed batch %s.%s %s at %s'
                         %(self, self, eid,
                           '[%s]'%(', '.join([txn.ID for txn in batch])),
                           now()))
-            elif self.shouldClose:
-                self.acceptor.close()
-                self.learner.close()
-                self._close()
+                eid += 1
+                timer = self.getEpochAlarm(eid)
+            #the other nodes wait for our epochs until all txns are learned
+            if self.shouldClose and self.isAllLearned():
+                break
+        self.acceptor.close()
+        self.learner.close()
+        for step in self._close():
+            yield step
 
 class Proposer(MsgXeiver):
     """Proposer of epochID.cnodeID.
@@ -87,9 +101,11 @@ class Proposer(MsgXeiver):
         MsgXeiver.__init__(self, cnode.ID)
         self.cnode = cnode
 
-    def propose(self, eid, batch):
+    def propose(self, eid, batch, cnodeID=None):
+        if cnodeID is None:
+            cnodeID = self.cnode.ID
         for acceptor in self.cnode.sysAcceptors:
-            self.sendMsg(acceptor, 'accept', (eid, self.cnode.ID, batch))
+            self.sendMsg(acceptor, 'accept', (eid, cnodeID, batch))
 
 class Acceptor(IDable, Thread, MsgXeiver):
     """Epoch replication acceptor.
@@ -120,14 +136,16 @@ class Acceptor(IDable, Thread, MsgXeiver):
         expired = 0
         epochLength = self.cnode.epochLength
         lastgc = 0
+        #wake up at the epoch boundaries of the local clock
+        next = (int(self.cnode.now() / epochLength) + 1) * epochLength
         while not self.shouldClose:
-            next = (self.cnode.now() / epochLength + 1) * epochLength
-            timeout = next - now()
+            timeout = max(self.cnode.clock.getDelay(next), 0)
+            timedOut = False
             try:
                 for step in self.waitMsg('accept', timeout):
                     yield step
-            except:
-                pass
+            except TimeoutException:
+                timedOut = True
             #check propose messages
             for content in self.popContents('accept'):
                 eid, cnodeID, batch = content
@@ -138,27 +156,30 @@ class Acceptor(IDable, Thread, MsgXeiver):
                                         now()))
                 if (eid, cnodeID) not in self.accepted:
                     self.accepted[(eid, cnodeID)] = batch
-                #tell all learners
+                #tell all learners the value accepted first
+                accepted = self.accepted[(eid, cnodeID)]
                 for learner in self.cnode.sysLearners:
                     self.sendMsg(learner, 'learn',
-                                 (eid, self.cnode.ID, (cnodeID, batch)))
+                                 (eid, self.cnode.ID, (cnodeID, accepted)))
             #expire epoch
-            if next >= now():
-                newExpire = int((now() + 0.01 - self.timeout) / epochLength)
+            if timedOut or self.cnode.now() >= next:
+                newExpire = int((self.cnode.now() - self.timeout) / epochLength)
                 newExpire = newExpire if newExpire >= 0 else 0
                 for eid in range(expired + 1, newExpire + 1):
                     for cnode in self.cnode.system.cnodes:
                         if (eid, cnode.ID) not in self.accepted:
-                            Proposer(self.cnode).propose(eid, [])
+                            Proposer(self.cnode).propose(eid, [], cnode.ID)
                             self.logger.debug('%s expried batch %s.%s at %s'
                                               %(self, cnode.ID, eid, now()))
                 expired = newExpire
+                next = max(next + epochLength,
+                           (int(self.cnode.now() / epochLength) + 1) * epochLength)
             #garbage collection
             interval = 1000000
             if now() - lastgc > interval:
                 lastgc = now()
                 safe = expired - interval / epochLength
-                for key in self.accepted:
+                for key in list(self.accepted):
                     eid, cnodeID = key
                     if eid < safe:
                         del self.accepted[(eid, cnodeID)]
@@ -178,6 +199,7 @@ class Learner(IDable, Thread, MsgXeiver):
         self.shouldClose = False
         self.learned = {}       #{eid : {cnodeID : batch}}
         self.votes = {}         #{(eid, cnodeID) : votes}
+        self.numTxnsLearned = 0
 
     def close(self):
         self.shouldClose = True
@@ -208,8 +230,10 @@ class Learner(IDable, Thread, MsgXeiver):
                     if eid not in self.learned:
                         self.learned[eid] = {}
                     assert cnodeID not in self.learned[eid]
-                    self.learned[eid][cnodeID] = batch
+                    self.learned[eid][cnodeID] = votes.final
                     del self.votes[(eid, cnodeID)]
+                    if cnodeID == self.cnode.ID:
+                        self.cnode.onBatchLearned(eid, votes.final)
             #check for epochs ready for execution
             while True:
                 next = executed + 1
@@ -224,6 +248,7 @@ class Learner(IDable, Thread, MsgXeiver):
                         txns.append(txn)
                 for snode in self.cnode.snodes:
                     snode.onTxnsArrive(txns)
+                self.numTxnsLearned += len(txns)
                 del self.learned[next]
                 executed = next
                 if len(txns) != 0:
@@ -275,3 +300,29 @@ class DRSNode(CDSNode):
     #   Read item message should live a long time since other snode will read
     #   the data; (2) the fault-tolerance of read item message is not clear.
     pass
+
+#####  TEST  #####
+def testDefault():
+    print '===== test default ====='
+    from sim import simulate
+    from sim.configure import readDefault
+    configs = readDefault({
+        'system.impl' : 'sim.impl.tide.DeterministicReplicationSystem'})
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    assert results['loss.ratio'] == 0
+    #the tide keys have defaults
+    del configs.conf['tide.epoch.length']
+    del configs.conf['tide.acceptor.epoch.timeout']
+    results = simulate.run(configs, verify=True)
+    assert results['verified'] is True
+    print 'test default passed'
+
+def test():
+    testDefault()
+
+def main():
+    test()
+
+if __name__ == '__main__':
+    main()
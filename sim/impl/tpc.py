@@ -6,9 +6,9 @@ from SimPy.Simulation import hold
 from sim.core import BThread, IDable, infinite
 from sim.locking import Lockable, LockThread
 from rintvl import RandInterval
-from sim.rti import MsgXeiver
+from sim.rti import MsgXeiver, REF_PKT_SIZE
 from sim.system import BaseSystem, StorageNode
-from sim.txns import TxnRunner
+from sim.txns import Action, TxnRunner
 
 class TPCLockingSystem(BaseSystem):
     """Two phase commit protocol with two phase locking implementation. """
@@ -85,10 +85,10 @@ class TPCTxnRunner(TxnRunner, MsgXeiver):
                          (self.attemptNo, TPCProtocol.RUNNING, itemID))
             self.released(proxy.conn)
             self.tryWait(proxy.conn)
-            until = now() + self.snode.configs.get('tpc.conn.timeout', infinite)
+            until = self.getConnDeadline()
             while True:
                 if not self.checkMsg('msg'):
-                    for step in self.waitMsg('msg', until - now()):
+                    for step in self.waitMsg('msg', self.getWaitTime(until)):
                         yield step
                 succeeded = False
                 for content in self.popContents('msg'):
@@ -132,14 +132,15 @@ class TPCTxnRunner(TxnRunner, MsgXeiver):
             self.logger.debug('%s send try commit request to %s at %s'
                               %(self.ID, proxy.ID, now()))
             self.sendMsg(proxy, 'msg',
-                         (self.attemptNo, TPCProtocol.COMMITTING, writeset))
+                         (self.attemptNo, TPCProtocol.COMMITTING, writeset),
+                         self.getWritesetPktSize(writeset))
             self.released(proxy.conn)
             self.tryWait(proxy.conn)
         #wait for all commit proxies ready
-        until = now() + self.snode.configs.get('tpc.conn.timeout', infinite)
+        until = self.getConnDeadline()
         while len(commitProxies) > 0:
             if not self.checkMsg('msg'):
-                for step in self.waitMsg('msg', until - now()):
+                for step in self.waitMsg('msg', self.getWaitTime(until)):
                     yield step
             for content in self.popContents('msg'):
                 p, attemptNo, label, result, attr = content
@@ -166,6 +167,21 @@ class TPCTxnRunner(TxnRunner, MsgXeiver):
         self.logger.debug('%s got all commit proxy return at %s'
                           %(self.ID, now()))
 
+    def getConnDeadline(self):
+        timeout = self.snode.configs.get('tpc.conn.timeout', infinite)
+        if timeout == infinite:
+            return infinite
+        return now() + timeout
+
+    def getWaitTime(self, until):
+        if until == infinite:
+            return infinite
+        return max(until - now(), 0)
+
+    def getWritesetPktSize(self, writeset):
+        valueSize = self.txn.config.get('write.value.size', 0)
+        return REF_PKT_SIZE * 3 + len(writeset) * (Action.PKT_SIZE + valueSize)
+
     def getSnodeWritesets(self):
         writesets = {}
         system = self.snode.system
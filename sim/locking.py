@@ -171,6 +171,7 @@ class Lockable(IDable):
                 self.state = Lockable.EXCLUSIVE
                 self.blockQueue.remove(owner)
                 del self.blockedThreads[owner]
+                self._grant(owner)
         else:
             threads, state = Lockable.WakeupAlgo(self)
             if threads != None:
@@ -179,6 +180,11 @@ class Lockable(IDable):
                     self.blockQueue.remove(thread)
                     del self.blockedThreads[thread]
                     self.owners.add(thread)
+                    self._grant(thread)
+
+    def _grant(self, thread):
+        if isinstance(thread, BThread):
+            thread.granted(self)
 
     def block(self, thread, state):
         """Block a thread for this object."""
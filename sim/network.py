@@ -1,6 +1,12 @@
-from SimPy.Simulation import hold
+import math
+import re
+
+import numpy
+from SimPy.Simulation import hold, now
 
 from rintvl import RandInterval
+from sim.core import infinite
+from sim.importutils import loadClass
 
 class IIDLatencyNetwork(object):
     """A network with iid latency distribution.
@@ -11,11 +17,14 @@ class IIDLatencyNetwork(object):
     """
     WITHIN_KEY = 'nw.latency.within.zone'
     CROSS_KEY = 'nw.latency.cross.zone'
+    NUM_EXPECT_SAMPLES = 1000
+    NEED_PKT_SIZE = False
     def __init__(self, configs):
         self.withinGen = RandInterval.get(
             *configs[IIDLatencyNetwork.WITHIN_KEY])
         self.crossGen = RandInterval.get(
             *configs[IIDLatencyNetwork.CROSS_KEY])
+        self.expected = {}      #{gen: mean latency}
 
     def getWithinZoneLatency(self):
         return self.withinGen.next()
@@ -26,6 +35,10 @@ class IIDLatencyNetwork(object):
     def getZone(self, addr):
         return addr.split('/')[0]
 
+    def resolve(self, addr):
+        """The handle of @addr passed to the other methods."""
+        return addr
+
     def getLatency(self, src, dst):
         if src == dst:
             return 0
@@ -36,11 +49,375 @@ class IIDLatencyNetwork(object):
         else:
             return self.getCrossZoneLatency()
 
+    def getExpectedLatency(self, src, dst):
+        """Expected latency between @src and @dst.
+
+        The mean is estimated once from samples of the distribution, because
+        the configured mean is not always meaningful(e.g. -1 for uniform).
+
+        """
+        if src == dst:
+            return 0
+        if self.getZone(src) == self.getZone(dst):
+            gen = self.withinGen
+        else:
+            gen = self.crossGen
+        if gen not in self.expected:
+            total = 0.0
+            for i in range(IIDLatencyNetwork.NUM_EXPECT_SAMPLES):
+                total += gen.next()
+            self.expected[gen] = total / IIDLatencyNetwork.NUM_EXPECT_SAMPLES
+        return self.expected[gen]
+
+    def sendPacket(self, pemproc, src, dst, pktSize):
+        latency = self.getLatency(src, dst)
+        yield hold, pemproc, latency
+
+    def profile(self, results):
+        pass
+
+class SampleBuffer(object):
+    """Pre-sampled values of a distribution, refilled when used up."""
+    def __init__(self, gen, size):
+        self.gen = gen
+        self.size = size
+        self.samples = []
+        self.index = 0
+
+    def next(self):
+        if self.index == len(self.samples):
+            #draw in bulk, a list is faster to index than an array
+            self.samples = self.gen.sample(self.size).tolist()
+            self.index = 0
+        value = self.samples[self.index]
+        self.index += 1
+        return value
+
+    def getMean(self, nsamples):
+        #the configured mean is not always meaningful(e.g. -1 for uniform)
+        return float(self.gen.sample(nsamples).mean())
+
+class MatrixLatencyNetwork(object):
+    """A network with a latency distribution for each pair of zones.
+
+    The distributions are given by 'nw.latency.matrix' as {(i, j): dist}, or
+    read from 'nw.latency.matrix.file' with one 'i j = dist' per line. A pair
+    given in one direction is used for both. Missing pairs fall back to
+    'nw.latency.within.zone' and 'nw.latency.cross.zone' if configured.
+
+    Inet addresses are in the form of 'zone%d/ID' and are resolved once to
+    (zone id, address) handles. Latencies are drawn from buffers of
+    pre-sampled values of each distribution.
+
+    """
+    MATRIX_KEY = 'nw.latency.matrix'
+    MATRIX_FILE_KEY = 'nw.latency.matrix.file'
+    BUFFER_SIZE = 1024
+    NUM_EXPECT_SAMPLES = 1000
+    NEED_PKT_SIZE = False
+    ZONE_PATTERN = re.compile('zone(\d+)$')
+    def __init__(self, configs):
+        matrix = self.readMatrix(configs)
+        numZones = configs.get('num.zones', 0)
+        for i, j in matrix.keys() + self.getCustomPairs():
+            numZones = max(numZones, i + 1, j + 1)
+        self.numZones = numZones
+        within = configs.get(IIDLatencyNetwork.WITHIN_KEY)
+        cross = configs.get(IIDLatencyNetwork.CROSS_KEY)
+        #share one buffer among the pairs with the same distribution
+        buffers = {}
+        def getBuffer(dist):
+            key = repr(dist)
+            if key not in buffers:
+                buffers[key] = SampleBuffer(RandInterval.get(*dist),
+                                            MatrixLatencyNetwork.BUFFER_SIZE)
+            return buffers[key]
+        self.buffers = []
+        for i in range(numZones):
+            row = []
+            for j in range(numZones):
+                buf = self.getCustomBuffer(i, j)
+                if buf is not None:
+                    row.append(buf)
+                    continue
+                if (i, j) in matrix:
+                    dist = matrix[(i, j)]
+                elif (j, i) in matrix:
+                    dist = matrix[(j, i)]
+                elif i == j and within is not None:
+                    dist = within
+                elif i != j and cross is not None:
+                    dist = cross
+                else:
+                    raise ValueError('no latency between zone %s and zone %s'
+                                     %(i, j))
+                row.append(getBuffer(dist))
+            self.buffers.append(row)
+        self.expected = {}      #{buffer: mean latency}
+
+    @classmethod
+    def readMatrix(cls, configs):
+        matrix = dict(configs.get(MatrixLatencyNetwork.MATRIX_KEY, {}))
+        fn = configs.get(MatrixLatencyNetwork.MATRIX_FILE_KEY)
+        if fn is not None:
+            fh = open(fn, 'r')
+            for line in fh:
+                line = line.split('#')[0].strip()
+                if line == '':
+                    continue
+                try:
+                    pair, dist = line.split('=', 1)
+                    i, j = [int(z) for z in pair.split()]
+                    matrix[(i, j)] = eval(dist.strip(), {'math' : math})
+                except Exception as e:
+                    raise SyntaxError('%s: line must be i j = dist: %s, %s'
+                                      %(fn, line, e))
+            fh.close()
+        return matrix
+
+    def getCustomPairs(self):
+        """Zone pairs with their own latency buffers in subclasses."""
+        return []
+
+    def getCustomBuffer(self, i, j):
+        return None
+
+    def resolve(self, addr):
+        zone = addr.split('/')[0]
+        match = MatrixLatencyNetwork.ZONE_PATTERN.match(zone)
+        if match is None:
+            raise ValueError('address not in the form of zone%%d/ID: %s'
+                             %addr)
+        zoneID = int(match.group(1))
+        if zoneID >= self.numZones:
+            raise ValueError('zone %s not in the latency matrix' %zoneID)
+        return (zoneID, addr)
+
+    def getLatency(self, src, dst):
+        if src == dst:
+            return 0
+        return self.buffers[src[0]][dst[0]].next()
+
+    def getExpectedLatency(self, src, dst):
+        if src == dst:
+            return 0
+        buf = self.buffers[src[0]][dst[0]]
+        if buf not in self.expected:
+            self.expected[buf] = \
+                    buf.getMean(MatrixLatencyNetwork.NUM_EXPECT_SAMPLES)
+        return self.expected[buf]
+
     def sendPacket(self, pemproc, src, dst, pktSize):
         latency = self.getLatency(src, dst)
         yield hold, pemproc, latency
 
+    def profile(self, results):
+        pass
+
+def readTrace(fn):
+    """Map a latency trace file without loading it."""
+    return numpy.memmap(fn, dtype='<f4', mode='r')
+
+def writeTrace(fn, samples):
+    """Write latency samples as a trace file of little endian float32."""
+    numpy.asarray(samples, dtype='<f4').tofile(fn)
+
+class TraceBuffer(object):
+    """Latencies replayed from a trace.
+
+    The trace has a sample every @interval time units and is replayed in a
+    loop, interpolating between consecutive samples.
+
+    """
+    def __init__(self, trace, interval, scale):
+        if len(trace) == 0:
+            raise ValueError('empty trace')
+        self.trace = trace
+        self.interval = float(interval)
+        self.scale = scale
+
+    def next(self):
+        pos = now() / self.interval
+        index = int(pos)
+        frac = pos - index
+        n = len(self.trace)
+        curr = float(self.trace[index % n])
+        succ = float(self.trace[(index + 1) % n])
+        return (curr + (succ - curr) * frac) * self.scale
+
+    def getMean(self, nsamples):
+        return float(self.trace.mean(dtype=numpy.float64)) * self.scale
+
+class TraceLatencyNetwork(MatrixLatencyNetwork):
+    """A latency matrix network that replays traces.
+
+    'nw.trace.files' maps zone pairs to trace files written by writeTrace(),
+    {(i, j): path}. A trace is used for both directions of the pair. The
+    samples are 'nw.trace.sample.interval' time units apart and multiplied by
+    'nw.trace.scale'. The traces are memory mapped, so only the pages in use
+    are read. The other pairs use the latency matrix.
+
+    """
+    FILES_KEY = 'nw.trace.files'
+    INTERVAL_KEY = 'nw.trace.sample.interval'
+    SCALE_KEY = 'nw.trace.scale'
+    def __init__(self, configs):
+        interval = configs[TraceLatencyNetwork.INTERVAL_KEY]
+        scale = configs.get(TraceLatencyNetwork.SCALE_KEY, 1.0)
+        if interval <= 0:
+            raise ValueError('trace sample interval %s > 0' %interval)
+        self.traceBuffers = {}      #{(i, j): buffer}
+        for pair, fn in configs[TraceLatencyNetwork.FILES_KEY].iteritems():
+            self.traceBuffers[pair] = TraceBuffer(readTrace(fn),
+                                                  interval, scale)
+        MatrixLatencyNetwork.__init__(self, configs)
+
+    def getCustomPairs(self):
+        return self.traceBuffers.keys()
+
+    def getCustomBuffer(self, i, j):
+        if (i, j) in self.traceBuffers:
+            return self.traceBuffers[(i, j)]
+        return self.traceBuffers.get((j, i))
+
+class BandwidthNetwork(object):
+    """A network with limited bandwidth on top of a latency network.
+
+    Each ordered pair of zones is a link that transmits packets one at a time
+    in FIFO order, at 'nw.bandwidth.within.zone' or 'nw.bandwidth.cross.zone'
+    bytes per time unit(infinite by default). A packet waits for the link,
+    takes pktSize / bandwidth to transmit and then the latency of the
+    underlying network 'nw.bandwidth.base.impl'(IIDLatencyNetwork by
+    default).
+
+    """
+    WITHIN_KEY = 'nw.bandwidth.within.zone'
+    CROSS_KEY = 'nw.bandwidth.cross.zone'
+    BASE_KEY = 'nw.bandwidth.base.impl'
+    NEED_PKT_SIZE = True
+    def __init__(self, configs):
+        baseCls = IIDLatencyNetwork
+        if configs.get(BandwidthNetwork.BASE_KEY) is not None:
+            baseCls = loadClass(configs[BandwidthNetwork.BASE_KEY])
+        self.base = baseCls(configs)
+        self.withinBW = configs.get(BandwidthNetwork.WITHIN_KEY, infinite)
+        self.crossBW = configs.get(BandwidthNetwork.CROSS_KEY, infinite)
+        for bw in (self.withinBW, self.crossBW):
+            if bw != infinite and bw <= 0:
+                raise ValueError('bandwidth %s > 0' %bw)
+        self.linkFree = {}      #{(src zone, dst zone): time}
+        self.linkBusy = {}      #{(src zone, dst zone): transmission time}
+        self.numPkts = 0
+        self.numBytes = 0
+        self.queueTime = 0.0
+
+    def resolve(self, addr):
+        return (addr.split('/')[0], self.base.resolve(addr))
+
+    def getExpectedLatency(self, src, dst):
+        return self.base.getExpectedLatency(src[1], dst[1])
+
+    def getTransmitDelay(self, src, dst, pktSize):
+        """Queue a packet on the link and return its delay."""
+        if src == dst or pktSize <= 0:
+            return 0
+        srcZone = src[0]
+        dstZone = dst[0]
+        bw = self.withinBW if srcZone == dstZone else self.crossBW
+        if bw == infinite:
+            return 0
+        link = (srcZone, dstZone)
+        txTime = float(pktSize) / bw
+        start = max(now(), self.linkFree.get(link, 0))
+        self.linkFree[link] = start + txTime
+        self.linkBusy[link] = self.linkBusy.get(link, 0) + txTime
+        self.numPkts += 1
+        self.numBytes += pktSize
+        self.queueTime += start - now()
+        return start + txTime - now()
+
+    def sendPacket(self, pemproc, src, dst, pktSize):
+        delay = self.getTransmitDelay(src, dst, pktSize)
+        if delay > 0:
+            yield hold, pemproc, delay
+        for step in self.base.sendPacket(pemproc, src[1], dst[1], pktSize):
+            yield step
+
+    def profile(self, results):
+        results.add('nw.num.pkts', self.numPkts)
+        results.add('nw.num.bytes', self.numBytes)
+        if self.numPkts != 0:
+            results.add('nw.queue.time.mean', self.queueTime / self.numPkts)
+        if len(self.linkBusy) > 0:
+            #over the time until the last transmission
+            end = max(self.linkFree.values())
+            results.add('nw.link.utilization.max',
+                        max(self.linkBusy.values()) / end)
+        self.base.profile(results)
+
 #####  TEST  #####
+def testMatrix():
+    config = {
+        'nw.latency.matrix' : {
+            (0, 1) : ('fixed', 50),
+            (0, 2) : ('uniform', -1, {'lb' : 100, 'ub' : 200}),
+            (2, 1) : ('fixed', 150),
+        },
+        'nw.latency.within.zone' : ('fixed', 1),
+    }
+    network = MatrixLatencyNetwork(config)
+    addrs = [network.resolve('zone%s/sn'%i) for i in range(3)]
+    cn = network.resolve('zone0/cn')
+    print network.getLatency(addrs[0], addrs[0])
+    print network.getLatency(addrs[0], cn)
+    for src in addrs:
+        print [network.getLatency(src, dst) for dst in addrs]
+    for src in addrs:
+        print [network.getExpectedLatency(src, dst) for dst in addrs]
+
+def testBandwidth():
+    from SimPy.Simulation import initialize
+    initialize()
+    config = {
+        'nw.latency.within.zone' : ('fixed', 1),
+        'nw.latency.cross.zone' : ('fixed', 100),
+        'nw.bandwidth.cross.zone' : 10,
+    }
+    network = BandwidthNetwork(config)
+    src = network.resolve('zone0/sn')
+    dst = network.resolve('zone1/sn')
+    local = network.resolve('zone0/cn')
+    #packets on the same link queue up
+    for i in range(3):
+        print network.getTransmitDelay(src, dst, 100)
+    print network.getTransmitDelay(dst, src, 100)
+    print network.getTransmitDelay(src, local, 100)
+    print network.getExpectedLatency(src, dst)
+
+def testTrace():
+    import os
+    import tempfile
+    from SimPy.Simulation import initialize
+    initialize()
+    fn = os.path.join(tempfile.mkdtemp(), '0-1.trace')
+    writeTrace(fn, [10, 20, 30, 40])
+    config = {
+        'nw.trace.files' : {(0, 1) : fn},
+        'nw.trace.sample.interval' : 100,
+        'nw.trace.scale' : 2,
+        'nw.latency.within.zone' : ('fixed', 1),
+        'nw.latency.cross.zone' : ('fixed', 100),
+        'num.zones' : 3,
+    }
+    network = TraceLatencyNetwork(config)
+    src = network.resolve('zone0/sn')
+    dst = network.resolve('zone1/sn')
+    other = network.resolve('zone2/sn')
+    print network.getLatency(src, dst), network.getLatency(dst, src)
+    print network.getLatency(src, other)
+    print network.getExpectedLatency(src, dst)
+    os.remove(fn)
+
 def test():
     config = {
         'nw.latency.within.zone' : ('uniform', 10, {'lb' : 5, 'ub' : 15}),
@@ -53,6 +430,16 @@ def test():
     print
     for i in range(10):
         print network.getLatency('zone1/sn', 'zone0/sn')
+    print
+    print network.getExpectedLatency('zone0/sn', 'zone0/sn')
+    print network.getExpectedLatency('zone0/sn', 'zone0/cn')
+    print network.getExpectedLatency('zone1/sn', 'zone0/sn')
+    print
+    testMatrix()
+    print
+    testBandwidth()
+    print
+    testTrace()
 
 def main():
     test()
@@ -12,6 +12,8 @@ from sim.core import Alarm, IDable, Thread, TimeoutException, infinite
 from sim.perf import Profiler
 from sim.rti import RTI, MsgXeiver
 
+PAXOS_MSG_TAGS = ['1a', '1b', '2a', '2b', 'propose', 'skip']
+
 class PaxosRoundType(object):
     NONE, NORMAL, FAST = range(3)
     TYPES = ['none', 'normal', 'fast']
@@ -417,6 +419,7 @@ class Learner(IDable, Thread, MsgXeiver):
         self.instances = {}
         self.iquorums = {}
         self.newInstanceEvent = SimEvent()
+        self.maxInstanceID = -1
         self.total = -1
         self.closed = False
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -442,7 +445,8 @@ class Learner(IDable, Thread, MsgXeiver):
             raise ValueError('init before run')
         while not self.closed:
             self._recv2bMsg()
-            for step in self.waitMsg('2b'):
+            self._recvSkipMsg()
+            for step in self.waitMsg(['2b', 'skip']):
                 yield step
 
     def _recv2bMsg(self):
@@ -464,11 +468,24 @@ class Learner(IDable, Thread, MsgXeiver):
                 finalrnd = self.iquorums[iid].finalrnd
                 finalval = self.iquorums[iid].finalval
                 self.instances[iid] = finalval
+                self.maxInstanceID = max(self.maxInstanceID, iid)
                 del self.iquorums[iid]
                 self.newInstanceEvent.signal()
                 self.logger.debug('%s "LEARNED": iid=%s, rnd=%s, value=%s at %s'
                                   %(self.ID, iid, finalrnd, finalval, now()))
 
+    def _recvSkipMsg(self):
+        for content in self.popContents('skip'):
+            iid, value = content
+            if iid in self.instances:
+                continue
+            self.instances[iid] = value
+            self.maxInstanceID = max(self.maxInstanceID, iid)
+            self.iquorums.pop(iid, None)
+            self.newInstanceEvent.signal()
+            self.logger.debug('%s "SKIPPED": iid=%s, value=%s at %s'
+                              %(self.ID, iid, value, now()))
+
 class Coordinator(IDable, Thread, MsgXeiver):
     """A special proposer for fast rounds with starting round number 0.
 
@@ -637,7 +654,16 @@ class RoundFailException(Exception):
     pass
 
 class Proposer(IDable, Thread, MsgXeiver):
-    """Paxos proposer."""
+    """Paxos proposer.
+
+    If the runner is thrifty, 1a, 2a and fast propose messages are only sent to
+    the closest quorum of acceptors. If the quorum does not respond within the
+    thrifty timeout, the messages are sent to the rest of the acceptors and
+    the proposer stops being thrifty. By default the timeout is a few
+    expected round trips to the farthest acceptor of the quorum, so that a
+    slow or crashed acceptor does not stall the instance.
+
+    """
     def __init__(self, prunner, rnd0, rndstep, acceptors, learner,
                  instanceID, value, timeout=infinite,
                  isFast=False, noPhase1=False):
@@ -663,8 +689,42 @@ class Proposer(IDable, Thread, MsgXeiver):
         self.crnd = rnd0
         self.quorum = None
         self.isSuccess = False
+        self.thrifty = prunner.thrifty
+        self.thriftyDeadline = None
+        self.lastSent = None            #(tag, content, targets)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def _sendToAcceptors(self, size, tag, content):
+        if self.thrifty:
+            targets = self.prunner.closestAcceptors[:size]
+            #resends on timeout do not move the deadline, otherwise a timeout
+            #shorter than the thrifty one would keep us on a stalled quorum
+            if self.thriftyDeadline is None and \
+               self.prunner.thriftyTimeout != infinite:
+                self.thriftyDeadline = now() + self.prunner.thriftyTimeout
+        else:
+            targets = self.acceptors
+        for acc in targets:
+            self.sendMsg(acc, tag, content)
+        self.lastSent = (tag, content, targets)
+
+    def _getThriftyEvent(self):
+        if self.thrifty and self.thriftyDeadline is not None:
+            return Alarm.setOnetime(max(self.thriftyDeadline - now(), 0),
+                                    name='pr-thrifty-tm')
+        return None
+
+    def _fallback(self):
+        #the closest quorum does not respond in time, send to the rest
+        self.thrifty = False
+        tag, content, targets = self.lastSent
+        for acc in self.acceptors:
+            if acc not in targets:
+                self.sendMsg(acc, tag, content)
+        self.prunner.monitor.observe('thrifty_fallback', 1)
+        self.logger.debug('%s thrifty fallback for iid=%s at %s'
+                          %(self.ID, self.instanceID, now()))
+
     def propose(self):
         self.crnd = self.rnd0
         #set pick value
@@ -734,8 +794,8 @@ class Proposer(IDable, Thread, MsgXeiver):
                             self.learner.instances[self.instanceID], now()))
 
     def _send1aMsg(self):
-        for acc in self.acceptors:
-            self.sendMsg(acc, '1a', (self, self.instanceID, self.crnd))
+        self._sendToAcceptors(self.qsize, '1a',
+                              (self, self.instanceID, self.crnd))
 
     def _recv1bMsg(self):
         while True:
@@ -763,8 +823,13 @@ class Proposer(IDable, Thread, MsgXeiver):
             if self.timeout != infinite:
                 timeoutEvent = Alarm.setOnetime(self.timeout, name='pr-1b-tm')
                 events.append(timeoutEvent)
+            thriftyEvent = self._getThriftyEvent()
+            if thriftyEvent is not None:
+                events.append(thriftyEvent)
             events.append(self.learner.newInstanceEvent)
             yield waitevent, self, events
+            if thriftyEvent in self.eventsFired:
+                self._fallback()
             if self.timeout != infinite:
                 if timeoutEvent in self.eventsFired:
                     #no progress, we need to do something
@@ -792,8 +857,8 @@ class Proposer(IDable, Thread, MsgXeiver):
         return pvalue
 
     def _send2aMsg(self, pvalue):
-        for acc in self.acceptors:
-            self.sendMsg(acc, '2a', (self, self.instanceID, self.crnd, pvalue))
+        self._sendToAcceptors(self.qsize, '2a',
+                              (self, self.instanceID, self.crnd, pvalue))
 
     def _checkValue(self):
         while True:
@@ -801,10 +866,15 @@ class Proposer(IDable, Thread, MsgXeiver):
             if self.timeout != infinite:
                 timeoutEvent = Alarm.setOnetime(self.timeout, name='pr-cv-tm')
                 events.append(timeoutEvent)
+            thriftyEvent = self._getThriftyEvent()
+            if thriftyEvent is not None:
+                events.append(thriftyEvent)
             events.append(self.learner.newInstanceEvent)
             yield waitevent, self, events
             if self.instanceID in self.learner.instances:
                 break
+            if thriftyEvent in self.eventsFired:
+                self._fallback()
             if self.timeout != infinite:
                 if timeoutEvent in self.eventsFired:
                     maxrnd = self.learner.getQuorumMaxRnd(self.instanceID)
@@ -828,8 +898,8 @@ class Proposer(IDable, Thread, MsgXeiver):
                 pass
 
     def _sendFastMsg(self):
-        for acc in self.acceptors:
-            self.sendMsg(acc, 'propose', (self, self.instanceID, self.value))
+        self._sendToAcceptors(self.fqsize, 'propose',
+                              (self, self.instanceID, self.value))
 
     def run(self):
         self.stime = now()
@@ -850,11 +920,15 @@ class PaxosResponse(object):
         self.finishedEvent = SimEvent()
         self.instanceID = None
 
+THRIFTY_TIMEOUT_RTTS = 3
+THRIFTY_TIMEOUT_MIN = 1
+
 class ProposerRunner(IDable, Thread, MsgXeiver):
     """A thread that launches proposers."""
     def __init__(self, parent, rnd0, rndstep, acceptors, learner,
                  timeout=infinite, isFast=False, noPhase1=False,
-                 iid0=0, iidstep=1):
+                 iid0=0, iidstep=1, thrifty=False, thriftyTimeout=None,
+                 learners=None):
         IDable.__init__(self, '%s/proprunner'%parent.ID)
         Thread.__init__(self)
         MsgXeiver.__init__(self, parent.inetAddr)
@@ -864,6 +938,7 @@ class ProposerRunner(IDable, Thread, MsgXeiver):
         self.rndstep = rndstep
         self.acceptors = acceptors
         self.learner = learner
+        self.learners = learners
         self.timeout = timeout
         self.isFast = isFast
         self.noPhase1 = noPhase1
@@ -875,10 +950,40 @@ class ProposerRunner(IDable, Thread, MsgXeiver):
         self.responses = {}
         self.iidstep = iidstep
         self.nextInstanceID = iid0 - iidstep
+        self.thrifty = thrifty
+        self.closestAcceptors = None
+        if self.thrifty:
+            self.closestAcceptors = self.getClosestAcceptors()
+            if thriftyTimeout is None:
+                thriftyTimeout = self.getThriftyTimeout()
+        self.thriftyTimeout = thriftyTimeout
         self.closed = False
         self.monitor = Profiler.getMonitor(self.ID)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def getClosestAcceptors(self):
+        #sort acceptors by expected latency, ties are broken by rotating from
+        #our own position so that runners do not all pick the same acceptors
+        network = RTI.networkInstance
+        n = len(self.acceptors)
+        start = self.rnd0 - 1
+        keys = {}
+        for i, acc in enumerate(self.acceptors):
+            latency = network.getExpectedLatency(self.rtiNetAddr,
+                                                 acc.rtiNetAddr)
+            keys[acc] = (latency, (i - start) % n)
+        return sorted(self.acceptors, key=lambda acc: keys[acc])
+
+    def getThriftyTimeout(self):
+        #a few expected round trips to the farthest acceptor we send to
+        network = RTI.networkInstance
+        n = len(self.acceptors)
+        size = getFastQSize(n) if self.isFast else getClassicQSize(n)
+        rtt = max([2 * network.getExpectedLatency(self.rtiNetAddr,
+                                                  acc.rtiNetAddr)
+                   for acc in self.closestAcceptors[:size]])
+        return max(THRIFTY_TIMEOUT_RTTS * rtt, THRIFTY_TIMEOUT_MIN)
+
     def close(self):
         self.closed = True
 
@@ -891,6 +996,22 @@ class ProposerRunner(IDable, Thread, MsgXeiver):
         self.responses[value] = response
         return response
 
+    def addSkip(self, value):
+        """Fill our next instance with @value without a consensus round.
+
+        The value is sent to the learners directly. This is only safe if no
+        other runner proposes in our instances, i.e. with no phase 1 and
+        interleaved instance IDs, and nodes do not fail.
+
+        """
+        if not self.noPhase1 or self.learners is None:
+            raise ValueError('%s cannot skip instances' %self.ID)
+        instanceID = self.getNextInstanceID()
+        for lnr in self.learners:
+            self.sendMsg(lnr, 'skip', (instanceID, value))
+        self.monitor.observe('paxos_skip', 1)
+        return instanceID
+
     def getNextInstanceID(self):
         self.nextInstanceID += self.iidstep
         while self.nextInstanceID in self.learner.instances:
@@ -950,7 +1071,8 @@ class ProposerRunner(IDable, Thread, MsgXeiver):
 
 def initPaxosCluster(pnodes, anodes, coordinatedRecovery,
                      isFast, propPlacement, noPhase1,
-                     interleavedIID, timeout):
+                     interleavedIID, timeout,
+                     thrifty=False, thriftyTimeout=None):
     #on each anode, there is an acceptor
     acceptors = []
     for anode in anodes:
@@ -980,7 +1102,10 @@ def initPaxosCluster(pnodes, anodes, coordinatedRecovery,
     if propPlacement == 'one':
         prunner = ProposerRunner(pnodes[0], 1, len(pnodes),
                                  acceptors, learners[0],
-                                 timeout, isFast, noPhase1)
+                                 timeout, isFast, noPhase1,
+                                 thrifty=thrifty,
+                                 thriftyTimeout=thriftyTimeout,
+                                 learners=learners)
         prunners.append(prunner)
         pnodes[0].paxosPRunner = prunner
         prunner.start()
@@ -989,12 +1114,18 @@ def initPaxosCluster(pnodes, anodes, coordinatedRecovery,
             if not interleavedIID:
                 prunner = ProposerRunner(pnode, i + 1, len(pnodes),
                                          acceptors, learners[i],
-                                         timeout, isFast, noPhase1)
+                                         timeout, isFast, noPhase1,
+                                         thrifty=thrifty,
+                                         thriftyTimeout=thriftyTimeout,
+                                         learners=learners)
             else:
                 prunner = ProposerRunner(pnode, i + 1, len(pnodes),
                                          acceptors, learners[i],
                                          timeout, isFast, noPhase1,
-                                         i, len(pnodes))
+                                         i, len(pnodes),
+                                         thrifty=thrifty,
+                                         thriftyTimeout=thriftyTimeout,
+                                         learners=learners)
             prunners.append(prunner)
             pnode.paxosPRunner = prunner
             prunner.start()
@@ -1002,66 +1133,79 @@ def initPaxosCluster(pnodes, anodes, coordinatedRecovery,
         raise ValueError('unknown proposer placement policy: %s'
                          %propPlacement)
 
-def profilePaxos(logger, monitor):
+def profilePaxos(results, monitor):
     pmean, pstd, phisto, pcount = \
             monitor.getElapsedStats('.*order.consensus')
-    logger.info('order.consensus.time.mean=%s'%pmean)
-    logger.info('order.consensus.time.std=%s'%pstd)
+    results.add('order.consensus.time.mean', pmean)
+    results.add('order.consensus.time.std', pstd)
     #logger.info('order.consensus.time.histo=(%s, %s)'%(phisto))
     totalTime = monitor.getElapsedStats('.*propose_value')
     mean, std, histo, count = totalTime
-    logger.info('paxos.propose.total.time.mean=%s'%mean)
-    logger.info('paxos.propose.total.time.std=%s'%std)
+    results.add('paxos.propose.total.time.mean', mean)
+    results.add('paxos.propose.total.time.std', std)
     #logger.info('paxos.propose.total.time.histo=(%s, %s)'%histo)
     #logger.info('paxos.propose.total.time.count=%s'%count)
     succTime = monitor.getElapsedStats('.*_psucc')
     mean, std, histo, count = succTime
-    logger.info('paxos.propose.succ.time.mean=%s'%mean)
-    logger.info('paxos.propose.succ.time.std=%s'%std)
+    results.add('paxos.propose.succ.time.mean', mean)
+    results.add('paxos.propose.succ.time.std', std)
     succCount = count
     #logger.info('paxos.propose.succ.time.histo=(%s, %s)'%histo)
     #logger.info('paxos.propose.succ.time.count=%s'%count)
     failTime = monitor.getElapsedStats('.*_pfail')
     mean, std, histo, count = failTime
-    logger.info('paxos.propose.fail.time.mean=%s'%mean)
-    logger.info('paxos.propose.fail.time.std=%s'%std)
+    results.add('paxos.propose.fail.time.mean', mean)
+    results.add('paxos.propose.fail.time.std', std)
     failCount = count
     #logger.info('paxos.propose.fail.time.histo=(%s, %s)'%histo)
     #logger.info('paxos.propose.fail.time.count=%s'%count)
-    logger.info('paxos.propose.fail.ratio=%s'%(float(failCount) / (failCount + succCount)))
+    results.add('paxos.propose.fail.ratio',
+                float(failCount) / (failCount + succCount))
     ntries = monitor.getObservedStats('.*ntries')
     mean, std, histo, count = ntries
-    logger.info('paxos.ntries.time.mean=%s'%mean)
-    logger.info('paxos.ntries.time.std=%s'%std)
+    results.add('paxos.ntries.time.mean', mean)
+    results.add('paxos.ntries.time.std', std)
     #logger.info('paxos.ntries.time.histo=(%s, %s)'%histo)
     #logger.info('paxos.ntries.time.count=%s'%count)
     numCol = monitor.getObservedCount('.*has_collision')
     numNCol = monitor.getObservedCount('.*no_collision')
-    logger.info('paxos.num.has.collision=%s'%numCol)
-    logger.info('paxos.num.no.collision=%s'%numNCol)
+    results.add('paxos.num.has.collision', numCol)
+    results.add('paxos.num.no.collision', numNCol)
     if numCol + numNCol != 0:
-        logger.info('paxos.collision.ratio=%s'%(float(numCol) / (numCol + numNCol)))
+        results.add('paxos.collision.ratio',
+                    float(numCol) / (numCol + numNCol))
+    #messages
+    numMsgs = 0
+    for tag in PAXOS_MSG_TAGS:
+        numMsgs += MsgXeiver.msgCounts.get(tag, 0)
+    results.add('paxos.num.msgs', numMsgs)
+    if succCount != 0:
+        results.add('paxos.msgs.per.commit', float(numMsgs) / succCount)
+    numFallback = monitor.getObservedCount('.*thrifty_fallback')
+    results.add('paxos.num.thrifty.fallback', numFallback)
+    numSkip = monitor.getObservedCount('.*paxos_skip')
+    results.add('paxos.num.skip', numSkip)
     #interval
     times, fstarts = monitor.getObserved('.*pfail.start')
     times, sstarts = monitor.getObserved('.*psucc.start')
     starts = fstarts + sstarts
-    _logIntervalStats(logger, fstarts, 'paxos.fail.interval')
-    _logIntervalStats(logger, sstarts, 'paxos.succ.interval')
-    _logIntervalStats(logger, starts, 'paxos.interval')
+    _addIntervalStats(results, fstarts, 'paxos.fail.interval')
+    _addIntervalStats(results, sstarts, 'paxos.succ.interval')
+    _addIntervalStats(results, starts, 'paxos.interval')
 
-def _logIntervalStats(logger, stimes, key):
+def _addIntervalStats(results, stimes, key):
     if len(stimes) == 0:
-        logger.info('%s.empty=True'%key)
+        results.add('%s.empty'%key, True)
         return
     stimes = sorted(stimes)
     intervals = [stimes[0]]
     for i in range(1, len(stimes)):
         intervals.append(stimes[i] - stimes[i - 1])
-    logger.info('%s.mean=%s'%(key, numpy.mean(intervals)))
-    logger.info('%s.std=%s'%(key, numpy.std(intervals)))
+    results.add('%s.mean'%key, numpy.mean(intervals))
+    results.add('%s.std'%key, numpy.std(intervals))
     freqs, bins = numpy.histogram(intervals)
-    logger.info('%s.histo=(%s, %s)'%(key, list(freqs), list(bins)))
-    logger.info('%s.count=%s'%(key, len(intervals)))
+    results.add('%s.histo'%key, (list(freqs), list(bins)))
+    results.add('%s.count'%key, len(intervals))
 
 
 ##### TEST #####
@@ -1252,6 +1396,61 @@ def testMultiplePaxosInterleavedIID():
     profile()
     logging.info('\n===== END TEST MULTIPLE PAXOS INTERLEAVEDIID =====\n\n')
 
+def testMultiplePaxosThrifty():
+    logging.info('\n\n===== START TEST MULTIPLE PAXOS THRIFTY =====\n')
+    Profiler.clear()
+    pnodes, anodes, values = initTest()
+    initPaxosCluster(pnodes, anodes, False, False, 'all', True, True, 1500,
+                     thrifty=True, thriftyTimeout=1000)
+    prunners = []
+    learners = []
+    for pnode in pnodes:
+        try:
+            prunners.append(pnode.paxosPRunner)
+        except AttributeError:
+            pass
+        learners.append(pnode.paxosLearner)
+    testrunner = TestRunner(values, prunners, THRESHOLD, INTERVAL)
+    testrunner.start()
+    simulate(until=10000000)
+    verifyResult(learners)
+    profile()
+    logging.info('\n===== END TEST MULTIPLE PAXOS THRIFTY =====\n\n')
+
+def testMultiplePaxosThriftyFallback():
+    logging.info('\n\n===== START TEST MULTIPLE PAXOS THRIFTY FALLBACK =====\n')
+    Profiler.clear()
+    pnodes, anodes, values = initTest()
+    allValues = set(values)
+    #the default thrifty timeout
+    initPaxosCluster(pnodes, anodes, False, False, 'all', True, True, 1500,
+                     thrifty=True)
+    prunners = []
+    learners = []
+    for pnode in pnodes:
+        try:
+            prunners.append(pnode.paxosPRunner)
+        except AttributeError:
+            pass
+        learners.append(pnode.paxosLearner)
+    #crash an acceptor that is in the closest quorum of some runners
+    crashed = anodes[0].paxosAcceptor
+    crashed.close()
+    assert any([crashed in prunner.closestAcceptors[:4]
+                for prunner in prunners])
+    for prunner in prunners:
+        assert prunner.thriftyTimeout != infinite
+    testrunner = TestRunner(values, prunners, THRESHOLD, INTERVAL)
+    testrunner.start()
+    simulate(until=10000000)
+    verifyResult(learners)
+    #every value is learned, the stalled quorums fell back to the rest
+    assert allValues.issubset(set(learners[0].instances.values()))
+    rootMon = Profiler.getMonitor('/')
+    assert rootMon.getObservedCount('.*thrifty_fallback') > 0
+    profile()
+    logging.info('\n===== END TEST MULTIPLE PAXOS THRIFTY FALLBACK =====\n\n')
+
 def testFastPaxosCoordinated():
     logging.info('\n\n===== START TEST FAST PAXOS COORDINATED=====\n')
     Profiler.clear()
@@ -1304,6 +1503,8 @@ def test():
     testClassicPaxosInterleavedIID()
     testMultiplePaxos()
     testMultiplePaxosInterleavedIID()
+    testMultiplePaxosThrifty()
+    testMultiplePaxosThriftyFallback()
     testFastPaxosCoordinated()
     testFastPaxosUncoordinated()
 
@@ -1,4 +1,6 @@
+import json
 import logging
+import math
 import numpy
 import random
 import re
@@ -86,6 +88,14 @@ class StateMonitor(IDable):
     def getElapsedCount(self, key):
         return len(self.getElapsed(key))
 
+    def getStopped(self, key):
+        times = []
+        for i in range(len(self.events)):
+            name, state = self.events[i]
+            if state == StateMonitor.STOP and re.match(key, name):
+                times.append(self.timeline[i])
+        return times
+
     def getObserved(self, key):
         times = []
         observed = []
@@ -235,6 +245,181 @@ class Profiler(object):
     def _clear(self):
         self.monitorTree = SMTree()
 
+class Results(object):
+    """Metrics of a simulation run.
+
+    The profile of a system adds its metrics with add(key, value). Metrics are
+    also logged as key=value, so the log stays as it was. The metrics are
+    written to a file as a json line of {'config' : ..., 'result' : ...}.
+
+    """
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.metrics = {}
+        self.keys = []
+
+    def add(self, key, value):
+        if key not in self.metrics:
+            self.keys.append(key)
+        self.metrics[key] = value
+        if self.logger is not None:
+            self.logger.info('%s=%s'%(key, value))
+
+    def get(self, key, default=None):
+        return self.metrics.get(key, default)
+
+    def write(self, fn, config=None, mode='w'):
+        fh = open(fn, mode)
+        fh.write(dumpResult(config, self.metrics))
+        fh.write('\n')
+        fh.close()
+
+def getQuantile(p, dof=None):
+    """The @p quantile of student t with @dof, or of normal if dof is None.
+
+    Falls back to normal without scipy.
+
+    """
+    if dof is not None:
+        try:
+            from scipy.stats import t
+            return t.ppf(p, dof)
+        except ImportError:
+            pass
+    #bisect the normal cdf
+    lb, ub = -10.0, 10.0
+    while ub - lb > 1e-9:
+        mid = (lb + ub) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            lb = mid
+        else:
+            ub = mid
+    return (lb + ub) / 2
+
+def getMSERTruncation(samples, batchSize=5):
+    """The number of warm-up samples by the MSER rule.
+
+    The samples are averaged in batches of @batchSize, 5 for MSER-5, and the
+    truncation minimizes the squared error of the mean of the batches left,
+    divided by their number squared. Only the first half is searched, as the
+    statistic is unstable with few batches left. Returns None if the minimum
+    is at the end of the first half, as the samples may still be transient.
+
+    """
+    num = len(samples) / batchSize
+    if num < 2:
+        return 0
+    batches = numpy.reshape(numpy.asarray(samples[:num * batchSize],
+                                          dtype=float), (num, batchSize))
+    z = batches.mean(axis=1)
+    #sums of z[d:] and z[d:]**2 for every d
+    s1 = numpy.cumsum(z[::-1])[::-1]
+    s2 = numpy.cumsum((z * z)[::-1])[::-1]
+    left = numpy.arange(num, 0, -1, dtype=float)
+    mser = (s2 - s1 * s1 / left) / (left * left)
+    bound = num / 2
+    d = int(numpy.argmin(mser[:bound + 1]))
+    if d == bound:
+        return None
+    return d * batchSize
+
+class StoppingRule(object):
+    """Batch means stopping rule on response times.
+
+    Response times are added as txns depart. Every
+    'simulation.stop.check.intvl' samples after 'simulation.stop.min.txns',
+    the warm-up is truncated by MSER-5 and the rest is split into
+    'simulation.stop.num.batches' batches.
+    The rule is met when the half width of the 'simulation.stop.confidence'
+    interval of the mean is within 'simulation.stop.rel.precision' of the mean.
+
+    """
+    PRECISION_KEY = 'simulation.stop.rel.precision'
+    def __init__(self, configs):
+        self.precision = configs[StoppingRule.PRECISION_KEY]
+        self.confidence = configs.get('simulation.stop.confidence', 0.95)
+        self.numBatches = configs.get('simulation.stop.num.batches', 20)
+        self.checkIntvl = configs.get('simulation.stop.check.intvl', 100)
+        self.minSamples = configs.get('simulation.stop.min.txns', 200)
+        if not 0 < self.confidence < 1:
+            raise ValueError('confidence = %s not in (0, 1)'%self.confidence)
+        if self.numBatches < 2:
+            raise ValueError('num batches = %s < 2'%self.numBatches)
+        self.quantile = getQuantile(1 - (1 - self.confidence) / 2.0,
+                                    self.numBatches - 1)
+        self.samples = []
+        self.lastCheck = 0
+        self.met = False
+        self.warmup = 0
+        self.mean = None
+        self.halfWidth = None
+
+    @classmethod
+    def isEnabled(cls, configs):
+        return configs.get(StoppingRule.PRECISION_KEY) is not None
+
+    def add(self, sample):
+        """Add a sample, and return True if the rule is met."""
+        self.samples.append(sample)
+        if self.met:
+            return True
+        if len(self.samples) < max(self.minSamples, self.lastCheck +
+                                   self.checkIntvl):
+            return False
+        self.lastCheck = len(self.samples)
+        self.check()
+        return self.met
+
+    def check(self):
+        warmup = getMSERTruncation(self.samples)
+        if warmup is None:
+            return
+        self.warmup = warmup
+        steady = self.samples[self.warmup:]
+        size = len(steady) / self.numBatches
+        if size == 0:
+            return
+        #the oldest samples left over are dropped with the warm-up
+        steady = steady[len(steady) - size * self.numBatches:]
+        means = numpy.reshape(numpy.asarray(steady, dtype=float),
+                              (self.numBatches, size)).mean(axis=1)
+        self.mean = means.mean()
+        self.halfWidth = (self.quantile * means.std(ddof=1) /
+                          math.sqrt(self.numBatches))
+        self.met = self.halfWidth <= self.precision * abs(self.mean)
+
+    def profile(self, results):
+        results.add('stop.met', self.met)
+        results.add('stop.num.txns', len(self.samples))
+        results.add('stop.warmup.txns', self.warmup)
+        results.add('stop.res.mean', self.mean)
+        results.add('stop.res.halfwidth', self.halfWidth)
+
+def _toJson(value):
+    #keys are strings and numpy values plain python values in json
+    if isinstance(value, dict):
+        return dict([(k if isinstance(k, basestring) else repr(k), _toJson(v))
+                     for k, v in value.iteritems()])
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_toJson(v) for v in value]
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if value is None or isinstance(value, (basestring, int, long, float)):
+        return value
+    return repr(value)
+
+def dumpResult(config, result):
+    """The json line of a run."""
+    return json.dumps({'config' : _toJson(config), 'result' : _toJson(result)},
+                      sort_keys=True)
+
+def loadResult(line):
+    """The (config, result) of a json line written by dumpResult."""
+    entry = json.loads(line)
+    return entry['config'], entry['result']
+
 #####  TEST #####
 def test():
     names = [
@@ -284,8 +469,29 @@ def test():
     print '============='
     print '%r' %Profiler.get().monitorTree
 
+def testStoppingRule():
+    print '===== test stopping rule ====='
+    assert abs(getQuantile(0.975) - 1.96) < 1e-3
+    assert abs(getQuantile(0.975, 19) - 2.093) < 1e-3
+    #a transient of 500 samples from 1000 down to the steady mean of 100
+    samples = [100 + 900 * (1 - i / 500.0) for i in range(500)]
+    samples += [random.expovariate(0.01) for i in range(5000)]
+    warmup = getMSERTruncation(samples)
+    assert 300 <= warmup <= 700, warmup
+    rule = StoppingRule({'simulation.stop.rel.precision' : 0.05})
+    count = 0
+    for sample in samples:
+        count += 1
+        if rule.add(sample):
+            break
+    assert rule.met and count < len(samples), count
+    assert rule.warmup >= 300, rule.warmup
+    assert abs(rule.mean - 100) < 3 * rule.halfWidth, rule.mean
+    print 'test stopping rule passed'
+
 def main():
     test()
+    testStoppingRule()
 
 if __name__ == '__main__':
     main()
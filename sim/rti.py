@@ -1,8 +1,10 @@
 from SimPy.Simulation import SimEvent
 from SimPy.Simulation import initialize, simulate, now
-from SimPy.Simulation import waitevent, hold
+from SimPy.Simulation import waitevent, hold, passivate
 
 from sim.core import infinite, Alarm, RetVal, Thread, TimeoutException
+from sim.fault import FaultInjector
+from sim.importutils import loadClass
 from sim.network import IIDLatencyNetwork
 
 class RTI(object):
@@ -30,6 +32,11 @@ class RTI(object):
     Before using this interface, it must be initialized using:
         RTI.initialize(configs)
 
+    The network model is IIDLatencyNetwork unless 'nw.impl' names another one.
+    The inet address of an object is resolved by the network when the object
+    is created. If 'fault.schedule' is set, messages are lost or resent
+    according to the FaultInjector.
+
     To send an invocation request and returns immediately, use:
         self.invoke(remoteObject.function, args).rtiCall(**kargs)
 
@@ -40,11 +47,22 @@ class RTI(object):
     **kargs includes:
         fwPktSize, bwPktSize and timeout
 
+    Packet sizes are in bytes. Only networks with NEED_PKT_SIZE use them, so
+    callers should estimate them only in that case.
+
     """
     networkInstance = None
+    faultInjector = None
     @classmethod
     def initialize(cls, configs):
-        RTI.networkInstance = IIDLatencyNetwork(configs)
+        networkCls = IIDLatencyNetwork
+        if configs.get('nw.impl') is not None:
+            networkCls = loadClass(configs['nw.impl'])
+        RTI.networkInstance = networkCls(configs)
+        RTI.faultInjector = None
+        if configs.get(FaultInjector.SCHEDULE_KEY) is not None:
+            RTI.faultInjector = FaultInjector(configs)
+        MsgXeiver.msgCounts = {}
 
     class AnonymousThread(Thread):
         """
@@ -63,26 +81,56 @@ class RTI(object):
             self.roundtrip = False
             self.fwPktSize = 0
             self.bwPktSize = 0
+            self.lost = False
+
+        def transfer(self, src, srcAddr, dst, dstAddr, pktSize):
+            #send a packet through network, resend it if lost and the fault
+            #injector says so, and set self.lost if it never arrives
+            faults = RTI.faultInjector
+            while True:
+                fault = None
+                if faults is not None:
+                    fault = faults.getDropFault(src, dst)
+                if fault is None:
+                    for step in RTI.networkInstance.sendPacket(
+                        self, srcAddr, dstAddr, pktSize):
+                        yield step
+                    if faults is not None:
+                        fault = faults.getCrashFault(dst)
+                if fault is None:
+                    self.lost = False
+                    return
+                delay = faults.getResendDelay(fault)
+                if delay is None:
+                    self.lost = True
+                    return
+                yield hold, self, delay
 
         def run(self):
-            srcAddr = self.parent.inetAddr
-            dstAddr = self.rm.im_self.inetAddr
-            #send a packet through network
-            for step in RTI.networkInstance.sendPacket(
-                self, srcAddr, dstAddr, self.fwPktSize):
+            srcAddr = self.parent.rtiNetAddr
+            dstAddr = self.rm.im_self.rtiNetAddr
+            src = self.parent.inetAddr
+            dst = self.rm.im_self.inetAddr
+            for step in self.transfer(src, srcAddr, dst, dstAddr,
+                                      self.fwPktSize):
                 yield step
-            #invoke the remote object's method
-            if self.roundtrip:
-                self.parent.rtiRVal.set(self.rm(*self.args))
-            else:
-                self.rm(*self.args)
-            if self.roundtrip:
-                for step in RTI.networkInstance.sendPacket(
-                    self, dstAddr, srcAddr, self.bwPktSize):
+            if not self.lost:
+                #invoke the remote object's method
+                if self.roundtrip:
+                    self.parent.rtiRVal.set(self.rm(*self.args))
+                else:
+                    self.rm(*self.args)
+            if self.roundtrip and not self.lost:
+                for step in self.transfer(dst, dstAddr, src, srcAddr,
+                                          self.bwPktSize):
                     yield step
+            if self.roundtrip and self.lost:
+                #the caller never gets the return
+                yield passivate, self
 
     def __init__(self, inetAddr):
         self.inetAddr = inetAddr
+        self.rtiNetAddr = RTI.networkInstance.resolve(inetAddr)
         self._thread = None
         self.rtiRVal = RetVal()
 
@@ -110,6 +158,31 @@ class RTI(object):
                     'rm=%s, args=%s, timeout=%s'
                     %(self._thread.rm, self._thread.args, timeout))
 
+REF_PKT_SIZE = 8            #size of a number or a reference
+
+def getPktSize(content):
+    """Estimate the size of a message content.
+
+    Objects with a pktSize attribute tell their own size; containers are the
+    sum of their elements; other objects are sent as references.
+
+    """
+    if hasattr(content, 'pktSize'):
+        return content.pktSize
+    if isinstance(content, basestring):
+        return len(content)
+    if isinstance(content, dict):
+        size = 0
+        for key, val in content.iteritems():
+            size += getPktSize(key) + getPktSize(val)
+        return size
+    if isinstance(content, (tuple, list, set, frozenset)):
+        size = 0
+        for c in content:
+            size += getPktSize(c)
+        return size
+    return REF_PKT_SIZE
+
 class DLLNode(object):
     """A double-linked list node for lru cache."""
     def __init__(self, this):
@@ -171,7 +244,10 @@ class MsgXeiver(RTI):
         send(tag, content)      --  send a message to other
         check(tag)              --  check if messages with @tag has arrived
         wait(tag)               --  wait until some message with @tag arrived
+
+    The number of messages sent with each tag is counted in msgCounts.
     """
+    msgCounts = {}                     #{tag: count}
     def __init__(self, inetAddr, maxntags=1000, tagbufsize=1000):
         RTI.__init__(self, inetAddr)
         self.rtiMessages = {}          #{tag: [content]}
@@ -215,8 +291,14 @@ class MsgXeiver(RTI):
             del self.rtiTagNodes[toRemove]
             del self.rtiMessages[toRemove]
 
-    def sendMsg(self, other, tag, content):
-        self.invoke(other._put, tag, content).rtiCall()
+    def sendMsg(self, other, tag, content, pktSize=None):
+        counts = MsgXeiver.msgCounts
+        counts[tag] = counts.get(tag, 0) + 1
+        if pktSize is None:
+            pktSize = 0
+            if RTI.networkInstance.NEED_PKT_SIZE:
+                pktSize = getPktSize(content)
+        self.invoke(other._put, tag, content).rtiCall(fwPktSize=pktSize)
 
     def checkMsg(self, tags):
         if not (isinstance(tags, list) or isinstance(tags, tuple)):
@@ -7,30 +7,32 @@ import time
 from SimPy.Simulation import initialize, simulate, now
 
 from sim.configure import Configuration
+from sim.core import BThread
 from sim.parse import CustomArgsParser
 from sim.importutils import loadClass
+from sim.locking import Lockable, FCFSAlgo
+from sim.perf import Profiler
 from sim.rti import RTI
 from sim.verify import Verifier
 
-def main():
-    start = time.time()
-    parser = CustomArgsParser(optFlags=['--verify'])
-    parser.parse(sys.argv[1:])
-    if len(parser.getPosArgs()) < 1:
-        print 'python sim.py <config dir> --verify'
-        sys.exit(-1)
-    path = parser.getPosArg(0)
-    configFile = '%s/__config__' %path
-    configs = Configuration()
-    configs.read(configFile)
+RESULT_FILE = '__result__'
 
-    if parser.getOption('--verify'):
-        configs['system.should.verify'] = True
+def reset():
+    """Reset the states shared by simulation runs in one process."""
+    Profiler.clear()
+    BThread.wait_graph = {}
+    Lockable.WakeupAlgo = FCFSAlgo
 
-    #simulation init
-    #logging.basicConfig(level=logging.DEBUG)
-    logging.config.fileConfig('%s/__logcfg__' %path)
+def run(configs, verify=False, resultFile=None):
+    """Simulate @configs and return the profiled metrics as a dict.
+
+    The result has 'verified' set if @verify. If @resultFile is given, the
+    configs and the result are written to it as a json line. Runs in the same
+    process are independent of each other.
+
+    """
     logger = logging.getLogger(__name__)
+    reset()
     #simpy initialize
     initialize()
     #system initialize
@@ -50,21 +52,51 @@ def main():
     logger.info('\n#####  END  #####\n')
 
     ##verify
+    verified = None
     try:
-        if parser.getOption('--verify'):
+        if verify:
             logger.info('\n#####  START VERIFICATION  #####\n')
             v = Verifier()
             v.check(system)
+            verified = True
             logger.info('VERIFICATION SUCCEEDS\n')
             logger.info('\n#####  END  #####\n')
     except:
+        verified = False
         logger.error('Verification failed.')
 
     #get profile
     logger.info('\n#####  PROFILING RESULTS  #####\n')
+    if verified is not None:
+        system.results.add('verified', verified)
     system.profile()
     #system.printMonitor()
     logger.info('\n#####  END  #####\n')
+    if resultFile is not None:
+        system.results.write(resultFile, getattr(configs, 'conf', configs))
+    return system.results.metrics
+
+def main():
+    start = time.time()
+    parser = CustomArgsParser(optFlags=['--verify'])
+    parser.parse(sys.argv[1:])
+    if len(parser.getPosArgs()) < 1:
+        print 'python sim.py <config dir> --verify'
+        sys.exit(-1)
+    path = parser.getPosArg(0)
+    configFile = '%s/__config__' %path
+    configs = Configuration()
+    configs.read(configFile)
+
+    verify = bool(parser.getOption('--verify'))
+    if verify:
+        configs['system.should.verify'] = True
+
+    #simulation init
+    #logging.basicConfig(level=logging.DEBUG)
+    logging.config.fileConfig('%s/__logcfg__' %path)
+    logger = logging.getLogger(__name__)
+    run(configs, verify, '%s/%s'%(path, RESULT_FILE))
 
     end = time.time()
     logger.info('\n#####  SIMULATION TIME: %s seconds  #####\n' %(end - start))
@@ -9,10 +9,11 @@ from SimPy.Simulation import now, initialize, simulate, stopSimulation
 from SimPy.Simulation import waitevent, hold, request, release
 
 from rintvl import RandInterval
+from sim.clock import Clock
 from sim.core import Alarm, IDable, Thread, infinite
 from sim.data import Dataset
 from sim.paxos import initPaxosCluster
-from sim.perf import Profiler
+from sim.perf import Profiler, Results, StoppingRule
 from sim.rti import RTI
 
 class BaseSystem(Thread):
@@ -32,6 +33,7 @@ class BaseSystem(Thread):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.configs = configs
         self.monitor = Profiler.getMonitor('system')
+        self.results = Results(self.logger)
         #system components
         self.cnodes = []
         self.snodes = {}
@@ -49,6 +51,11 @@ class BaseSystem(Thread):
         self.numTxnsDepart = 0
         self.numTxnsLoss = 0
         self.state = None
+        #for stopping when the response time mean is precise enough
+        self.stopRule = None
+        if StoppingRule.isEnabled(configs):
+            self.stopRule = StoppingRule(configs)
+        self.arriveTimes = {}
         #for print progress
         self.simThr = self.configs.get('sim.progress.print.intvl.thr', 1000)
         self.realThr = self.configs.get('real.progress.print.intvl.thr', 10)
@@ -101,6 +108,8 @@ class BaseSystem(Thread):
     #txn arrive and depart metrics, called by cnodes
     def onTxnArrive(self, txn):
         self.txnsRunning.add(txn)
+        if self.stopRule is not None:
+            self.arriveTimes[txn] = now()
         self.monitor.start('%s.%s'%(BaseSystem.TXN_EXEC_KEY_PREFIX, txn.ID))
         self.logger.debug('Txn %s arrive in system at %s, progress=A:%s/%s'
                          %(txn.ID, now(),
@@ -125,6 +134,13 @@ class BaseSystem(Thread):
                               %(txn.ID, now(),
                                 self.numTxnsDepart, self.numTxnsSched))
             self.txnsRunning.remove(txn)
+            if self.stopRule is not None:
+                met = self.stopRule.met
+                elapsed = now() - self.arriveTimes.pop(txn)
+                if self.stopRule.add(elapsed) and not met:
+                    self.logger.info(
+                        'system: stopping rule met after %s txns at %s'
+                        %(len(self.stopRule.samples), now()))
 
     #system run, called by the sim main
     def run(self):
@@ -134,7 +150,7 @@ class BaseSystem(Thread):
         #the big while loop
         while True:
             if self.state == BaseSystem.RUNNING:
-                if not self.txnsToRun.empty():
+                if not self.txnsToRun.empty() and not self.isStopRuleMet():
                     #simulate txn arrive as scheduled
                     at, txn = self.txnsToRun.get()
                     while now() < at:
@@ -142,6 +158,9 @@ class BaseSystem(Thread):
                         yield waitevent, self, nextArrive
                         if now() < at:
                             continue
+                        if self.isStopRuleMet():
+                            #the txns left are not needed
+                            break
                         self.numTxnsArrive += 1
                         if self.allowOverLoad or \
                            len(self.txnsRunning) < self.maxNumTxns:
@@ -175,6 +194,9 @@ class BaseSystem(Thread):
                 sleep = Alarm.setOnetime(self.simThr, 'closing')
                 yield waitevent, self, sleep
 
+    def isStopRuleMet(self):
+        return self.stopRule is not None and self.stopRule.met
+
     def startupNodes(self):
         for cnode in self.cnodes:
             cnode.start()
@@ -185,7 +207,19 @@ class BaseSystem(Thread):
 
     def startupPaxos(self):
         initPaxosCluster(
-            self.cnodes, self.cnodes, False, False, 'all', True, True, infinite)
+            self.cnodes, self.cnodes, False, False, 'all', True, True, infinite,
+            **self.getThriftyKargs())
+
+    def getThriftyKargs(self):
+        """The thrifty options of initPaxosCluster from the configs.
+
+        The thrifty timeout is derived from the network if not configured.
+
+        """
+        return {
+            'thrifty' : self.configs.get('paxos.thrifty', False),
+            'thriftyTimeout' : self.configs.get('paxos.thrifty.timeout', None),
+        }
 
     def printProgress(self):
         #do not overflood the output, so we only print when both the
@@ -206,17 +240,24 @@ class BaseSystem(Thread):
         resMean, resStd, resHisto, resCount = \
                 Profiler.getMonitor('system').getElapsedStats(
                     '.*%s'%BaseSystem.TXN_EXEC_KEY_PREFIX)
-        self.logger.info('res.mean=%s'%resMean)
-        self.logger.info('res.std=%s'%resStd)
+        self.results.add('res.mean', resMean)
+        self.results.add('res.std', resStd)
         #self.logger.info('res.histo=(%s,%s)'%(resHisto))
         loss = float(Profiler.getMonitor('system').getObservedCount(
             '.*%s'%BaseSystem.TXN_LOSS_KEY_PREFIX))
         lossRatio = loss / (resCount + loss)
-        self.logger.info('loss.ratio=%s'%lossRatio)
+        self.results.add('loss.ratio', lossRatio)
         loadMean, loadStd, loadHisto, loadCount = \
                 Profiler.getMonitor('/').getObservedStats('.*.num.txns')
-        self.logger.info('load.mean=%s'%loadMean)
-        self.logger.info('load.std=%s'%loadStd)
+        self.results.add('load.mean', loadMean)
+        self.results.add('load.std', loadStd)
+        if self.stopRule is not None:
+            self.stopRule.profile(self.results)
+        RTI.networkInstance.profile(self.results)
+        if RTI.faultInjector is not None:
+            commitTimes = Profiler.getMonitor('system').getStopped(
+                '.*%s'%BaseSystem.TXN_EXEC_KEY_PREFIX)
+            RTI.faultInjector.profile(self.results, commitTimes)
         #self.logger.info('load.histo=(%s,%s)'%(loadHisto))
 
     def printMonitor(self):
@@ -241,6 +282,7 @@ class ClientNode(IDable, Thread, RTI):
         self.txnsRunning = set([])
         self.shouldClose = False
         self.closeEvent = SimEvent()
+        self.clock = Clock(configs)
         #paxos entities
         self.paxosPRunner = None
         self.paxosAcceptor = None
@@ -334,6 +376,7 @@ class StorageNode(IDable, Thread, RTI):
         self.runningThreads = set([])
         self.closeEvent = SimEvent()
         self.newTxnEvent = SimEvent()
+        self.clock = Clock(configs)
 
     @property
     def load(self):
@@ -352,6 +395,10 @@ class StorageNode(IDable, Thread, RTI):
         self.newTxns.extend(txns)
         self.newTxnEvent.signal()
 
+    #notify txn finish, called by the txn starter
+    def onTxnFinish(self, txn):
+        self.cnode.onTxnDepart(txn)
+
     def newTxnRunner(self, txn):
         class DefaultTxnRunner(Thread):
             def __init__(self, snode, txn):
@@ -404,7 +451,7 @@ class StorageNode(IDable, Thread, RTI):
             #clean up
             self.snode.txnsRunning.remove(self.txn)
             self.snode.runningThreads.remove(self)
-            self.snode.cnode.onTxnDepart(self.txn)
+            self.snode.onTxnFinish(self.txn)
 
     def run(self):
         #the big while loop
@@ -9,6 +9,7 @@ from sim.locking import LockThread
 
 class Action(object):
     READ, WRITE = ('r', 'w')
+    PKT_SIZE = 16           #label and item id
     def __init__(self, label, itemID, attr=None):
         self.label = label
         self.itemID = itemID
@@ -24,6 +25,7 @@ class Action(object):
         return '(%s %s)' %(self.label, self.itemID)
 
 class Transaction(IDable):
+    PKT_SIZE = 16           #header
     def __init__(self, ID, zoneID, actions, config):
         IDable.__init__(self, 'txn%s'%ID)
         self.zoneID = zoneID
@@ -32,6 +34,25 @@ class Transaction(IDable):
         self.config = config
         for action in actions:
             self.gids.add(action.itemID.gid)
+        self._pktSize = None
+
+    @property
+    def pktSize(self):
+        """Size of the txn in a message.
+
+        Writes carry a value of 'write.value.size' bytes set in the txn class
+        config.
+
+        """
+        if self._pktSize is None:
+            valueSize = self.config.get('write.value.size', 0)
+            size = Transaction.PKT_SIZE
+            for action in self.actions:
+                size += Action.PKT_SIZE
+                if action.isWrite():
+                    size += valueSize
+            self._pktSize = size
+        return self._pktSize
 
     def __repr__(self):
         return ('%s{(%s) [%s] [%s]}'
@@ -131,7 +152,7 @@ class TxnRunner(LockThread):
                 for step in self.begin():
                     yield step
                 #read and write
-                for action in self.txn.actions:
+                for action in self.getActions():
                     if action.isRead():
                         for step in self.read(action.itemID, action.attr):
                             yield step
@@ -169,13 +190,19 @@ class TxnRunner(LockThread):
             except TimeoutException as e:
                 self.monitor.observe('abort.timeout', 0)
                 self.logger.debug(
-                    '%s aborted because of timeout on %r with state %s'
-                    %(e.args[0], e.args[1]))
+                    '%s aborted because of timeout on %r with state %s at %s'
+                    %(self.ID, e.args, TxnRunner.STATESTR[self.state], now()))
+                self.Aborting()
+                for step in self.abort():
+                    yield step
         for step in self.cleanup():
             yield step
         self.Finished()
 
     #intermediate methods to override
+    def getActions(self):
+        return self.txn.actions
+
     def prepare(self):
         yield hold, self
 